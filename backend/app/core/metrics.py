@@ -0,0 +1,185 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Sequence
+
+# Seconds; roughly doubling from 1 ms to 10 s.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    # Fixed-bucket histogram, safe to observe from several threads.
+    # Buckets are upper bounds; snapshots are cumulative like Prometheus.
+    __slots__ = ("buckets", "_counts", "_sum", "_lock")
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        cumulative = {}
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            cumulative[str(bound)] = running
+        running += counts[-1]
+        cumulative["+Inf"] = running
+
+        return {"buckets": cumulative, "count": running, "sum": total}
+
+    def render(self, name: str, labels: str = "") -> list[str]:
+        # Prometheus text exposition lines; labels is e.g. 'route="/x"'.
+        snapshot = self.snapshot()
+        sep = "," if labels else ""
+        lines = [
+            f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}'
+            for bound, count in snapshot["buckets"].items()
+        ]
+        braces = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{braces} {snapshot['sum']}")
+        lines.append(f"{name}_count{braces} {snapshot['count']}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+class CounterVec:
+    # Counters keyed by label values, e.g. purchases by outcome.
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            labels = _labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+class HistogramVec:
+    # One Histogram per combination of label values, created on first use.
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._children: dict[tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *labelvalues) -> Histogram:
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float, *labelvalues) -> None:
+        self.labels(*labelvalues).observe(value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labelvalues, child in sorted(self._children.items()):
+            lines += child.render(self.name, _labels(self.labelnames, labelvalues))
+        return lines
+
+
+class Registry:
+    # What GET /metrics renders: the metrics made through it plus collector
+    # functions that return exposition lines for stats kept elsewhere.
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[Callable[[], list[str]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> CounterVec:
+        metric = CounterVec(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> HistogramVec:
+        metric = HistogramVec(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, collect: Callable[[], list[str]]) -> None:
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collect in self._collectors:
+            lines += collect()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds",
+    "Time from request to the end of the response body.",
+    ("method", "route", "status"),
+)
+
+PURCHASES = registry.counter(
+    "vending_purchases_total",
+    "Purchases by outcome.",
+    ("outcome",),
+)
+
+# Seconds; a change decision takes microseconds.
+CHANGE_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01,
+)
+
+CHANGE_SECONDS = registry.histogram(
+    "vending_change_engine_seconds",
+    "Time to decide a purchase and its change.",
+    ("engine",),
+    CHANGE_BUCKETS,
+)
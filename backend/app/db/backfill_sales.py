@@ -0,0 +1,105 @@
+from sqlalchemy import cast, func, literal, literal_column, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models.models import (
+    ProductSalesModel,
+    SalesBucketModel,
+    TransactionLogModel,
+)
+
+SALES = TransactionLogModel.__table__.c
+SOLD = (
+    SALES.status == "success",
+    SALES.machine_id.is_not(None),
+    SALES.product_id.is_not(None),
+)
+
+
+def _backfill_once(db: Session, model, columns: list[str], rows) -> bool:
+    # Fills `model` from transaction_logs the first time it runs; returns
+    # False when the table already has rows. The table lock holds off
+    # purchases (they upsert into it) until the totals are in, so none is
+    # counted twice or missed, and workers starting up concurrently wait
+    # for the first one and then skip.
+    table = model.__tablename__
+    db.execute(text(f"LOCK TABLE {table} IN EXCLUSIVE MODE"))
+
+    if db.execute(select(literal(1)).select_from(model).limit(1)).first():
+        db.rollback()
+        return False
+
+    db.execute(insert(model).from_select(columns, rows))
+    db.commit()
+    return True
+
+
+def backfill_product_sales(db: Session) -> bool:
+    totals = (
+        select(
+            SALES.machine_id,
+            SALES.product_id,
+            func.count(),
+            func.sum(SALES.product_price),
+            func.max(SALES.created_at),
+        )
+        .where(*SOLD)
+        .group_by(SALES.machine_id, SALES.product_id)
+    )
+    return _backfill_once(
+        db,
+        ProductSalesModel,
+        ["machine_id", "product_id", "units_sold", "revenue", "last_sold_at"],
+        totals,
+    )
+
+
+def backfill_sales_buckets(db: Session) -> bool:
+    # Refusals were never logged, so history only has sales.
+    def per(period: str):
+        # Inlined rather than bound so GROUP BY matches the select list.
+        start = func.date_trunc(
+            literal_column(f"'{period}'"),
+            SALES.created_at,
+            literal_column("'UTC'"),
+        )
+        return (
+            select(
+                SALES.machine_id,
+                cast(literal(period), SalesBucketModel.period.type).label("period"),
+                start.label("bucket_start"),
+                SALES.product_id,
+                func.count(),
+                func.sum(SALES.product_price),
+                func.sum(SALES.change_amount),
+            )
+            .where(*SOLD)
+            .group_by(SALES.machine_id, start, SALES.product_id)
+        )
+
+    return _backfill_once(
+        db,
+        SalesBucketModel,
+        [
+            "machine_id",
+            "period",
+            "bucket_start",
+            "product_id",
+            "units",
+            "revenue",
+            "change_paid",
+        ],
+        union_all(per("hour"), per("day")),
+    )
+
+
+if __name__ == "__main__":
+    from app.db.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for backfill in (backfill_product_sales, backfill_sales_buckets):
+            done = backfill(db)
+            print(f"{backfill.__name__}: {'done' if done else 'already filled'}")
+    finally:
+        db.close()
@@ -1,12 +1,52 @@
+from functools import lru_cache
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from app.core.config import DATABASE_URL
+from app.core.config import (
+    DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+)
+from app.db.pool_stats import TimedAsyncQueuePool, TimedQueuePool, watch_pool
+from app.db.query_stats import watch_queries
+
+POOL_OPTIONS = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
 
 # Create a SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
+watch_pool("sync", engine)
+watch_queries(engine)
 
 # Create a session local class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Create a declarative base class
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+@lru_cache(maxsize=1)
+def get_async_sessionmaker() -> async_sessionmaker:
+    # Built on first use so sync deployments never load the async driver.
+    url = make_url(DATABASE_URL).set(drivername="postgresql+psycopg")
+    async_engine = create_async_engine(
+        url,
+        poolclass=TimedAsyncQueuePool,
+        **POOL_OPTIONS,
+    )
+    watch_pool("async", async_engine.sync_engine)
+    watch_queries(async_engine.sync_engine)
+    return async_sessionmaker(
+        async_engine,
+        autoflush=False,
+        expire_on_commit=False,
+    )
@@ -1,8 +1,122 @@
-from app.db.database import SessionLocal
+from sqlalchemy import Engine, func, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import ProgrammingError
+
+from app.db.backfill_sales import backfill_product_sales, backfill_sales_buckets
+from app.db.database import Base, SessionLocal, get_async_sessionmaker
+from app.db.seed import seed_machine
+from app.db.seed_balance import seed_balance
+from app.db.seed_product import seed_products
+from app.models.models import MachineModel, SchemaVersionModel
 
 def get_db():
     db = SessionLocal()
     try:
          yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+def create_missing_indexes(engine: Engine) -> None:
+    # create_all() only builds indexes together with a new table; this adds
+    # the ones declared since an existing table was created.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def upgrade_schema(engine: Engine) -> None:
+    # Brings tables created by older releases up to the current models;
+    # a no-op on a fresh database.
+    columns = {c["name"] for c in inspect(engine).get_columns("balances")}
+    if "id" in columns:
+        # balances used a nanoid key and a globally unique denomination,
+        # which allowed only one machine's float.
+        statements = [
+            "ALTER TABLE balances DROP CONSTRAINT IF EXISTS balances_denomination_key",
+            "ALTER TABLE balances DROP CONSTRAINT IF EXISTS balances_pkey",
+            "ALTER TABLE balances DROP COLUMN id",
+            "DELETE FROM balances WHERE machine_id IS NULL",
+            "ALTER TABLE balances ADD PRIMARY KEY (machine_id, denomination)",
+        ]
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+
+    # Row versions for optimistic locking on stock and float.
+    with engine.begin() as conn:
+        for table in ("machine_products", "balances"):
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "
+                    "version integer NOT NULL DEFAULT 0"
+                )
+            )
+
+
+# Bump whenever the models, upgrade_schema() or the seed data change, so
+# that workers prepare the database once more on their next start.
+SCHEMA_VERSION = 3
+
+# pg_advisory_lock key held while one worker prepares the database.
+PREPARE_LOCK = 0x76656E64
+
+
+def schema_version(engine: Engine) -> int | None:
+    # One round trip; None on a database that was never prepared.
+    try:
+        with engine.connect() as conn:
+            return conn.scalar(select(SchemaVersionModel.version))
+    except ProgrammingError:
+        return None
+
+
+def prepare_database(engine: Engine) -> bool:
+    # What every worker runs on startup. Normally just the version check;
+    # on a new or older database one worker creates and upgrades the
+    # schema, seeds the demo machine (first boot only) and backfills the
+    # sales tables while the others wait on the lock, then skip. Returns
+    # whether this worker did the work.
+    if schema_version(engine) == SCHEMA_VERSION:
+        return False
+
+    with engine.connect() as lock:
+        lock.execute(select(func.pg_advisory_lock(PREPARE_LOCK)))
+        try:
+            if schema_version(engine) == SCHEMA_VERSION:
+                return False
+
+            Base.metadata.create_all(bind=engine)
+            upgrade_schema(engine)
+            create_missing_indexes(engine)
+
+            db = SessionLocal()
+            try:
+                if db.scalar(select(MachineModel.id).limit(1)) is None:
+                    machine_id = seed_machine(db)
+                    seed_products(db, machine_id)
+                    seed_balance(db, machine_id)
+                backfill_product_sales(db)
+                backfill_sales_buckets(db)
+
+                stmt = insert(SchemaVersionModel).values(id=1, version=SCHEMA_VERSION)
+                db.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[SchemaVersionModel.id],
+                        set_={
+                            "version": stmt.excluded.version,
+                            "updated_at": func.now(),
+                        },
+                    )
+                )
+                db.commit()
+            finally:
+                db.close()
+            return True
+        finally:
+            lock.execute(select(func.pg_advisory_unlock(PREPARE_LOCK)))
+            lock.commit()
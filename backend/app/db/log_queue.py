@@ -0,0 +1,342 @@
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from uuid import UUID
+
+from sqlalchemy import String, cast, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import (
+    TRANSACTION_LOG_BATCH_SIZE,
+    TRANSACTION_LOG_FLUSH_INTERVAL,
+    TRANSACTION_LOG_MODE,
+    TRANSACTION_LOG_QUEUE_DIR,
+)
+from app.core.metrics import Histogram
+from app.models.models import TransactionLogModel, TransactionMoneyModel
+
+logger = logging.getLogger(__name__)
+
+# Seconds from a purchase committing to its log row reaching Postgres.
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_LOG_UUIDS = ("id", "machine_id", "product_id")
+_LOG_TIMES = ("created_at", "updated_at")
+
+
+def _encode(log_row: dict, money_rows: list[dict]) -> str:
+    return json.dumps([log_row, money_rows], default=str)
+
+
+def _decode(payload: str) -> tuple[dict, list[dict]]:
+    log_row, money_rows = json.loads(payload)
+    for name in _LOG_UUIDS:
+        log_row[name] = UUID(log_row[name])
+    for name in _LOG_TIMES:
+        log_row[name] = datetime.fromisoformat(log_row[name])
+    for line in money_rows:
+        line["transaction_id"] = UUID(line["transaction_id"])
+    return log_row, money_rows
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # FULL: an appended record is on disk before the purchase responds.
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS pending ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " enqueued_at REAL NOT NULL,"
+        " payload TEXT NOT NULL,"
+        " xid TEXT)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS held ("
+        " seq INTEGER PRIMARY KEY,"
+        " enqueued_at REAL NOT NULL,"
+        " payload TEXT NOT NULL,"
+        " xid TEXT)"
+    )
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(pending)")}
+    if "xid" not in columns:
+        # A file left by a worker that appended after commit.
+        conn.execute("ALTER TABLE pending ADD COLUMN xid TEXT")
+    return conn
+
+
+def xid_columns(deferred: bool) -> list:
+    # The writing transaction's id as an extra, last RETURNING column, for
+    # the record a deferred purchase appends before it commits.
+    if not deferred:
+        return []
+    return [cast(func.pg_current_xact_id(), String)]
+
+
+def _statuses(db: Session, xids: list[str]) -> dict[str, str | None]:
+    # 'committed', 'aborted' or 'in progress' for each transaction id.
+    rows = db.execute(
+        text(
+            "SELECT x, pg_xact_status(CAST(x AS xid8)) "
+            "FROM unnest(CAST(:xids AS text[])) AS x"
+        ),
+        {"xids": xids},
+    )
+    return dict(rows.all())
+
+
+def _claim(directory: Path) -> tuple[Path, int]:
+    # One queue file per worker process, held with an exclusive lock. A
+    # restarted worker takes over the file its predecessor left behind
+    # (the lock dies with the process) and flushes what is in it.
+    directory.mkdir(parents=True, exist_ok=True)
+    slot = 0
+    while True:
+        path = directory / f"queue-{slot}.db"
+        fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            slot += 1
+            continue
+        return path, fd
+
+
+class TransactionLogQueue:
+    # Durable local queue of transaction log records (SQLite in WAL mode)
+    # with a background thread that moves them to Postgres in batches.
+    # Stock and float are still committed by the purchase itself; only the
+    # audit trail is written behind. A purchase appends its record before it
+    # commits, tagged with its Postgres transaction id, and the writer only
+    # sends records whose transaction committed.
+    def __init__(
+        self,
+        directory: Path | str,
+        session_factory: sessionmaker,
+        batch_size: int = TRANSACTION_LOG_BATCH_SIZE,
+        flush_interval: float = TRANSACTION_LOG_FLUSH_INTERVAL,
+    ):
+        self.path, self._lock_fd = _claim(Path(directory))
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lag = Histogram(LAG_BUCKETS)
+        self.flushed = 0
+        self.discarded = 0
+        self.batches = 0
+        self.flush_errors = 0
+        self.last_error: str | None = None
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+        self._depth = self._conn().execute(
+            "SELECT count(*) FROM pending"
+        ).fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections stay on the thread that opened them.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def append(
+        self, log_row: dict, money_rows: list[dict], xid: str | None = None
+    ) -> None:
+        # xid is the purchase's transaction, still open; None for a record
+        # that is already committed.
+        self._conn().execute(
+            "INSERT INTO pending (enqueued_at, payload, xid) VALUES (?, ?, ?)",
+            (time.time(), _encode(log_row, money_rows), xid),
+        )
+        with self._lock:
+            self._depth += 1
+            if self._depth >= self.batch_size:
+                self._wake.set()
+
+    def _window(self, after: int) -> list[tuple]:
+        return self._conn().execute(
+            "SELECT seq, enqueued_at, payload, xid FROM pending"
+            " WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after, self.batch_size),
+        ).fetchall()
+
+    def flush(self) -> int:
+        # Settles up to one batch; returns how many records it took off the
+        # queue. Records of committed purchases go to Postgres, those of
+        # rolled back ones are dropped and those still open are stepped over
+        # until a later round. Records whose transaction Postgres no longer
+        # remembers are moved to the held table for an operator to check.
+        # Inserts skip rows that are already there, so a batch that was
+        # written but not yet deleted locally (crash in between) is safe to
+        # send again.
+        rows = self._window(0)
+        if not rows:
+            return 0
+
+        sent, dropped, held, logs, money = [], [], [], [], []
+        db: Session = self.session_factory()
+        try:
+            settling = 0
+            while rows and settling < self.batch_size:
+                xids = sorted({xid for *_, xid in rows if xid is not None})
+                statuses = _statuses(db, xids) if xids else {}
+                for seq, enqueued_at, payload, xid in rows:
+                    status = "committed" if xid is None else statuses[xid]
+                    if status == "in progress":
+                        continue
+                    if status == "committed":
+                        log_row, money_rows = _decode(payload)
+                        logs.append(log_row)
+                        money.extend(money_rows)
+                        sent.append((seq, enqueued_at))
+                    elif status == "aborted":
+                        dropped.append((seq, enqueued_at))
+                    else:
+                        held.append((seq, enqueued_at))
+                    settling += 1
+                    if settling == self.batch_size:
+                        break
+                else:
+                    rows = self._window(rows[-1][0])
+
+            if logs:
+                db.execute(insert(TransactionLogModel).on_conflict_do_nothing(), logs)
+            if money:
+                db.execute(
+                    insert(TransactionMoneyModel).on_conflict_do_nothing(), money
+                )
+            db.commit()
+        finally:
+            db.close()
+
+        settled = sent + dropped + held
+        if not settled:
+            return 0
+        if held:
+            logger.warning(
+                "%d transaction log records have a transaction Postgres no "
+                "longer knows the outcome of; moved to the held table in %s",
+                len(held),
+                self.path,
+            )
+        flushed_at = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN")
+        if held:
+            conn.execute(
+                "INSERT INTO held SELECT seq, enqueued_at, payload, xid"
+                " FROM pending WHERE seq IN (SELECT value FROM json_each(?))",
+                (json.dumps([seq for seq, _ in held]),),
+            )
+        conn.execute(
+            "DELETE FROM pending WHERE seq IN (SELECT value FROM json_each(?))",
+            (json.dumps([seq for seq, _ in settled]),),
+        )
+        conn.execute("COMMIT")
+        for _, enqueued_at in sent:
+            self.lag.observe(flushed_at - enqueued_at)
+        with self._lock:
+            self._depth -= len(settled)
+            self.flushed += len(sent)
+            self.discarded += len(dropped)
+            self.batches += 1
+        return len(settled)
+
+    def drain(self) -> int:
+        # Stops once only records of open transactions are left.
+        moved = 0
+        while True:
+            n = self.flush()
+            moved += n
+            if n < self.batch_size:
+                return moved
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.flush() == self.batch_size:
+                    continue
+            except Exception as e:
+                # Postgres unavailable, say: keep the records and retry.
+                with self._lock:
+                    self.flush_errors += 1
+                    self.last_error = repr(e)
+                logger.exception("transaction log flush failed")
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="transaction-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Flushes what is left on a clean shutdown; anything it can't send
+        # stays on disk for the next start.
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.drain()
+        except Exception:
+            logger.exception("transaction log flush on shutdown failed")
+        os.close(self._lock_fd)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        oldest = conn.execute("SELECT min(enqueued_at) FROM pending").fetchone()[0]
+        held = conn.execute("SELECT count(*) FROM held").fetchone()[0]
+        with self._lock:
+            return {
+                "path": str(self.path),
+                "depth": self._depth,
+                "oldest_seconds": time.time() - oldest if oldest else 0.0,
+                "flushed": self.flushed,
+                "discarded": self.discarded,
+                "held": held,
+                "batches": self.batches,
+                "flush_errors": self.flush_errors,
+                "last_error": self.last_error,
+                "lag_seconds": self.lag.snapshot(),
+            }
+
+
+_queue: TransactionLogQueue | None = None
+
+
+def get_log_queue() -> TransactionLogQueue | None:
+    # None unless TRANSACTION_LOG_MODE is "queue" and the writer started.
+    return _queue
+
+
+def start_log_queue() -> TransactionLogQueue | None:
+    global _queue
+    if TRANSACTION_LOG_MODE != "queue" or _queue is not None:
+        return _queue
+
+    from app.db.database import SessionLocal
+
+    _queue = TransactionLogQueue(TRANSACTION_LOG_QUEUE_DIR, SessionLocal)
+    _queue.start()
+    return _queue
+
+
+def stop_log_queue() -> None:
+    global _queue
+    if _queue is not None:
+        _queue.stop()
+        _queue = None
@@ -0,0 +1,140 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.core.metrics import Histogram, registry
+
+# One PoolStats per engine ("sync", "async"), filled in by pool events.
+POOL_STATS: dict[str, "PoolStats"] = {}
+
+
+class PoolStats:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.wait = Histogram()
+        self.connect = Histogram()
+        self.checkouts = 0
+        self.connects = 0
+        self.connect_errors = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            # Negative until the pool has opened `size` connections.
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "connect_errors": self.connect_errors,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait_seconds": self.wait.snapshot(),
+            "connect_seconds": self.connect.snapshot(),
+        }
+
+
+class _TimedGet:
+    # Pool events fire once a connection is handed out, so time the wait for
+    # it here and leave it on the record for the "checkout" hook.
+    stats: "PoolStats | None" = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.count("timeouts")
+            raise
+        record.info["waited"] = time.perf_counter() - started
+        return record
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool; keep counting into ours.
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class TimedQueuePool(_TimedGet, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedGet, AsyncAdaptedQueuePool):
+    pass
+
+
+def watch_pool(name: str, engine: Engine) -> PoolStats:
+    stats = PoolStats(engine)
+    if isinstance(engine.pool, _TimedGet):
+        engine.pool.stats = stats
+
+    @event.listens_for(engine.pool, "checkout")
+    def on_checkout(dbapi_connection, record, proxy):
+        stats.count("checkouts")
+        waited = record.info.pop("waited", None)
+        if waited is not None:
+            stats.wait.observe(waited)
+
+    @event.listens_for(engine.pool, "connect")
+    def on_connect(dbapi_connection, record):
+        stats.count("connects")
+
+    @event.listens_for(engine.pool, "invalidate")
+    def on_invalidate(dbapi_connection, record, exception):
+        stats.count("invalidations")
+
+    @event.listens_for(engine, "do_connect")
+    def on_do_connect(dialect, record, cargs, cparams):
+        record.info["connect_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def on_connected(dbapi_connection, record):
+        started = record.info.pop("connect_started", None)
+        if started is not None:
+            stats.connect.observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def on_error(context):
+        # No connection yet means the error came from opening one.
+        if context.connection is None:
+            stats.count("connect_errors")
+
+    POOL_STATS[name] = stats
+    return stats
+
+
+def pool_statistics() -> dict:
+    return {name: stats.snapshot() for name, stats in POOL_STATS.items()}
+
+
+def _pool_metrics() -> list[str]:
+    lines = [
+        "# HELP db_pool_wait_seconds Time spent waiting for a pooled connection.",
+        "# TYPE db_pool_wait_seconds histogram",
+    ]
+    for name, stats in POOL_STATS.items():
+        lines += stats.wait.render("db_pool_wait_seconds", f'pool="{name}"')
+    lines += [
+        "# HELP db_pool_checked_out Connections currently in use.",
+        "# TYPE db_pool_checked_out gauge",
+    ]
+    for name, stats in POOL_STATS.items():
+        lines.append(f'db_pool_checked_out{{pool="{name}"}} {stats.engine.pool.checkedout()}')
+    return lines
+
+
+registry.collector(_pool_metrics)
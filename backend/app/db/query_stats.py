@@ -0,0 +1,103 @@
+import logging
+import re
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import SLOW_QUERY_MS
+from app.core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Roughly Fibonacci: one or two statements is a cache hit, five is a
+# purchase, anything in the tens is worth a look.
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+STATEMENTS = registry.histogram(
+    "db_statements_per_request",
+    "SQL statements executed while handling a request.",
+    ("route",),
+    STATEMENT_BUCKETS,
+)
+DB_SECONDS = registry.histogram(
+    "db_seconds_per_request",
+    "Time spent in SQL statements while handling a request.",
+    ("route",),
+)
+SLOW_QUERIES = registry.counter(
+    "db_slow_queries_total",
+    "Statements slower than SLOW_QUERY_MS.",
+)
+
+
+class QueryCounter:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# The request being handled, if any. Sync routes run in the threadpool with
+# a copy of the context, which still points at the same counter.
+current_queries: ContextVar[QueryCounter | None] = ContextVar(
+    "current_queries", default=None
+)
+
+_PYFORMAT = re.compile(r"%\((\w+)\)s")
+_VALUES_ROWS = re.compile(r"(\([^()]*\))(?:, \([^()]*\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    # One line, :name placeholders, and a multi-row VALUES list collapsed to
+    # its first row, so a statement logs the same whatever the batch size.
+    sql = _PYFORMAT.sub(r":\1", _WHITESPACE.sub(" ", statement).strip())
+    return _VALUES_ROWS.sub(r"\1, ...", sql)
+
+
+def parameter_shape(parameters) -> str:
+    # Names and types, never values.
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(
+        parameters[0], (dict, list, tuple)
+    ):
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(
+            f"{name}: {type(value).__name__}" for name, value in parameters.items()
+        ) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def watch_queries(engine: Engine, slow_ms: float = SLOW_QUERY_MS) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        counter = current_queries.get()
+        if counter is not None:
+            counter.statements += 1
+            counter.seconds += elapsed
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            SLOW_QUERIES.inc()
+            logger.warning(
+                "slow query %.1f ms: %s params=%s",
+                elapsed * 1000,
+                normalize_sql(statement),
+                parameter_shape(parameters),
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def on_error(context):
+        # The statement failed, so after_cursor_execute won't pop its start.
+        if context.connection is not None:
+            started = context.connection.info.get("query_started")
+            if started:
+                started.pop()
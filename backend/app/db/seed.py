@@ -4,23 +4,20 @@ from sqlalchemy.orm import Session
 from app.models.models import MachineModel
 
 
-DEFAULT_MACHINE_ID = UUID("00000000-0000-0000-0000-000000000001")
-
-
-def seed_machine(db: Session) -> None:
+def seed_machine(db: Session) -> UUID:
+    # The first machine, created on an empty database; the demo products
+    # and float are seeded into it.
     machine = (
         db.query(MachineModel)
-        .filter(MachineModel.id == DEFAULT_MACHINE_ID)
+        .order_by(MachineModel.name, MachineModel.id)
         .first()
     )
 
     if machine:
-        return
+        return machine.id
 
-    machine = MachineModel(
-        id=DEFAULT_MACHINE_ID,
-        name="Main Vending Machine",
-    )
+    machine = MachineModel(name="Main Vending Machine")
 
     db.add(machine)
     db.commit()
+    return machine.id
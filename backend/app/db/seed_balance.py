@@ -1,8 +1,8 @@
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from app.models.models import BalanceModel
-from app.core.config import DEFAULT_MACHINE_ID
-from nanoid import generate
+from uuid import UUID
 
 DEMO_BALANCES = [
     {
@@ -47,23 +47,11 @@ DEMO_BALANCES = [
     },
 ]
 
-def seed_balance(db: Session) -> None:
-    for item in DEMO_BALANCES:
-        balance = (
-            db.query(BalanceModel)
-            .filter(BalanceModel.denomination == item["denomination"])
-            .first()
-        )
-
-        if not balance:
-            balance = BalanceModel(
-                id=generate(),
-                machine_id=DEFAULT_MACHINE_ID,
-                denomination=item["denomination"],
-                amount=item["amount"],
-                type=item["type"],
-            )
-            db.add(balance)
-            db.flush()
-
-    db.commit()
\ No newline at end of file
+def seed_balance(db: Session, machine_id: UUID) -> None:
+    # Leaves denominations the machine already has alone.
+    db.execute(
+        insert(BalanceModel)
+        .values([{"machine_id": machine_id, **item} for item in DEMO_BALANCES])
+        .on_conflict_do_nothing()
+    )
+    db.commit()
@@ -1,7 +1,9 @@
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from app.models.models import ProductModel, MachineProductModel
-from app.core.config import DEFAULT_MACHINE_ID
+from uuid import UUID
 
 
 DEMO_PRODUCTS = [
@@ -38,38 +40,48 @@ DEMO_PRODUCTS = [
 ]
 
 
-def seed_products(db: Session) -> None:
-    for item in DEMO_PRODUCTS:
-        product = (
-            db.query(ProductModel)
-            .filter(ProductModel.name == item["name"])
-            .first()
-        )
-
-        if not product:
-            product = ProductModel(
-                name=item["name"],
-                price=item["price"],
-                image=item["image"],
+def seed_products(db: Session, machine_id: UUID) -> None:
+    # Adds whichever demo products and machine rows are missing, in bulk.
+    names = [item["name"] for item in DEMO_PRODUCTS]
+    product_ids = dict(
+        db.execute(
+            select(ProductModel.name, ProductModel.id).where(
+                ProductModel.name.in_(names)
             )
-            db.add(product)
-            db.flush()
+        ).all()
+    )
 
-        machine_product = (
-            db.query(MachineProductModel)
-            .filter(
-                MachineProductModel.machine_id == DEFAULT_MACHINE_ID,
-                MachineProductModel.product_id == product.id,
-            )
-            .first()
+    missing = [item for item in DEMO_PRODUCTS if item["name"] not in product_ids]
+    if missing:
+        product_ids.update(
+            db.execute(
+                insert(ProductModel)
+                .values(
+                    [
+                        {
+                            "name": item["name"],
+                            "price": item["price"],
+                            "image": item["image"],
+                        }
+                        for item in missing
+                    ]
+                )
+                .returning(ProductModel.name, ProductModel.id)
+            ).all()
         )
 
-        if not machine_product:
-            machine_product = MachineProductModel(
-                machine_id=DEFAULT_MACHINE_ID,
-                product_id=product.id,
-                stock=item["stock"],
-            )
-            db.add(machine_product)
-
+    db.execute(
+        insert(MachineProductModel)
+        .values(
+            [
+                {
+                    "machine_id": machine_id,
+                    "product_id": product_ids[item["name"]],
+                    "stock": item["stock"],
+                }
+                for item in DEMO_PRODUCTS
+            ]
+        )
+        .on_conflict_do_nothing()
+    )
     db.commit()
@@ -1,5 +1,15 @@
-from typing import List, Dict
+from functools import lru_cache
+from typing import Callable, List, Dict, Optional, Tuple
 from app.schemas.schemas import MoneyItem
+from app.core.config import CHANGE_ENGINE
+
+ChangeEngine = Callable[[Dict[int, int], int], Dict[int, int]]
+# Same engines over a balance vector: (denominations descending, counts,
+# amount) -> counts to pay out, or None when the amount cannot be paid.
+CountEngine = Callable[
+    [Tuple[int, ...], Tuple[int, ...], int],
+    Optional[Tuple[int, ...]],
+]
 
 
 def calculate_total_money(money: List[MoneyItem]) -> int:
@@ -40,3 +50,330 @@ def greedy_change(
         raise ValueError("CANNOT_MAKE_CHANGE")
 
     return change
+
+
+def _balance_vector(
+    balance: Dict[int, int],
+) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    # Denominations in descending order with their (non-negative) counts.
+    denoms = tuple(sorted((d for d in balance if d > 0), reverse=True))
+    counts = tuple(max(balance[d], 0) for d in denoms)
+    return denoms, counts
+
+
+def _shift_or(reachable: int, denom: int, count: int, mask: int) -> int:
+    # Bounded subset-sum step on a big-int bitset: add up to `count` coins of
+    # `denom` to every reachable amount. Counts are split into powers of two
+    # so each denomination costs O(log count) shifts.
+    chunk = 1
+    while count > 0:
+        take = min(chunk, count)
+        reachable |= (reachable << (denom * take)) & mask
+        count -= take
+        chunk <<= 1
+    return reachable
+
+
+def _payable_suffixes(
+    denoms: Tuple[int, ...],
+    counts: Tuple[int, ...],
+    amount: int,
+) -> List[int]:
+    # payable[i] is the bitset of amounts up to `amount` that denoms[i:] can
+    # pay; payable[len(denoms)] only holds 0.
+    mask = (1 << (amount + 1)) - 1
+    payable = [1] * (len(denoms) + 1)
+    for i in range(len(denoms) - 1, -1, -1):
+        payable[i] = _shift_or(payable[i + 1], denoms[i], counts[i], mask)
+    return payable
+
+
+@lru_cache(maxsize=64)
+def is_canonical(denoms: Tuple[int, ...]) -> bool:
+    # A coin system is canonical when unbounded greedy is optimal for every
+    # amount. Kozen & Zaks: if it is not, the smallest counterexample is
+    # below the sum of the two largest coins, so checking up to there is
+    # enough. Systems without a 1 are treated as non-canonical.
+    if not denoms or denoms[-1] != 1:
+        return False
+    if len(denoms) < 3:
+        return True
+
+    limit = denoms[0] + denoms[1]
+    ascending = denoms[::-1]
+    best = [0] * limit
+    for amount in range(1, limit):
+        best[amount] = min(
+            best[amount - d] + 1 for d in ascending if d <= amount
+        )
+
+        greedy_coins = 0
+        rest = amount
+        for d in denoms:
+            greedy_coins += rest // d
+            rest %= d
+        if greedy_coins != best[amount]:
+            return False
+
+    return True
+
+
+def _unbounded_greedy(
+    denoms: Tuple[int, ...],
+    counts: Tuple[int, ...],
+    amount: int,
+) -> Optional[Tuple[int, ...]]:
+    used = []
+    for denom, available in zip(denoms, counts):
+        take = amount // denom
+        if take > available:
+            return None
+        used.append(take)
+        amount -= take * denom
+    return tuple(used) if amount == 0 else None
+
+
+@lru_cache(maxsize=4096)
+def _optimal_counts(
+    denoms: Tuple[int, ...],
+    counts: Tuple[int, ...],
+    amount: int,
+) -> Optional[Tuple[int, ...]]:
+    if amount == 0:
+        return (0,) * len(denoms)
+
+    # Fast path: in a canonical system the unbounded greedy answer is the
+    # minimum coin count, so if the float can cover it nothing beats it.
+    if is_canonical(denoms):
+        used = _unbounded_greedy(denoms, counts, amount)
+        if used is not None:
+            return used
+
+    # Bounded-coin search over (denomination index, remaining amount),
+    # largest denomination first. payable[i] is a bitset of the amounts
+    # denoms[i:] can pay, so the search never enters a dead end and an
+    # unpayable amount is rejected before searching at all. Branches that
+    # cannot beat the best answer so far are cut (coins used + rest /
+    # current denomination is a lower bound).
+    n = len(denoms)
+    payable = _payable_suffixes(denoms, counts, amount)
+    if not (payable[0] >> amount) & 1:
+        return None
+
+    best_coins = amount + 1
+    best_used: Optional[Tuple[int, ...]] = None
+
+    def search(i: int, rest: int, coins: int, used: Tuple[int, ...]) -> None:
+        nonlocal best_coins, best_used
+        if rest == 0:
+            if coins < best_coins:
+                best_coins = coins
+                best_used = used + (0,) * (n - i)
+            return
+
+        denom = denoms[i]
+        if coins + -(-rest // denom) >= best_coins:
+            return
+
+        following = payable[i + 1]
+        smaller = denoms[i + 1] if i + 1 < n else 0
+        for take in range(min(counts[i], rest // denom), -1, -1):
+            left = rest - take * denom
+            # Each coin fewer here needs at least one more smaller coin, so
+            # once the bound fails no smaller take can win either.
+            if smaller and coins + take + -(-left // smaller) >= best_coins:
+                break
+            if (following >> left) & 1:
+                search(i + 1, left, coins + take, used + (take,))
+
+    search(0, amount, 0, ())
+    return best_used
+
+
+def _greedy_counts(
+    denoms: Tuple[int, ...],
+    counts: Tuple[int, ...],
+    amount: int,
+) -> Optional[Tuple[int, ...]]:
+    used = []
+    for denom, available in zip(denoms, counts):
+        take = min(available, amount // denom)
+        used.append(take)
+        amount -= take * denom
+    return tuple(used) if amount == 0 else None
+
+
+def _change_from_counts(
+    engine: CountEngine,
+    balance: Dict[int, int],
+    change_amount: int,
+) -> Dict[int, int]:
+    if change_amount < 0:
+        raise ValueError("CANNOT_MAKE_CHANGE")
+
+    denoms, counts = _balance_vector(balance)
+    used = engine(denoms, counts, change_amount)
+
+    if used is None:
+        raise ValueError("CANNOT_MAKE_CHANGE")
+
+    return {denom: qty for denom, qty in zip(denoms, used) if qty > 0}
+
+
+def optimal_change(
+    balance: Dict[int, int],
+    change_amount: int,
+) -> Dict[int, int]:
+    return _change_from_counts(_optimal_counts, balance, change_amount)
+
+
+class ChangeAvailability:
+    # Every change amount up to the largest denomination the float can pay,
+    # as a bitset: bit n is set when n is payable.
+    __slots__ = ("denoms", "reachable")
+
+    def __init__(self, denoms: Tuple[int, ...], reachable: int):
+        self.denoms = denoms
+        self.reachable = reachable
+
+    def can_change(self, amount: int) -> bool:
+        return amount >= 0 and (self.reachable >> amount) & 1 == 1
+
+    def hint(self, price: int) -> Tuple[bool, Optional[int]]:
+        # Paying `price` with copies of one denomination overshoots by
+        # (-price) % denom. Returns (exact_change_only, max_accepted_note)
+        # where max_accepted_note is the largest denomination such that it
+        # and every smaller one can be paid back.
+        exact_change_only = True
+        max_accepted_note = None
+
+        for denom in reversed(self.denoms):
+            overshoot = -price % denom
+            if not self.can_change(overshoot):
+                break
+            max_accepted_note = denom
+            if overshoot:
+                exact_change_only = False
+
+        return exact_change_only, max_accepted_note
+
+
+@lru_cache(maxsize=64)
+def _availability(
+    denoms: Tuple[int, ...],
+    counts: Tuple[int, ...],
+) -> ChangeAvailability:
+    limit = denoms[0] if denoms else 0
+    mask = (1 << (limit + 1)) - 1
+    reachable = 1
+
+    for denom, count in zip(denoms, counts):
+        reachable = _shift_or(reachable, denom, count, mask)
+
+    return ChangeAvailability(denoms, reachable)
+
+
+def change_availability(balance: Dict[int, int]) -> ChangeAvailability:
+    return _availability(*_balance_vector(balance))
+
+
+def _feasible_combinations(
+    denoms: Tuple[int, ...],
+    counts: Tuple[int, ...],
+    amount: int,
+    limit: int,
+    branching: int = 3,
+) -> List[Tuple[int, ...]]:
+    # Up to `limit` ways to pay `amount`, largest denomination first. Each
+    # level only tries its `branching` largest payable counts (plus none),
+    # which keeps the search bounded while still offering real alternatives
+    # to "drain the big notes".
+    found: List[Tuple[int, ...]] = []
+    n = len(denoms)
+    payable = _payable_suffixes(denoms, counts, amount)
+    if not (payable[0] >> amount) & 1:
+        return found
+
+    def walk(i: int, rest: int, used: Tuple[int, ...]) -> None:
+        if rest == 0:
+            found.append(used + (0,) * (n - i))
+            return
+
+        denom = denoms[i]
+        following = payable[i + 1]
+        tried = 0
+        for take in range(min(counts[i], rest // denom), -1, -1):
+            if len(found) >= limit:
+                return
+            left = rest - take * denom
+            if take and tried >= branching:
+                continue
+            if (following >> left) & 1:
+                tried += 1
+                walk(i + 1, left, used + (take,))
+
+    walk(0, amount, ())
+    return found
+
+
+def _conserving_counts(
+    denoms: Tuple[int, ...],
+    counts: Tuple[int, ...],
+    amount: int,
+    candidates: int = 32,
+) -> Optional[Tuple[int, ...]]:
+    # Among feasible payouts, keep the float able to pay back as many
+    # amounts as possible afterwards; fewer coins breaks ties.
+    options = _feasible_combinations(denoms, counts, amount, candidates)
+
+    optimal = _optimal_counts(denoms, counts, amount)
+    if optimal is not None and optimal not in options:
+        options.append(optimal)
+    if not options:
+        return None
+
+    mask = (1 << (denoms[0] + 1)) - 1
+
+    def score(used: Tuple[int, ...]) -> Tuple[int, int]:
+        reachable = 1
+        for denom, count, qty in zip(denoms, counts, used):
+            reachable = _shift_or(reachable, denom, count - qty, mask)
+        return bin(reachable).count("1"), -sum(used)
+
+    return max(options, key=score)
+
+
+def conserving_change(
+    balance: Dict[int, int],
+    change_amount: int,
+) -> Dict[int, int]:
+    return _change_from_counts(_conserving_counts, balance, change_amount)
+
+
+CHANGE_ENGINES: Dict[str, ChangeEngine] = {
+    "greedy": greedy_change,
+    "optimal": optimal_change,
+    "conserve": conserving_change,
+}
+
+COUNT_ENGINES: Dict[str, CountEngine] = {
+    "greedy": _greedy_counts,
+    "optimal": _optimal_counts,
+    "conserve": _conserving_counts,
+}
+
+
+def get_change_engine(name: Optional[str] = None) -> ChangeEngine:
+    name = name or CHANGE_ENGINE
+    try:
+        return CHANGE_ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown change engine: {name}")
+
+
+def get_count_engine(name: Optional[str] = None) -> CountEngine:
+    name = name or CHANGE_ENGINE
+    try:
+        return COUNT_ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Unknown change engine: {name}")
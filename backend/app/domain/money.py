@@ -0,0 +1,96 @@
+from operator import add, mul, sub
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.domain.change import (
+    ChangeAvailability,
+    CountEngine,
+    _availability,
+    get_count_engine,
+)
+from app.schemas.schemas import MoneyItem
+
+# Denominations the machine handles, largest first. Every MoneyVector is laid
+# out in this order, which is also the order the change engines work in.
+DENOMINATIONS: Tuple[int, ...] = (1000, 500, 100, 50, 20, 10, 5, 1)
+
+_INDEX = {denom: i for i, denom in enumerate(DENOMINATIONS)}
+_ZERO = (0,) * len(DENOMINATIONS)
+
+
+def denomination_type(denom: int) -> str:
+    return "coin" if denom < 20 else "banknote"
+
+
+class MoneyVector:
+    __slots__ = ("counts",)
+
+    def __init__(self, counts: Tuple[int, ...] = _ZERO):
+        self.counts = counts
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[int, int]]) -> "MoneyVector":
+        counts = list(_ZERO)
+        for denom, quantity in pairs:
+            i = _INDEX.get(denom)
+            if i is None:
+                raise ValueError("INVALID_DENOMINATION")
+            counts[i] += quantity
+        return cls(tuple(counts))
+
+    @classmethod
+    def from_dict(cls, money: Dict[int, int]) -> "MoneyVector":
+        return cls.from_pairs(money.items())
+
+    @classmethod
+    def from_items(cls, items: Iterable[MoneyItem]) -> "MoneyVector":
+        return cls.from_pairs((m.denomination, m.quantity) for m in items)
+
+    def to_dict(self) -> Dict[int, int]:
+        return {d: q for d, q in zip(DENOMINATIONS, self.counts) if q}
+
+    def to_items(self) -> List[MoneyItem]:
+        return [
+            MoneyItem(denomination=d, quantity=q)
+            for d, q in zip(DENOMINATIONS, self.counts)
+            if q
+        ]
+
+    def total(self) -> int:
+        return sum(map(mul, DENOMINATIONS, self.counts))
+
+    def __add__(self, other: "MoneyVector") -> "MoneyVector":
+        return MoneyVector(tuple(map(add, self.counts, other.counts)))
+
+    def __sub__(self, other: "MoneyVector") -> "MoneyVector":
+        counts = tuple(map(sub, self.counts, other.counts))
+        if min(counts) < 0:
+            raise ValueError("NEGATIVE_BALANCE")
+        return MoneyVector(counts)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, MoneyVector) and self.counts == other.counts
+
+    def __hash__(self) -> int:
+        return hash(self.counts)
+
+    def __repr__(self) -> str:
+        return f"MoneyVector({self.to_dict()})"
+
+    def make_change(
+        self,
+        change_amount: int,
+        engine: Optional[CountEngine] = None,
+    ) -> "MoneyVector":
+        if change_amount < 0:
+            raise ValueError("CANNOT_MAKE_CHANGE")
+
+        engine = engine or get_count_engine()
+        used = engine(DENOMINATIONS, self.counts, change_amount)
+
+        if used is None:
+            raise ValueError("CANNOT_MAKE_CHANGE")
+
+        return MoneyVector(used)
+
+    def availability(self) -> ChangeAvailability:
+        return _availability(DENOMINATIONS, self.counts)
@@ -1,11 +1,13 @@
-from app.domain.types import Money, PurchaseResult
-from app.domain.change import greedy_change
+from app.domain.types import Money, PurchaseResult, VectorPurchaseResult
+from app.domain.change import ChangeEngine, CountEngine, get_change_engine
+from app.domain.money import MoneyVector
 
 def purchase(
     product_price: int,
     product_stock: int,
     machine_balance: dict[int, int],
     inserted_money: list[Money],
+    make_change: ChangeEngine | None = None,
 ) -> PurchaseResult:
 
     if product_stock <= 0:
@@ -27,10 +29,37 @@ def purchase(
             balance.get(money.denomination, 0) + money.quantity
         )
 
-    change = greedy_change(balance, change_amount)
+    make_change = make_change or get_change_engine()
+    change = make_change(balance, change_amount)
 
     return PurchaseResult(
         change=change,
         paid_amount=paid_amount,
         product_price=product_price,
-    )
\ No newline at end of file
+    )
+
+def purchase_vector(
+    product_price: int,
+    product_stock: int,
+    machine_balance: MoneyVector,
+    inserted_money: MoneyVector,
+    make_change: CountEngine | None = None,
+) -> VectorPurchaseResult:
+
+    if product_stock <= 0:
+        raise ValueError("OUT_OF_STOCK")
+
+    paid_amount = inserted_money.total()
+
+    if paid_amount < product_price:
+        raise ValueError("INSUFFICIENT_FUNDS")
+
+    balance = machine_balance + inserted_money
+    change = balance.make_change(paid_amount - product_price, make_change)
+
+    return VectorPurchaseResult(
+        change=change,
+        balance=balance - change,
+        paid_amount=paid_amount,
+        product_price=product_price,
+    )
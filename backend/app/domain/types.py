@@ -1,7 +1,9 @@
 # app/domain/types.py
 from dataclasses import dataclass
 
-@dataclass(frozen=True)
+from app.domain.money import MoneyVector
+
+@dataclass(frozen=True, slots=True)
 class Money:
     denomination: int
     quantity: int
@@ -11,3 +13,10 @@ class PurchaseResult:
     change: dict[int, int]
     paid_amount: int
     product_price: int
+
+@dataclass(slots=True)
+class VectorPurchaseResult:
+    change: MoneyVector
+    balance: MoneyVector
+    paid_amount: int
+    product_price: int
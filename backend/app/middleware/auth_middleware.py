@@ -8,6 +8,18 @@ SECRET_KEY = os.getenv("SECRET_KEY_JWT")
 ALGORITHM = "HS256"
 
 
+def admin_claims(request: Request) -> dict | None:
+    # The payload of a valid access_token cookie, for routes outside
+    # protected_paths that still want an admin.
+    token = request.cookies.get("access_token")
+    if not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+
 class JWTAuthMiddleware(BaseHTTPMiddleware):
     def __init__(self, app, protected_paths: list[str]):
         super().__init__(app)
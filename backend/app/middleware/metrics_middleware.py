@@ -0,0 +1,52 @@
+import time
+
+from app.core.config import DEBUG
+from app.core.metrics import REQUEST_SECONDS
+from app.db.query_stats import DB_SECONDS, STATEMENTS, QueryCounter, current_queries
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: it only wraps send, so it
+    # adds no task or body buffering per request. Requests are labelled with
+    # the route template, not the URL, to keep the series bounded.
+    def __init__(self, app, debug: bool = DEBUG):
+        self.app = app
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+        queries = QueryCounter()
+        token = current_queries.set(queries)
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.debug:
+                    # What ran before the headers; a streamed body's
+                    # queries only show in the histograms.
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            (b"x-db-statements", str(queries.statements).encode()),
+                            (b"x-db-time-ms", f"{queries.seconds * 1000:.1f}".encode()),
+                        ],
+                    }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            current_queries.reset(token)
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started, scope["method"], route, status
+            )
+            STATEMENTS.observe(queries.statements, route)
+            DB_SECONDS.observe(queries.seconds, route)
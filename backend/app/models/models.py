@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, UUID, Enum, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, UUID, Enum, DateTime, ForeignKey, Index
 from pydantic import BaseModel
 from datetime import datetime, UTC
 from app.db.database import Base
 from sqlalchemy import Column, text
+from sqlalchemy.dialects.postgresql import JSONB
 class ProductModel(Base):
     __tablename__ = "products"
 
@@ -26,6 +27,7 @@ class MachineProductModel(Base):
     machine_id = Column(UUID, ForeignKey("machines.id"), primary_key=True)
     product_id = Column(UUID, ForeignKey("products.id"), primary_key=True)
     stock = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False, server_default=text("0"))
     created_at = Column(
     DateTime(timezone=True),
     default=lambda: datetime.now(UTC),
@@ -36,14 +38,20 @@ class MachineProductModel(Base):
     onupdate=lambda: datetime.now(UTC),
 )
 
+    __mapper_args__ = {"version_id_col": version}
+
 class BalanceModel(Base):
     __tablename__ = "balances"
 
-    id = Column(String, primary_key=True)  # nanoid
-    machine_id = Column(UUID, ForeignKey("machines.id"))
-    denomination = Column(Integer, nullable=False, unique=True)
+    # One row per machine and denomination; purchases on different machines
+    # never touch the same rows.
+    machine_id = Column(UUID, ForeignKey("machines.id"), primary_key=True)
+    denomination = Column(Integer, primary_key=True)
     amount = Column(Integer, nullable=False)
     type = Column(Enum("coin", "banknote", name="balance_type"))
+    version = Column(Integer, nullable=False, server_default=text("0"))
+
+    __mapper_args__ = {"version_id_col": version}
 
 
 class MachineModel(Base):
@@ -71,6 +79,18 @@ class TransactionLogModel(Base):
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
     updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
 
+    # History pages walk these newest first (see TransactionService).
+    __table_args__ = (
+        Index("ix_transaction_logs_machine_created", "machine_id", "created_at", "id"),
+        Index(
+            "ix_transaction_logs_machine_product_created",
+            "machine_id",
+            "product_id",
+            "created_at",
+            "id",
+        ),
+    )
+
 class TransactionMoneyModel(Base):
     __tablename__ = "transaction_money"
 
@@ -78,7 +98,8 @@ class TransactionMoneyModel(Base):
     transaction_id = Column(
         UUID,
         ForeignKey("transaction_logs.id"),
-        nullable=False
+        nullable=False,
+        index=True,
     )
 
     denomination = Column(Integer, nullable=False)
@@ -89,6 +110,45 @@ class TransactionMoneyModel(Base):
         nullable=False
     )
 
+class ProductSalesModel(Base):
+    # Running totals per machine and product, kept up to date by the purchase
+    # transaction (see app/db/backfill_sales.py for existing history).
+    __tablename__ = "product_sales"
+
+    machine_id = Column(UUID, ForeignKey("machines.id"), primary_key=True)
+    product_id = Column(
+        UUID,
+        ForeignKey("products.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    units_sold = Column(Integer, nullable=False, server_default=text("0"))
+    revenue = Column(BigInteger, nullable=False, server_default=text("0"))
+    last_sold_at = Column(DateTime(timezone=True))
+
+class SalesBucketModel(Base):
+    # Hourly and daily totals per machine and product (UTC bucket starts),
+    # maintained by the purchase path. change_paid is the value paid back,
+    # refusals counts purchases turned down for stock, funds or change.
+    __tablename__ = "sales_buckets"
+
+    machine_id = Column(UUID, ForeignKey("machines.id"), primary_key=True)
+    period = Column(Enum("hour", "day", name="bucket_period"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    product_id = Column(
+        UUID,
+        ForeignKey("products.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    units = Column(Integer, nullable=False, server_default=text("0"))
+    revenue = Column(BigInteger, nullable=False, server_default=text("0"))
+    change_paid = Column(BigInteger, nullable=False, server_default=text("0"))
+    refusals = Column(Integer, nullable=False, server_default=text("0"))
+
+    # Fleet-wide ranges (no machine filter).
+    __table_args__ = (
+        Index("ix_sales_buckets_period_start", "period", "bucket_start"),
+    )
+
 class UserModel(Base):
     __tablename__ = "users"
 
@@ -99,3 +159,31 @@ class UserModel(Base):
     updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
     
     
+
+
+class SchemaVersionModel(Base):
+    __tablename__ = "schema_version"
+
+    # A single row: the schema and seed version the database was last
+    # prepared for (see app/db/init_db.py).
+    id = Column(Integer, primary_key=True, default=1)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
+
+
+class IdempotencyKeyModel(Base):
+    # The outcome of every purchase made with an Idempotency-Key, written in
+    # the purchase's own transaction (see app/service/idempotency.py).
+    __tablename__ = "idempotency_keys"
+
+    machine_id = Column(UUID, ForeignKey("machines.id"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    body = Column(JSONB, nullable=False)
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+        index=True,
+    )
@@ -1,36 +1,106 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.responses import StreamingResponse
+from datetime import datetime
+from typing import Literal
 from sqlalchemy.orm import Session
-from uuid import UUID, uuid4
+from uuid import UUID
 
 from app.db.init_db import get_db
+from app.db.pool_stats import pool_statistics
+from app.db.log_queue import get_log_queue
+from app.core.config import PURCHASE_ENGINE, PUSH_EVENTS, TRANSACTION_LOG_MODE
 from app.service.admin_service import AdminService
+from app.service.machine_registry import machine_registry
+from app.service.machine_service import MachineService
+from app.service.product_service import ProductService
+from app.service.import_service import ImportService, parse_rows
+from app.service.analytics_service import AnalyticsService
+from app.service.transaction_service import MAX_PAGE_SIZE, TransactionService
+from app.service.export_service import MEDIA_TYPES, export_transactions
+from app.service.catalog_cache import catalog_cache
+from app.service.idempotency import idempotency_store
+from app.service.events import event_hub
+from app.service.ledger import get_ledger
+from app.storage.images import queue_variants, save_image
 from app.schemas.schemas import (
     Product,
     ProductCreate,
     ProductUpdate,
     MoneyItem,
     AdminProduct,
+    PoolStatus,
+    CatalogCacheStats,
+    IdempotencyStats,
+    LogQueueStats,
+    EventHubStats,
+    LedgerStats,
+    SalesBucket,
+    SalesSummary,
+    TransactionPage,
+    Machine,
+    MachineCreate,
+    ImportResult,
+    ProductImportResult,
 )
-from pathlib import Path
 
 router = APIRouter(tags=["Admin"])
 
-IMAGE_DIR = Path(__file__).resolve().parent.parent.parent.parent / "images"
-print(IMAGE_DIR)
+def get_admin_service(
+    machine_id: UUID,
+    db: Session = Depends(get_db),
+) -> AdminService:
+    machine_registry.get(db, machine_id)
+    return AdminService(db, machine_id)
 
 
-def get_admin_service(db: Session = Depends(get_db)) -> AdminService:
-    return AdminService(db)
+def get_machine_service(db: Session = Depends(get_db)) -> MachineService:
+    return MachineService(db)
 
 
-@router.get("/products", response_model=list[AdminProduct])
+def get_product_service(db: Session = Depends(get_db)) -> ProductService:
+    return ProductService(db)
+
+
+def get_import_service(db: Session = Depends(get_db)) -> ImportService:
+    return ImportService(db)
+
+
+async def import_rows(request: Request) -> list:
+    # JSON array or text/csv body; read here so the handlers can stay sync.
+    return parse_rows(request.headers.get("content-type", ""), await request.body())
+
+
+def get_analytics_service(db: Session = Depends(get_db)) -> AnalyticsService:
+    return AnalyticsService(db)
+
+
+def get_transaction_service(db: Session = Depends(get_db)) -> TransactionService:
+    return TransactionService(db)
+
+
+@router.get("/machines", response_model=list[Machine])
+def list_machines(
+    service: MachineService = Depends(get_machine_service),
+):
+    return service.list_machines()
+
+
+@router.post("/machines", response_model=Machine, status_code=201)
+def create_machine(
+    data: MachineCreate,
+    service: MachineService = Depends(get_machine_service),
+):
+    return service.create_machine(data)
+
+
+@router.get("/machines/{machine_id}/products", response_model=list[AdminProduct])
 def list_products(
     service: AdminService = Depends(get_admin_service),
 ):
     return service.list_products()
 
 
-@router.post("/products", response_model=Product)
+@router.post("/machines/{machine_id}/products", response_model=Product)
 def create_product(
     name: str = Form(...),
     price: int = Form(...),
@@ -38,18 +108,8 @@ def create_product(
     image: UploadFile = File(...),
     service: AdminService = Depends(get_admin_service),
 ):
-    IMAGE_DIR.mkdir(exist_ok=True)
-
-    ext = Path(image.filename).suffix
-    filename = f"{uuid4()}{ext}"
-
-    file_path = IMAGE_DIR / filename
-
-    with open(file_path, "wb") as f:
-        f.write(image.file.read())
-
-    image_path = f"/images/{filename}"
-
+    image_path = save_image(image)
+    queue_variants(image_path)
 
     data = ProductCreate(
         name=name,
@@ -62,7 +122,10 @@ def create_product(
 
 
 
-@router.put("/products/{product_id}", response_model=AdminProduct)
+@router.put(
+    "/machines/{machine_id}/products/{product_id}",
+    response_model=AdminProduct,
+)
 def update_product(
     product_id: UUID,
     name: str = Form(...),
@@ -74,16 +137,8 @@ def update_product(
     image_path = None
 
     if image:
-        IMAGE_DIR.mkdir(exist_ok=True)
-        ext = Path(image.filename).suffix
-        filename = f"{uuid4()}{ext}"
-
-        file_path = IMAGE_DIR / filename
-
-        with open(file_path, "wb") as f:
-            f.write(image.file.read())
-
-        image_path = f"/images/{filename}"
+        image_path = save_image(image)
+        queue_variants(image_path)
 
     return service.update_product(
         product_id,
@@ -95,7 +150,7 @@ def update_product(
 
 
 
-@router.delete("/products/{product_id}", status_code=204)
+@router.delete("/machines/{machine_id}/products/{product_id}", status_code=204)
 def delete_product(
     product_id: UUID,
     service: AdminService = Depends(get_admin_service),
@@ -104,18 +159,155 @@ def delete_product(
     return None
 
 
-@router.get("/balance", response_model=list[MoneyItem])
+@router.delete("/products/{product_id}", status_code=204)
+def delete_catalog_product(
+    product_id: UUID,
+    service: ProductService = Depends(get_product_service),
+):
+    service.delete_product(product_id)
+    return None
+
+
+@router.get("/machines/{machine_id}/balance", response_model=list[MoneyItem])
 def get_balance(
     service: AdminService = Depends(get_admin_service),
 ):
     return service.list_balance()
 
 
-@router.put("/balance", response_model=list[MoneyItem])
+@router.put("/machines/{machine_id}/balance", response_model=list[MoneyItem])
 def set_balance(
     balance: list[MoneyItem],
     service: AdminService = Depends(get_admin_service),
 ):
-    print(balance)
     return service.set_balance(balance)
 
+
+@router.post("/import/products", response_model=ProductImportResult)
+def import_products(
+    rows: list = Depends(import_rows),
+    service: ImportService = Depends(get_import_service),
+):
+    return service.import_products(rows)
+
+
+@router.post("/import/stock", response_model=ImportResult)
+def import_stock(
+    rows: list = Depends(import_rows),
+    service: ImportService = Depends(get_import_service),
+):
+    return service.import_stock(rows)
+
+
+@router.post("/import/balances", response_model=ImportResult)
+def import_balances(
+    rows: list = Depends(import_rows),
+    service: ImportService = Depends(get_import_service),
+):
+    return service.import_balances(rows)
+
+
+# Does not take a session itself, so it still answers when the pool is
+# exhausted.
+@router.get("/pool", response_model=dict[str, PoolStatus])
+def get_pool_status():
+    return pool_statistics()
+
+
+@router.get("/catalog-cache", response_model=CatalogCacheStats)
+def get_catalog_cache_stats():
+    return catalog_cache.stats()
+
+
+@router.get("/log-queue", response_model=LogQueueStats)
+def get_log_queue_stats():
+    queue = get_log_queue()
+    return {"mode": TRANSACTION_LOG_MODE, **(queue.stats() if queue else {})}
+
+
+@router.get("/ledger", response_model=LedgerStats)
+def get_ledger_stats():
+    ledger = get_ledger()
+    return {"engine": PURCHASE_ENGINE if ledger else "db", **(ledger.stats() if ledger else {})}
+
+
+@router.get("/events")
+async def admin_events(machine_id: UUID | None = None):
+    # Every machine's events unless one is given.
+    if not PUSH_EVENTS:
+        raise HTTPException(404, "Push events are disabled")
+    return StreamingResponse(
+        event_hub.stream(machine_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/events/stats", response_model=EventHubStats)
+def get_event_stats():
+    return event_hub.stats()
+
+
+@router.get("/idempotency", response_model=IdempotencyStats)
+def get_idempotency_stats():
+    return idempotency_store.stats()
+
+
+@router.get("/analytics/buckets", response_model=list[SalesBucket])
+def list_sales_buckets(
+    period: Literal["hour", "day"] = "day",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    machine_id: UUID | None = None,
+    product_id: UUID | None = None,
+    service: AnalyticsService = Depends(get_analytics_service),
+):
+    return service.list_buckets(period, start, end, machine_id, product_id)
+
+
+@router.get("/analytics/summary", response_model=SalesSummary)
+def get_sales_summary(
+    period: Literal["hour", "day"] = "day",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    machine_id: UUID | None = None,
+    product_id: UUID | None = None,
+    service: AnalyticsService = Depends(get_analytics_service),
+):
+    return service.summary(period, start, end, machine_id, product_id)
+
+
+@router.get("/transactions", response_model=TransactionPage)
+def list_transactions(
+    machine_id: UUID | None = None,
+    product_id: UUID | None = None,
+    status: Literal["success", "cancel", "insufficient_balance"] | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    service: TransactionService = Depends(get_transaction_service),
+):
+    return service.list_transactions(
+        limit, machine_id, product_id, status, start, end, cursor
+    )
+
+
+@router.get("/transactions/export")
+def export_transaction_logs(
+    format: Literal["csv", "ndjson"] = "csv",
+    gzip: bool = False,
+    machine_id: UUID | None = None,
+    product_id: UUID | None = None,
+    status: Literal["success", "cancel", "insufficient_balance"] | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    filename = f"transactions.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_transactions(
+            format, gzip, machine_id, product_id, status, start, end
+        ),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.db.init_db import get_db
-from app.service.vending_service import VendingService
+from app.core.config import DB_MODE, PUSH_EVENTS
+from app.db.init_db import get_db, get_async_db
+from app.service.events import event_hub
+from app.service.machine_registry import machine_registry
+from app.service.vending_service import AsyncVendingService, VendingService
 from app.schemas.schemas import (
+    Machine,
     Product,
     PurchaseRequest,
     PurchaseResponse,
@@ -11,21 +19,82 @@ from app.schemas.schemas import (
 
 router = APIRouter(tags=["Vending"])
 
-def get_vending_service(
-    db: Session = Depends(get_db),
-) -> VendingService:
-    return VendingService(db)
+if DB_MODE == "async":
 
-@router.get("/products", response_model=list[Product])
-def get_products(
-    service: VendingService = Depends(get_vending_service),
-):
-    return service.get_products()
+    async def get_vending_service(
+        machine_id: UUID,
+        db: AsyncSession = Depends(get_async_db),
+    ) -> AsyncVendingService:
+        await machine_registry.aget(db, machine_id)
+        return AsyncVendingService(db, machine_id)
+
+    @router.get("/machines", response_model=list[Machine])
+    async def list_machines(db: AsyncSession = Depends(get_async_db)):
+        return await machine_registry.aall(db)
+
+
+    @router.get("/machines/{machine_id}/products", response_model=list[Product])
+    async def get_products(
+        service: AsyncVendingService = Depends(get_vending_service),
+    ):
+        return await service.get_products()
+
+
+    @router.post(
+        "/machines/{machine_id}/buy/product",
+        response_model=PurchaseResponse,
+    )
+    async def buy_product(
+        req: PurchaseRequest,
+        idempotency_key: str | None = Header(None, max_length=255),
+        service: AsyncVendingService = Depends(get_vending_service),
+    ):
+        return await service.buy_product(req, idempotency_key)
+
+else:
+
+    def get_vending_service(
+        machine_id: UUID,
+        db: Session = Depends(get_db),
+    ) -> VendingService:
+        machine_registry.get(db, machine_id)
+        return VendingService(db, machine_id)
+
+    @router.get("/machines", response_model=list[Machine])
+    def list_machines(db: Session = Depends(get_db)):
+        return machine_registry.all(db)
+
+
+    @router.get("/machines/{machine_id}/products", response_model=list[Product])
+    def get_products(
+        service: VendingService = Depends(get_vending_service),
+    ):
+        return service.get_products()
+
+
+    @router.post(
+        "/machines/{machine_id}/buy/product",
+        response_model=PurchaseResponse,
+    )
+    def buy_product(
+        req: PurchaseRequest,
+        idempotency_key: str | None = Header(None, max_length=255),
+        service: VendingService = Depends(get_vending_service),
+    ):
+        return service.buy_product(req, idempotency_key)
 
 
-@router.post("/buy/product", response_model=PurchaseResponse)
-def buy_product(
-    req: PurchaseRequest,
-    service: VendingService = Depends(get_vending_service),
+# Server-sent events for one machine: stock, price and float changes as
+# they commit, from any worker. Takes no database connection while open.
+@router.get("/machines/{machine_id}/events")
+async def machine_events(
+    machine_id: UUID,
+    service=Depends(get_vending_service),
 ):
-    return service.buy_product(req)
+    if not PUSH_EVENTS:
+        raise HTTPException(404, "Push events are disabled")
+    return StreamingResponse(
+        event_hub.stream(machine_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
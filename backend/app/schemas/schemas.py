@@ -1,6 +1,9 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, computed_field
 from typing import Optional, List, Literal
 from uuid import UUID
+from datetime import datetime
+
+from app.storage.images import variant_urls
 
 class Product(BaseModel):
     id: UUID
@@ -8,11 +11,22 @@ class Product(BaseModel):
     price: int
     stock: int
     image: str
+    exact_change_only: bool = False
+    max_accepted_note: Optional[int] = None
 
     model_config = ConfigDict(from_attributes=True)
 
+    # {"thumbnail"|"tile"|"full": {"webp"|"png": url}}, rendered in the
+    # background after upload; clients fall back to `image` until they exist.
+    @computed_field
+    @property
+    def image_variants(self) -> dict[str, dict[str, str]]:
+        return variant_urls(self.image)
+
 class AdminProduct(Product):
     total_sold: int
+    revenue: int = 0
+    last_sold_at: Optional[datetime] = None
 
 
 class ProductCreate(BaseModel):
@@ -28,6 +42,16 @@ class ProductUpdate(BaseModel):
     stock: Optional[int] = None
     image: Optional[str] = None
 
+class Machine(BaseModel):
+    id: UUID
+    name: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class MachineCreate(BaseModel):
+    name: str
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -58,9 +82,158 @@ class PurchaseResponse(BaseModel):
 
 
 class Balance(BaseModel):
-    id: UUID
     machine_id: UUID
     denomination: int
     amount: int
     type: Literal["coin", "banknote"]
 
+
+
+class HistogramSnapshot(BaseModel):
+    # Cumulative counts keyed by upper bound in seconds, plus "+Inf".
+    buckets: dict[str, int]
+    count: int
+    sum: float
+
+
+class PoolStatus(BaseModel):
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    max_overflow: int
+    checkouts: int
+    connects: int
+    connect_errors: int
+    invalidations: int
+    timeouts: int
+    wait_seconds: HistogramSnapshot
+    connect_seconds: HistogramSnapshot
+
+
+class LogQueueStats(BaseModel):
+    mode: Literal["sync", "queue"]
+    path: Optional[str] = None
+    depth: int = 0
+    oldest_seconds: float = 0.0
+    flushed: int = 0
+    discarded: int = 0
+    held: int = 0
+    batches: int = 0
+    flush_errors: int = 0
+    last_error: Optional[str] = None
+    lag_seconds: Optional[HistogramSnapshot] = None
+
+
+class LedgerStats(BaseModel):
+    engine: Literal["db", "ledger"]
+    machines: int = 0
+    purchases: int = 0
+    conflicts: int = 0
+    reloads: int = 0
+    batch_sizes: Optional[HistogramSnapshot] = None
+
+
+class EventHubStats(BaseModel):
+    listening: bool
+    subscribers: int
+    received: int
+    dropped: int
+
+
+class IdempotencyStats(BaseModel):
+    keys: int
+    in_flight: int
+    executed: int
+    replayed: int
+    recovered: int
+    waited: int
+
+
+class CatalogCacheStats(BaseModel):
+    entries: int
+    hits: int
+    misses: int
+    coalesced: int
+    invalidations: int
+    patches: int
+
+
+class SalesBucket(BaseModel):
+    period: Literal["hour", "day"]
+    bucket_start: datetime
+    machine_id: UUID
+    product_id: UUID
+    units: int
+    revenue: int
+    change_paid: int
+    refusals: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class SalesSummary(BaseModel):
+    start: datetime
+    end: datetime
+    units: int
+    revenue: int
+    change_paid: int
+    refusals: int
+
+
+class TransactionMoneyLine(BaseModel):
+    denomination: int
+    quantity: int
+    direction: Literal["inserted", "change"]
+
+
+class TransactionRecord(BaseModel):
+    id: UUID
+    machine_id: UUID
+    product_id: Optional[UUID]
+    product_price: int
+    paid_amount: int
+    change_amount: int
+    status: Literal["success", "cancel", "insufficient_balance"]
+    created_at: datetime
+    money: List[TransactionMoneyLine]
+
+
+class TransactionPage(BaseModel):
+    items: List[TransactionRecord]
+    # Pass back as ?cursor= for the next (older) page; None on the last one.
+    next_cursor: Optional[str] = None
+
+
+class ProductImport(BaseModel):
+    name: str
+    price: int = Field(ge=0)
+    image: Optional[str] = None
+
+
+class StockImport(BaseModel):
+    machine_id: UUID
+    product_id: UUID
+    stock: int = Field(ge=0)
+
+
+class BalanceImport(BaseModel):
+    machine_id: UUID
+    denomination: int
+    quantity: int = Field(ge=0)
+
+
+class ImportRowError(BaseModel):
+    # 1-based position among the data rows (the CSV header is not counted).
+    row: int
+    error: str
+
+
+class ImportResult(BaseModel):
+    applied: int
+    errors: List[ImportRowError]
+
+
+class ProductImportResult(ImportResult):
+    # Name -> id of every imported product, for the stock import.
+    products: dict[str, UUID]
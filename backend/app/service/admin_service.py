@@ -1,4 +1,6 @@
+from sqlalchemy import and_, func, select
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from fastapi import HTTPException
 from uuid import UUID
 
@@ -6,7 +8,7 @@ from app.models.models import (
     ProductModel,
     MachineProductModel,
     BalanceModel,
-    TransactionLogModel,
+    ProductSalesModel,
 )
 from app.schemas.schemas import (
     Product,
@@ -16,44 +18,62 @@ from app.schemas.schemas import (
     MoneyResponse,
     AdminProduct
 )
-from nanoid import generate
-from app.core.config import BASE_URL, DEFAULT_MACHINE_ID
+from app.core.config import BASE_URL
+from app.domain.money import DENOMINATIONS, denomination_type
+from app.service.catalog_cache import catalog_cache
+from app.service.events import notify
+from app.service.import_service import balance_upsert
 
 
 
 class AdminService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, machine_id: UUID):
         self.db = db
+        self.machine_id = machine_id
+
+    def _commit(self) -> None:
+        # Stock and float rows are versioned; a purchase that landed between
+        # our read and write makes the write stale.
+        try:
+            self.db.commit()
+        except StaleDataError:
+            self.db.rollback()
+            raise HTTPException(409, "Changed by a purchase, please retry")
     
-    def get_total_sold_by_id(self, product_id: UUID) -> int:
-        count = self.db.query(TransactionLogModel).filter(
-            TransactionLogModel.machine_id == DEFAULT_MACHINE_ID,
-            TransactionLogModel.product_id == product_id,
-        ).count()
-        print(count)
-        return count
-    
-    def list_products(self) -> list[AdminProduct]:
-        products = (
-            self.db.query(ProductModel, MachineProductModel)
+    def _products_query(self):
+        # Products with their machine row and sales totals in one query.
+        return (
+            self.db.query(ProductModel, MachineProductModel, ProductSalesModel)
             .join(
                 MachineProductModel,
                 ProductModel.id == MachineProductModel.product_id,
             )
-            .filter(MachineProductModel.machine_id == DEFAULT_MACHINE_ID)
-            .all()
+            .outerjoin(
+                ProductSalesModel,
+                and_(
+                    ProductSalesModel.machine_id == MachineProductModel.machine_id,
+                    ProductSalesModel.product_id == MachineProductModel.product_id,
+                ),
+            )
+            .filter(MachineProductModel.machine_id == self.machine_id)
         )
 
+    def _admin_product(self, p, mp, sales) -> AdminProduct:
+        return AdminProduct(
+            id=p.id,
+            name=p.name,
+            price=p.price,
+            stock=mp.stock,
+            image=f"{BASE_URL}{p.image}",
+            total_sold=sales.units_sold if sales else 0,
+            revenue=sales.revenue if sales else 0,
+            last_sold_at=sales.last_sold_at if sales else None,
+        )
+
+    def list_products(self) -> list[AdminProduct]:
         return [
-            AdminProduct(
-                id=p.id,
-                name=p.name,
-                price=p.price,
-                stock=mp.stock,
-                image=f"{BASE_URL}{p.image}",
-                total_sold=self.get_total_sold_by_id(p.id),
-            )
-            for p, mp in products
+            self._admin_product(p, mp, sales)
+            for p, mp, sales in self._products_query().all()
         ]
 
     def create_product(self, data: ProductCreate) -> Product:
@@ -66,13 +86,15 @@ class AdminService:
         self.db.flush() 
 
         machine_product = MachineProductModel(
-            machine_id=DEFAULT_MACHINE_ID,
+            machine_id=self.machine_id,
             product_id=product.id,
             stock=data.stock,
         )
         self.db.add(machine_product)
 
+        notify(self.db, [{"type": "catalog", "machine_id": self.machine_id}])
         self.db.commit()
+        catalog_cache.invalidate(self.machine_id)
         self.db.refresh(product)
 
         return Product(
@@ -91,11 +113,14 @@ class AdminService:
         stock: int,
         image: str | None = None,
     ) -> AdminProduct:
-        product = self.db.query(ProductModel).filter_by(id=product_id).first()
-        mp = self.db.query(MachineProductModel).filter_by(
-            product_id=product_id,
-            machine_id=DEFAULT_MACHINE_ID,
-        ).first()
+        row = (
+            self._products_query()
+            .filter(ProductModel.id == product_id)
+            .first()
+        )
+        if not row:
+            raise HTTPException(404, "Product not found")
+        product, mp, sales = row
 
         product.name = name
         product.price = price
@@ -104,45 +129,57 @@ class AdminService:
         if image:
             product.image = image
 
-        self.db.commit()
-
-        return AdminProduct(
-            id=product.id,
-            name=product.name,
-            price=product.price,
-            stock=mp.stock,
-            image=f"{BASE_URL}{product.image}",
-            total_sold=self.get_total_sold_by_id(product.id),
+        # Built before the commit expires the loaded rows.
+        response = self._admin_product(product, mp, sales)
+        notify(
+            self.db,
+            [
+                {
+                    "type": "product",
+                    "product_id": product_id,
+                    "name": response.name,
+                    "price": response.price,
+                    "image": response.image,
+                },
+                {
+                    "type": "stock",
+                    "machine_id": self.machine_id,
+                    "product_id": product_id,
+                    "stock": stock,
+                },
+            ],
         )
+        self._commit()
+        # Name and price are shared by every machine that sells it.
+        catalog_cache.invalidate()
+
+        return response
 
 
     def delete_product(self, product_id: UUID) -> None:
+        # Takes the product off this machine only; the catalog entry, other
+        # machines and the sales history are untouched (see ProductService).
         mp = (
             self.db.query(MachineProductModel)
             .filter(
-                MachineProductModel.machine_id == DEFAULT_MACHINE_ID,
+                MachineProductModel.machine_id == self.machine_id,
                 MachineProductModel.product_id == product_id,
             )
             .first()
         )
 
-        product = (
-            self.db.query(ProductModel)
-            .filter(ProductModel.id == product_id)
-            .first()
-        )
-
-        if not product or not mp:
+        if not mp:
             raise HTTPException(404, "Product not found")
 
         self.db.delete(mp)
-        self.db.delete(product)
-        self.db.commit()
+        notify(self.db, [{"type": "catalog", "machine_id": self.machine_id}])
+        self._commit()
+        catalog_cache.invalidate(self.machine_id)
 
     def list_balance(self) -> list[MoneyItem]:
         balances = (
             self.db.query(BalanceModel)
-            .filter(BalanceModel.machine_id == DEFAULT_MACHINE_ID)
+            .filter(BalanceModel.machine_id == self.machine_id)
             .all()
         )
 
@@ -156,37 +193,40 @@ class AdminService:
         ]
 
     def set_balance(self, items: list[MoneyItem]) -> list[MoneyItem]:
-        for item in items:
-            balance = (
-                self.db.query(BalanceModel)
-                .filter(
-                    BalanceModel.machine_id == DEFAULT_MACHINE_ID,
-                    BalanceModel.denomination == item.denomination,
-                )
-                .first()
+        if any(item.denomination not in DENOMINATIONS for item in items):
+            raise HTTPException(400, "Invalid denomination")
+
+        # The whole float in one upsert; a repeated denomination keeps its
+        # last quantity.
+        amounts = {item.denomination: item.quantity for item in items}
+        if amounts:
+            self.db.execute(
+                balance_upsert(),
+                [
+                    {
+                        "machine_id": self.machine_id,
+                        "denomination": denom,
+                        "amount": amount,
+                        "type": denomination_type(denom),
+                    }
+                    for denom, amount in amounts.items()
+                ],
             )
-
-            if balance:
-                balance.amount = item.quantity
-            else:
-                self.db.add(
-                    BalanceModel(
-                        id=generate(),
-                        machine_id=DEFAULT_MACHINE_ID,
-                        denomination=item.denomination,
-                        amount=item.quantity,
-                    )
-                )
-
         self.db.commit()
+        # The float decides the exact-change hints.
+        catalog_cache.invalidate(self.machine_id)
         return items
 
     def get_total_sold(self) -> int:
-        return self.db.query(TransactionLogModel).filter(
-            TransactionLogModel.machine_id == DEFAULT_MACHINE_ID
-        ).count()
+        return self.db.scalar(
+            select(func.coalesce(func.sum(ProductSalesModel.units_sold), 0)).where(
+                ProductSalesModel.machine_id == self.machine_id
+            )
+        )
 
     def get_total_earned(self) -> int:
-        return self.db.query(TransactionLogModel).filter(
-            TransactionLogModel.machine_id == DEFAULT_MACHINE_ID
-        ).sum(TransactionLogModel.amount)
\ No newline at end of file
+        return self.db.scalar(
+            select(func.coalesce(func.sum(ProductSalesModel.revenue), 0)).where(
+                ProductSalesModel.machine_id == self.machine_id
+            )
+        )
@@ -0,0 +1,95 @@
+from datetime import UTC, datetime, timedelta
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.models.models import SalesBucketModel
+from app.schemas.schemas import SalesBucket, SalesSummary
+
+DEFAULT_RANGE = {"hour": timedelta(days=1), "day": timedelta(days=30)}
+
+
+class AnalyticsService:
+    # Reads the sales_buckets rollup; every query is a range scan on its
+    # primary key (machine, period, bucket start), or on (period, bucket
+    # start) across the fleet, so its cost follows the number of buckets
+    # asked for, not the length of the history.
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _range(
+        self,
+        period: str,
+        start: datetime | None,
+        end: datetime | None,
+    ) -> tuple[datetime, datetime]:
+        # Naive datetimes are taken as UTC.
+        end = end or datetime.now(UTC)
+        start = start or end - DEFAULT_RANGE[period]
+        start, end = (
+            t if t.tzinfo else t.replace(tzinfo=UTC) for t in (start, end)
+        )
+        if start >= end:
+            raise HTTPException(400, "start must be before end")
+        return start, end
+
+    def _filters(self, period, start, end, machine_id, product_id):
+        filters = [
+            SalesBucketModel.period == period,
+            SalesBucketModel.bucket_start >= start,
+            SalesBucketModel.bucket_start < end,
+        ]
+        if machine_id:
+            filters.append(SalesBucketModel.machine_id == machine_id)
+        if product_id:
+            filters.append(SalesBucketModel.product_id == product_id)
+        return filters
+
+    def list_buckets(
+        self,
+        period: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        machine_id: UUID | None = None,
+        product_id: UUID | None = None,
+    ) -> list[SalesBucket]:
+        start, end = self._range(period, start, end)
+        buckets = self.db.scalars(
+            select(SalesBucketModel)
+            .where(*self._filters(period, start, end, machine_id, product_id))
+            .order_by(
+                SalesBucketModel.bucket_start,
+                SalesBucketModel.machine_id,
+                SalesBucketModel.product_id,
+            )
+        )
+        return [SalesBucket.model_validate(b) for b in buckets]
+
+    def summary(
+        self,
+        period: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        machine_id: UUID | None = None,
+        product_id: UUID | None = None,
+    ) -> SalesSummary:
+        start, end = self._range(period, start, end)
+        totals = self.db.execute(
+            select(
+                *(
+                    func.coalesce(func.sum(getattr(SalesBucketModel, name)), 0)
+                    for name in ("units", "revenue", "change_paid", "refusals")
+                )
+            ).where(*self._filters(period, start, end, machine_id, product_id))
+        ).one()
+        units, revenue, change_paid, refusals = totals
+        return SalesSummary(
+            start=start,
+            end=end,
+            units=units,
+            revenue=revenue,
+            change_paid=change_paid,
+            refusals=refusals,
+        )
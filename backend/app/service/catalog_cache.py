@@ -0,0 +1,235 @@
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable
+from uuid import UUID
+
+from app.core.config import CATALOG_CACHE_TTL
+from app.schemas.schemas import Product
+
+# A loader returns (product rows, balance rows) for one machine:
+#   products: id, name, price, image, stock, version
+#   balance:  denomination, amount, version
+CatalogRows = tuple[list, list]
+
+
+class CatalogEntry:
+    # One machine's catalog as last seen. Stock and float rows carry their
+    # version column, so a patch from an older purchase never overwrites a
+    # newer value.
+    __slots__ = ("products", "stock", "balance", "loaded_at", "_catalog")
+
+    def __init__(self, products, balance_rows):
+        self.products = {p.id: (p.name, p.price, p.image) for p in products}
+        self.stock = {p.id: (p.stock, p.version) for p in products}
+        self.balance = {
+            b.denomination: (b.amount, b.version) for b in balance_rows
+        }
+        self.loaded_at = time.monotonic()
+        self._catalog: list[Product] | None = None
+
+    def catalog(self, build) -> list[Product]:
+        if self._catalog is None:
+            rows = [
+                (product_id, name, price, image, self.stock[product_id][0])
+                for product_id, (name, price, image) in self.products.items()
+            ]
+            pairs = [(d, amount) for d, (amount, _) in self.balance.items()]
+            self._catalog = build(rows, pairs)
+        return self._catalog
+
+    def patch(self, stock_rows, balance_rows, product_id: UUID) -> None:
+        for stock, version, *_ in stock_rows:
+            current = self.stock.get(product_id)
+            if current is not None and version > current[1]:
+                self.stock[product_id] = (stock, version)
+
+        for denom, amount, version, *_ in balance_rows:
+            current = self.balance.get(denom)
+            if current is None or version > current[1]:
+                self.balance[denom] = (amount, version)
+
+        self._catalog = None
+
+
+class _Flight:
+    # A load in progress that other sync callers wait on.
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class CatalogCache:
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self.patches = 0
+        self._entries: dict[UUID, CatalogEntry] = {}
+        self._loading: dict[UUID, _Flight] = {}
+        self._async_loading: dict[UUID, asyncio.Future] = {}
+        # Bumped by every change the cache cannot apply in place; a load
+        # that started before the bump is served but not stored.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _fresh(self, machine_id: UUID) -> CatalogEntry | None:
+        entry = self._entries.get(machine_id)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+            return entry
+        return None
+
+    def _store(self, machine_id: UUID, rows: CatalogRows, generation: int):
+        entry = CatalogEntry(*rows)
+        if generation == self._generation:
+            self._entries[machine_id] = entry
+        return entry
+
+    def get(
+        self,
+        machine_id: UUID,
+        load: Callable[[], CatalogRows],
+        build,
+    ) -> list[Product]:
+        with self._lock:
+            entry = self._fresh(machine_id)
+            if entry is not None:
+                self.hits += 1
+                return entry.catalog(build)
+
+            flight = self._loading.get(machine_id)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._loading[machine_id] = _Flight()
+                generation = self._generation
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            rows = load()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                entry = self._store(machine_id, rows, generation)
+            flight.result = entry.catalog(build)
+            return flight.result
+        finally:
+            with self._lock:
+                self._loading.pop(machine_id, None)
+            flight.done.set()
+
+    async def aget(
+        self,
+        machine_id: UUID,
+        load: Callable[[], Awaitable[CatalogRows]],
+        build,
+    ) -> list[Product]:
+        # Same as get() for the event loop: waiters await the leader's
+        # future instead of blocking a thread.
+        with self._lock:
+            entry = self._fresh(machine_id)
+            if entry is not None:
+                self.hits += 1
+                return entry.catalog(build)
+
+            flight = self._async_loading.get(machine_id)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = asyncio.get_running_loop().create_future()
+                self._async_loading[machine_id] = flight
+                generation = self._generation
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # Shielded so a cancelled waiter doesn't cancel everyone's load.
+            return await asyncio.shield(flight)
+
+        try:
+            rows = await load()
+        except BaseException as e:
+            flight.set_exception(e)
+            # Mark it retrieved in case nobody else was waiting.
+            flight.exception()
+            raise
+        else:
+            with self._lock:
+                entry = self._store(machine_id, rows, generation)
+            flight.set_result(entry.catalog(build))
+            return flight.result()
+        finally:
+            with self._lock:
+                self._async_loading.pop(machine_id, None)
+
+    def apply_purchase(
+        self,
+        machine_id: UUID,
+        product_id: UUID,
+        stock_rows,
+        balance_rows,
+    ) -> None:
+        # Rows come from the purchase's own UPDATE ... RETURNING, so they
+        # are what the database holds after it committed.
+        with self._lock:
+            entry = self._entries.get(machine_id)
+            if entry is None:
+                self._generation += 1
+                return
+            entry.patch(stock_rows, balance_rows, product_id)
+            self.patches += 1
+
+    def apply_remote(
+        self,
+        machine_id: UUID,
+        product_id: UUID | None,
+        stock_rows,
+        balance_rows,
+    ) -> None:
+        # A write made through another worker. Nothing to do when this
+        # worker has not loaded the machine; unlike a local purchase it
+        # does not hold back loads in flight, as it is one of many.
+        with self._lock:
+            entry = self._entries.get(machine_id)
+            if entry is not None:
+                entry.patch(stock_rows, balance_rows, product_id)
+                self.patches += 1
+
+    def invalidate(self, machine_id: UUID | None = None) -> None:
+        # None drops every machine, e.g. after a product's name or price
+        # changed.
+        with self._lock:
+            if machine_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(machine_id, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations,
+                "patches": self.patches,
+            }
+
+
+catalog_cache = CatalogCache()
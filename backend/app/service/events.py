@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+from typing import Callable
+from uuid import UUID
+
+from sqlalchemy import String, cast, func, literal_column, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    DATABASE_URL,
+    EVENT_KEEPALIVE,
+    EVENT_QUEUE_SIZE,
+    PUSH_EVENTS,
+)
+from app.service.catalog_cache import catalog_cache
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "vending_events"
+
+# Events (JSON objects with a "type"):
+#   stock    machine_id, product_id, stock[, version]
+#   balance  machine_id, denomination, amount[, version]
+#   product  product_id, name, price, image      (every machine)
+#   catalog  machine_id or null                  (re-read the catalog)
+#   resync   sent to a client that may have missed events
+
+
+def notify_columns(kind: str, **fields) -> list:
+    # pg_notify(...) as an extra RETURNING column: the event carries the
+    # row's new values and goes out when, and only if, the transaction
+    # commits. Empty when push is off.
+    if not PUSH_EVENTS:
+        return []
+    pairs = [literal_column("'type'"), literal_column(f"'{kind}'")]
+    for key, value in fields.items():
+        pairs += [literal_column(f"'{key}'"), value]
+    return [func.pg_notify(CHANNEL, cast(func.json_build_object(*pairs), String))]
+
+
+def notify(db: Session, events: list[dict]) -> None:
+    # For writes that have no RETURNING to ride on; one statement for all.
+    if not PUSH_EVENTS or not events:
+        return
+    db.execute(
+        text(
+            "SELECT pg_notify(:channel, payload) "
+            "FROM unnest(CAST(:payloads AS text[])) AS payload"
+        ),
+        {
+            "channel": CHANNEL,
+            "payloads": [json.dumps(e, default=str) for e in events],
+        },
+    )
+
+
+def _apply_to_cache(event: dict) -> None:
+    # Keeps this worker's catalog cache in step with writes made through
+    # the others. Versioned rows are patched in place; anything else drops
+    # the machine (or, without one, every machine).
+    kind = event.get("type")
+    machine_id = event.get("machine_id")
+    machine_id = UUID(machine_id) if machine_id else None
+    if "version" in event and machine_id is not None:
+        if kind == "stock":
+            catalog_cache.apply_remote(
+                machine_id,
+                UUID(event["product_id"]),
+                [(event["stock"], event["version"])],
+                [],
+            )
+            return
+        if kind == "balance":
+            catalog_cache.apply_remote(
+                machine_id,
+                None,
+                [],
+                [(event["denomination"], event["amount"], event["version"])],
+            )
+            return
+    catalog_cache.invalidate(machine_id)
+
+
+def _frame(kind: str, data: str) -> str:
+    return f"event: {kind}\ndata: {data}\n\n"
+
+
+RESYNC = _frame("resync", "{}")
+
+
+class EventHub:
+    # Fans notifications out to this worker's SSE clients. A client is an
+    # asyncio.Queue of ready-made frames: idle ones hold no connection to
+    # Postgres and wake only for a keep-alive comment.
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.received = 0
+        self.dropped = 0
+        self.connected = False
+        self._subscribers: dict[str | None, set[asyncio.Queue]] = {}
+        # In-process consumers called with every event, e.g. the ledger.
+        self._hooks: list[Callable[[dict], None]] = []
+        self._task: asyncio.Task | None = None
+
+    def add_hook(self, hook: Callable[[dict], None]) -> None:
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[dict], None]) -> None:
+        if hook in self._hooks:
+            self._hooks.remove(hook)
+
+    def subscribe(self, machine_id: UUID | None) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        key = str(machine_id) if machine_id else None
+        self._subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, machine_id: UUID | None, queue: asyncio.Queue) -> None:
+        key = str(machine_id) if machine_id else None
+        queues = self._subscribers.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[key]
+
+    def _put(self, queue: asyncio.Queue, frame: str) -> None:
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Too far behind to catch up event by event.
+            self.dropped += 1
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+    def publish(self, payload: str) -> None:
+        self.received += 1
+        event = json.loads(payload)
+        _apply_to_cache(event)
+        for hook in self._hooks:
+            hook(event)
+
+        frame = _frame(event["type"], payload)
+        machine_id = event.get("machine_id")
+        # Fleet-wide events reach every client; the others reach the
+        # machine's clients and the fleet-wide ones.
+        targets = list(self._subscribers) if machine_id is None else [machine_id, None]
+        for key in targets:
+            for queue in self._subscribers.get(key, ()):
+                self._put(queue, frame)
+
+    def resync(self) -> None:
+        catalog_cache.invalidate()
+        for hook in self._hooks:
+            hook({"type": "resync"})
+        for queues in self._subscribers.values():
+            for queue in queues:
+                self._put(queue, RESYNC)
+
+    async def stream(self, machine_id: UUID | None = None):
+        queue = self.subscribe(machine_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(machine_id, queue)
+
+    async def _listen(self, dsn: str) -> None:
+        import psycopg
+
+        delay = 1.0
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(dsn, autocommit=True)
+                async with conn:
+                    await conn.execute(f"LISTEN {CHANNEL}")
+                    delay = 1.0
+                    self.connected = True
+                    # Whatever happened while we were not listening is lost.
+                    self.resync()
+                    async for notification in conn.notifies():
+                        try:
+                            self.publish(notification.payload)
+                        except Exception:
+                            logger.exception("bad event %r", notification.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("event listener lost its connection")
+            self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def start(self, dsn: str | None = None) -> None:
+        if not PUSH_EVENTS or self._task is not None:
+            return
+        # psycopg wants a plain libpq URL, without SQLAlchemy's driver name.
+        url = make_url(dsn or DATABASE_URL).set(drivername="postgresql")
+        dsn = url.render_as_string(hide_password=False)
+        self._task = asyncio.get_running_loop().create_task(self._listen(dsn))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "listening": self.connected,
+            "subscribers": sum(len(q) for q in self._subscribers.values()),
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+event_hub = EventHub()
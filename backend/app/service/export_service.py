@@ -0,0 +1,168 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import Callable, Iterator
+from uuid import UUID
+
+from sqlalchemy import String, cast, func, literal_column, select, true
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+
+from app.core.config import EXPORT_BATCH_SIZE
+from app.db.database import SessionLocal
+from app.models.models import TransactionLogModel, TransactionMoneyModel
+from app.service.transaction_service import _filtered
+
+CSV_COLUMNS = [
+    "id",
+    "machine_id",
+    "product_id",
+    "product_price",
+    "paid_amount",
+    "change_amount",
+    "status",
+    "created_at",
+    "inserted",
+    "change",
+]
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _money_lines(log, fmt: str):
+    # Money lines of one log row, already in output form, so rows can be
+    # written as they arrive instead of being grouped in Python.
+    money = TransactionMoneyModel
+    lines = select().where(money.transaction_id == log.id)
+
+    if fmt == "csv":
+        def joined(direction):
+            return (
+                func.string_agg(
+                    func.concat(money.denomination, "x", money.quantity),
+                    aggregate_order_by(
+                        literal_column("' '"),
+                        money.denomination.desc(),
+                    ),
+                )
+                .filter(money.direction == direction)
+                .label(direction)
+            )
+
+        return lines.add_columns(joined("inserted"), joined("change"))
+
+    line = func.json_build_object(
+        "denomination", money.denomination,
+        "quantity", money.quantity,
+        "direction", money.direction,
+    )
+    return lines.add_columns(
+        func.json_agg(
+            aggregate_order_by(line, money.direction, money.denomination.desc())
+        ).label("money")
+    )
+
+
+def _export_query(fmt, machine_id, product_id, status, start, end):
+    # Postgres renders ids as text and, for NDJSON, the whole line; that
+    # leaves Python little more than joining strings.
+    log = TransactionLogModel
+    money = _money_lines(log, fmt).lateral("money")
+
+    if fmt == "csv":
+        columns = [
+            cast(log.id, String),
+            cast(log.machine_id, String),
+            cast(log.product_id, String),
+            log.product_price,
+            log.paid_amount,
+            log.change_amount,
+            log.status,
+            log.created_at,
+            money.c.inserted,
+            money.c.change,
+        ]
+    else:
+        columns = [
+            cast(
+                func.json_build_object(
+                    "id", log.id,
+                    "machine_id", log.machine_id,
+                    "product_id", log.product_id,
+                    "product_price", log.product_price,
+                    "paid_amount", log.paid_amount,
+                    "change_amount", log.change_amount,
+                    "status", log.status,
+                    "created_at", log.created_at,
+                    "money", func.coalesce(money.c.money, func.json_build_array()),
+                ),
+                String,
+            )
+        ]
+
+    query = select(*columns).select_from(log).join(money, true())
+    query = _filtered(query, machine_id, product_id, status, start, end)
+    return query.order_by(log.machine_id, log.created_at, log.id)
+
+
+def _csv_chunk(rows) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        *fields, created_at, inserted, change = row
+        writer.writerow(
+            [
+                *fields,
+                created_at.isoformat() if created_at else "",
+                inserted or "",
+                change or "",
+            ]
+        )
+    return out.getvalue()
+
+
+def _ndjson_chunk(rows) -> str:
+    return "".join(line + "\n" for line, in rows)
+
+
+def export_transactions(
+    fmt: str = "csv",
+    compress: bool = False,
+    machine_id: UUID | None = None,
+    product_id: UUID | None = None,
+    status: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> Iterator[bytes]:
+    # Streams the export in chunks of `batch_size` rows read from a
+    # server-side cursor, so memory stays flat however large it gets. The
+    # generator owns its session: request-scoped ones are closed before a
+    # streaming body is sent.
+    encode = _csv_chunk if fmt == "csv" else _ndjson_chunk
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(text: str) -> bytes:
+        data = text.encode()
+        return gzip.compress(data) if gzip else data
+
+    db = session_factory()
+    try:
+        if fmt == "csv":
+            yield emit(",".join(CSV_COLUMNS) + "\r\n")
+
+        result = db.execute(
+            _export_query(fmt, machine_id, product_id, status, start, end),
+            execution_options={"yield_per": batch_size},
+        )
+        for rows in result.partitions():
+            chunk = emit(encode(rows))
+            if chunk:
+                yield chunk
+
+        if gzip:
+            yield gzip.flush()
+    finally:
+        db.close()
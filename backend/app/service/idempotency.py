@@ -0,0 +1,377 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Awaitable, Callable, Hashable
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    IDEMPOTENCY_MAX_KEYS,
+    IDEMPOTENCY_RETENTION,
+    IDEMPOTENCY_TTL,
+)
+from app.models.models import IdempotencyKeyModel
+from app.schemas.schemas import PurchaseResponse
+
+# Refusals the customer would get again for the same request (sold out,
+# can't make change, unknown product). 409 "busy" and errors from the
+# database are not stored, so a retry with the same key tries again.
+STORED_ERRORS = (400, 404)
+
+# How often a worker deletes rows past IDEMPOTENCY_RETENTION, in seconds.
+PRUNE_INTERVAL = 3600
+
+Outcome = PurchaseResponse | HTTPException
+
+
+class DuplicateKey(Exception):
+    # Raised by a purchase (after rolling back) whose key another worker
+    # committed first; the store answers with that worker's outcome.
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class IdempotencyClaim:
+    # Written with the purchase it belongs to, so the key is taken if and
+    # only if the purchase (or the stored refusal) committed.
+    machine_id: UUID
+    key: str
+    fingerprint: str
+
+    def row(self, outcome: Outcome) -> dict:
+        if isinstance(outcome, HTTPException):
+            status_code, body = outcome.status_code, {"detail": outcome.detail}
+        else:
+            status_code, body = 200, outcome.model_dump(mode="json")
+        return {
+            "machine_id": self.machine_id,
+            "key": self.key,
+            "fingerprint": self.fingerprint,
+            "status_code": status_code,
+            "body": body,
+        }
+
+
+def _cutoff():
+    return func.now() - timedelta(seconds=IDEMPOTENCY_RETENTION)
+
+
+def claims_insert(rows: list[dict]):
+    # Returns the keys it took. A key held by an uncommitted purchase is
+    # waited on; one held by a committed purchase is left alone unless it
+    # is past retention.
+    stmt = insert(IdempotencyKeyModel).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKeyModel.machine_id, IdempotencyKeyModel.key],
+        set_={
+            "fingerprint": stmt.excluded.fingerprint,
+            "status_code": stmt.excluded.status_code,
+            "body": stmt.excluded.body,
+            "created_at": func.now(),
+        },
+        where=IdempotencyKeyModel.created_at < _cutoff(),
+    ).returning(IdempotencyKeyModel.key)
+
+
+def claim_write(claim: IdempotencyClaim, outcome: Outcome):
+    return claims_insert([claim.row(outcome)])
+
+
+def _lookup_query(machine_id: UUID, idempotency_key: str):
+    return select(
+        IdempotencyKeyModel.fingerprint,
+        IdempotencyKeyModel.status_code,
+        IdempotencyKeyModel.body,
+    ).where(
+        IdempotencyKeyModel.machine_id == machine_id,
+        IdempotencyKeyModel.key == idempotency_key,
+        IdempotencyKeyModel.created_at >= _cutoff(),
+    )
+
+
+def _prune_statement():
+    return delete(IdempotencyKeyModel).where(
+        IdempotencyKeyModel.created_at < _cutoff()
+    )
+
+
+def _mismatch() -> HTTPException:
+    return HTTPException(
+        status_code=422,
+        detail="Idempotency-Key was already used for a different purchase",
+    )
+
+
+def _in_progress() -> HTTPException:
+    # The key was taken but its row has since expired: too late to replay.
+    return HTTPException(
+        status_code=409,
+        detail="Idempotency-Key is in use, please retry",
+    )
+
+
+def _settle(outcome: Outcome) -> PurchaseResponse:
+    if isinstance(outcome, HTTPException):
+        raise outcome
+    return outcome
+
+
+class _Pending:
+    # A purchase in progress that duplicates on other threads wait on.
+    __slots__ = ("fingerprint", "done", "result", "error")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result: PurchaseResponse | None = None
+        self.error: BaseException | None = None
+
+
+class IdempotencyStore:
+    # Outcomes of purchases by (machine, Idempotency-Key). Given a session,
+    # the idempotency_keys table is the record: a key missing from memory is
+    # looked up there before purchasing, and the purchase writes its claim
+    # in its own transaction. In memory are the outcomes of recent keys,
+    # kept for `ttl` seconds and at most `max_keys` of them, oldest dropped
+    # first, and the purchases in flight in this process. A key is bound to
+    # the request it first came with (its fingerprint); reusing it for
+    # another purchase is rejected.
+    def __init__(
+        self,
+        ttl: float = IDEMPOTENCY_TTL,
+        max_keys: int = IDEMPOTENCY_MAX_KEYS,
+    ):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.executed = 0
+        self.replayed = 0
+        self.recovered = 0
+        self.waited = 0
+        self._pruned_at = time.monotonic()
+        self._outcomes: OrderedDict[tuple, tuple[float, Hashable, Outcome]] = (
+            OrderedDict()
+        )
+        self._pending: dict[tuple, _Pending] = {}
+        self._async_pending: dict[tuple, tuple[Hashable, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+
+    def _stored(self, key: tuple, fingerprint: Hashable) -> Outcome | None:
+        stored = self._outcomes.get(key)
+        if stored is None:
+            return None
+        expires_at, stored_fingerprint, outcome = stored
+        if expires_at <= time.monotonic():
+            del self._outcomes[key]
+            return None
+        if stored_fingerprint != fingerprint:
+            raise _mismatch()
+        self.replayed += 1
+        return outcome
+
+    def _store(self, key: tuple, fingerprint: Hashable, outcome: Outcome) -> None:
+        if isinstance(outcome, HTTPException) and (
+            outcome.status_code not in STORED_ERRORS
+        ):
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes[key] = (now + self.ttl, fingerprint, outcome)
+            self._outcomes.move_to_end(key)
+            # Every entry lives for the same ttl, so the oldest is at the
+            # front.
+            while self._outcomes:
+                oldest_key, (expires_at, _, _) = next(iter(self._outcomes.items()))
+                if expires_at > now and len(self._outcomes) <= self.max_keys:
+                    break
+                del self._outcomes[oldest_key]
+
+    def _due_prune(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned_at < PRUNE_INTERVAL:
+                return False
+            self._pruned_at = now
+            return True
+
+    def _recorded(self, row, fingerprint: Hashable) -> Outcome | None:
+        if row is None:
+            return None
+        stored_fingerprint, status_code, body = row
+        if stored_fingerprint != fingerprint:
+            raise _mismatch()
+        self.recovered += 1
+        if status_code == 200:
+            return PurchaseResponse.model_validate(body)
+        return HTTPException(status_code=status_code, detail=body["detail"])
+
+    def _execute(
+        self,
+        key: tuple,
+        fingerprint: Hashable,
+        purchase: Callable[[], PurchaseResponse],
+        db: Session | None,
+    ) -> PurchaseResponse:
+        if db is None:
+            return purchase()
+        if self._due_prune():
+            db.execute(_prune_statement())
+            db.commit()
+        outcome = self._recorded(db.execute(_lookup_query(*key)).first(), fingerprint)
+        if outcome is not None:
+            return _settle(outcome)
+        try:
+            return purchase()
+        except DuplicateKey:
+            outcome = self._recorded(
+                db.execute(_lookup_query(*key)).first(), fingerprint
+            )
+            if outcome is None:
+                raise _in_progress()
+            return _settle(outcome)
+
+    async def _aexecute(
+        self,
+        key: tuple,
+        fingerprint: Hashable,
+        purchase: Callable[[], Awaitable[PurchaseResponse]],
+        db: AsyncSession | None,
+    ) -> PurchaseResponse:
+        if db is None:
+            return await purchase()
+        if self._due_prune():
+            await db.execute(_prune_statement())
+            await db.commit()
+        row = (await db.execute(_lookup_query(*key))).first()
+        outcome = self._recorded(row, fingerprint)
+        if outcome is not None:
+            return _settle(outcome)
+        try:
+            return await purchase()
+        except DuplicateKey:
+            row = (await db.execute(_lookup_query(*key))).first()
+            outcome = self._recorded(row, fingerprint)
+            if outcome is None:
+                raise _in_progress()
+            return _settle(outcome)
+
+    def run(
+        self,
+        machine_id: UUID,
+        idempotency_key: str,
+        fingerprint: Hashable,
+        purchase: Callable[[], PurchaseResponse],
+        db: Session | None = None,
+    ) -> PurchaseResponse:
+        key = (machine_id, idempotency_key)
+        with self._lock:
+            outcome = self._stored(key, fingerprint)
+            if outcome is not None:
+                return _settle(outcome)
+
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                self.executed += 1
+                pending = self._pending[key] = _Pending(fingerprint)
+            elif pending.fingerprint != fingerprint:
+                raise _mismatch()
+            else:
+                self.waited += 1
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            pending.result = self._execute(key, fingerprint, purchase, db)
+        except HTTPException as e:
+            pending.error = e
+            self._store(key, fingerprint, e)
+            raise
+        except BaseException as e:
+            pending.error = e
+            raise
+        else:
+            self._store(key, fingerprint, pending.result)
+            return pending.result
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.done.set()
+
+    async def arun(
+        self,
+        machine_id: UUID,
+        idempotency_key: str,
+        fingerprint: Hashable,
+        purchase: Callable[[], Awaitable[PurchaseResponse]],
+        db: AsyncSession | None = None,
+    ) -> PurchaseResponse:
+        # Same as run() for the event loop: duplicates await the first
+        # request's future instead of blocking a thread.
+        key = (machine_id, idempotency_key)
+        with self._lock:
+            outcome = self._stored(key, fingerprint)
+            if outcome is not None:
+                return _settle(outcome)
+
+            pending = self._async_pending.get(key)
+            leader = pending is None
+            if leader:
+                self.executed += 1
+                future = asyncio.get_running_loop().create_future()
+                self._async_pending[key] = (fingerprint, future)
+            elif pending[0] != fingerprint:
+                raise _mismatch()
+            else:
+                self.waited += 1
+                future = pending[1]
+
+        if not leader:
+            # Shielded so a cancelled duplicate doesn't cancel the purchase.
+            return await asyncio.shield(future)
+
+        try:
+            result = await self._aexecute(key, fingerprint, purchase, db)
+        except BaseException as e:
+            if isinstance(e, HTTPException):
+                self._store(key, fingerprint, e)
+            future.set_exception(e)
+            # Mark it retrieved in case nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            self._store(key, fingerprint, result)
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._async_pending.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._outcomes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._outcomes),
+                "in_flight": len(self._pending) + len(self._async_pending),
+                "executed": self.executed,
+                "replayed": self.replayed,
+                "recovered": self.recovered,
+                "waited": self.waited,
+            }
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,290 @@
+import csv
+import io
+import json
+from datetime import UTC, datetime
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.domain.money import DENOMINATIONS, denomination_type
+from app.models.models import (
+    BalanceModel,
+    MachineModel,
+    MachineProductModel,
+    ProductModel,
+)
+from app.schemas.schemas import (
+    BalanceImport,
+    ImportResult,
+    ImportRowError,
+    ProductImport,
+    ProductImportResult,
+    StockImport,
+)
+from app.service.catalog_cache import catalog_cache
+from app.service.events import notify, notify_columns
+
+
+def parse_rows(content_type: str, body: bytes) -> list[dict]:
+    # A JSON array of objects, or CSV with a header row.
+    if content_type.startswith("text/csv"):
+        try:
+            reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+            # Empty cells are missing values, not empty strings.
+            return [
+                {k: v for k, v in row.items() if v not in ("", None)}
+                for row in reader
+            ]
+        except (UnicodeDecodeError, csv.Error):
+            raise HTTPException(400, "Invalid CSV")
+
+    try:
+        rows = json.loads(body)
+    except ValueError:
+        raise HTTPException(400, "Invalid JSON")
+    if not isinstance(rows, list):
+        raise HTTPException(400, "Expected a JSON array of rows")
+    return rows
+
+
+def _with_events(stmt, kind: str, **fields):
+    # One push event per written row.
+    columns = notify_columns(kind, **fields)
+    return stmt.returning(*columns) if columns else stmt
+
+
+def balance_upsert():
+    # Executed with a list of rows: psycopg2 sends them as multi-row
+    # INSERTs, a page at a time. The version bump keeps purchases' cache
+    # patches from going back past the new amounts.
+    stmt = insert(BalanceModel)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[BalanceModel.machine_id, BalanceModel.denomination],
+        set_={
+            "amount": stmt.excluded.amount,
+            "version": BalanceModel.version + 1,
+        },
+    )
+    return _with_events(
+        stmt,
+        "balance",
+        machine_id=BalanceModel.machine_id,
+        denomination=BalanceModel.denomination,
+        amount=BalanceModel.amount,
+        version=BalanceModel.version,
+    )
+
+
+def stock_upsert():
+    stmt = insert(MachineProductModel)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            MachineProductModel.machine_id,
+            MachineProductModel.product_id,
+        ],
+        set_={
+            "stock": stmt.excluded.stock,
+            "version": MachineProductModel.version + 1,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    return _with_events(
+        stmt,
+        "stock",
+        machine_id=MachineProductModel.machine_id,
+        product_id=MachineProductModel.product_id,
+        stock=MachineProductModel.stock,
+        version=MachineProductModel.version,
+    )
+
+
+def _error(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}"
+        for err in e.errors()
+    )
+
+
+class ImportService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _validate(
+        self,
+        schema: type[BaseModel],
+        rows: list,
+        key,
+    ) -> tuple[list[tuple[int, BaseModel]], list[ImportRowError]]:
+        valid, errors, seen = [], [], {}
+        for n, row in enumerate(rows, start=1):
+            try:
+                item = schema.model_validate(row)
+            except ValidationError as e:
+                errors.append(ImportRowError(row=n, error=_error(e)))
+                continue
+            # One statement may not update the same row twice.
+            k = key(item)
+            if k in seen:
+                errors.append(
+                    ImportRowError(row=n, error=f"Duplicate of row {seen[k]}")
+                )
+                continue
+            seen[k] = n
+            valid.append((n, item))
+        return valid, errors
+
+    def _existing(self, column, ids: set) -> set:
+        if not ids:
+            return set()
+        return set(self.db.scalars(select(column).where(column.in_(ids))))
+
+    def _drop_unknown(self, valid, errors, field, known, message):
+        kept = []
+        for n, item in valid:
+            if getattr(item, field) in known:
+                kept.append((n, item))
+            else:
+                errors.append(ImportRowError(row=n, error=message))
+        return kept
+
+    def import_products(self, rows: list) -> ProductImportResult:
+        # Keyed on name: existing products get the new price (and image,
+        # if given), the others are created.
+        valid, errors = self._validate(ProductImport, rows, lambda p: p.name)
+
+        names = {p.name for _, p in valid}
+        existing = {}
+        if names:
+            existing = dict(
+                self.db.execute(
+                    select(ProductModel.name, ProductModel.id).where(
+                        ProductModel.name.in_(names)
+                    )
+                ).all()
+            )
+
+        now = datetime.now(UTC)
+        created, updated = [], []
+        for _, p in valid:
+            if p.name in existing:
+                updated.append(
+                    {
+                        "_id": existing[p.name],
+                        "_price": p.price,
+                        "_image": p.image,
+                        "_updated_at": now,
+                    }
+                )
+            else:
+                existing[p.name] = uuid4()
+                created.append(
+                    {
+                        "id": existing[p.name],
+                        "name": p.name,
+                        "price": p.price,
+                        "image": p.image or "",
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                )
+
+        if created:
+            self.db.execute(insert(ProductModel), created)
+        if updated:
+            table = ProductModel.__table__
+            self.db.execute(
+                update(table)
+                .where(table.c.id == bindparam("_id"))
+                .values(
+                    price=bindparam("_price"),
+                    image=func.coalesce(bindparam("_image"), table.c.image),
+                    updated_at=bindparam("_updated_at"),
+                ),
+                updated,
+            )
+        if valid:
+            notify(self.db, [{"type": "catalog", "machine_id": None}])
+        self.db.commit()
+        if valid:
+            # Names and prices are shared by every machine.
+            catalog_cache.invalidate()
+
+        errors.sort(key=lambda e: e.row)
+        return ProductImportResult(
+            applied=len(valid),
+            errors=errors,
+            products={p.name: existing[p.name] for _, p in valid},
+        )
+
+    def import_stock(self, rows: list) -> ImportResult:
+        valid, errors = self._validate(
+            StockImport, rows, lambda s: (s.machine_id, s.product_id)
+        )
+        machines = self._existing(MachineModel.id, {s.machine_id for _, s in valid})
+        valid = self._drop_unknown(
+            valid, errors, "machine_id", machines, "Machine not found"
+        )
+        products = self._existing(ProductModel.id, {s.product_id for _, s in valid})
+        valid = self._drop_unknown(
+            valid, errors, "product_id", products, "Product not found"
+        )
+
+        now = datetime.now(UTC)
+        if valid:
+            self.db.execute(
+                stock_upsert(),
+                [
+                    {
+                        "machine_id": s.machine_id,
+                        "product_id": s.product_id,
+                        "stock": s.stock,
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                    for _, s in valid
+                ],
+            )
+        self.db.commit()
+        self._invalidate({s.machine_id for _, s in valid})
+
+        errors.sort(key=lambda e: e.row)
+        return ImportResult(applied=len(valid), errors=errors)
+
+    def import_balances(self, rows: list) -> ImportResult:
+        valid, errors = self._validate(
+            BalanceImport, rows, lambda b: (b.machine_id, b.denomination)
+        )
+        valid = self._drop_unknown(
+            valid, errors, "denomination", DENOMINATIONS, "Invalid denomination"
+        )
+        machines = self._existing(MachineModel.id, {b.machine_id for _, b in valid})
+        valid = self._drop_unknown(
+            valid, errors, "machine_id", machines, "Machine not found"
+        )
+
+        if valid:
+            self.db.execute(
+                balance_upsert(),
+                [
+                    {
+                        "machine_id": b.machine_id,
+                        "denomination": b.denomination,
+                        "amount": b.quantity,
+                        "type": denomination_type(b.denomination),
+                    }
+                    for _, b in valid
+                ],
+            )
+        self.db.commit()
+        self._invalidate({b.machine_id for _, b in valid})
+
+        errors.sort(key=lambda e: e.row)
+        return ImportResult(applied=len(valid), errors=errors)
+
+    def _invalidate(self, machine_ids: set[UUID]) -> None:
+        for machine_id in machine_ids:
+            catalog_cache.invalidate(machine_id)
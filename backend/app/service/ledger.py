@@ -0,0 +1,650 @@
+import logging
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import Integer, column, select, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import (
+    LEDGER_MAX_BATCH,
+    LEDGER_THREADS,
+    PURCHASE_ENGINE,
+    PURCHASE_MAX_RETRIES,
+    PUSH_EVENTS,
+)
+from app.core.metrics import Histogram
+from app.db.log_queue import get_log_queue, xid_columns
+from app.domain.change import get_count_engine
+from app.domain.money import DENOMINATIONS, MoneyVector, denomination_type
+from app.models.models import (
+    BalanceModel,
+    MachineProductModel,
+    ProductModel,
+    TransactionLogModel,
+    TransactionMoneyModel,
+)
+from app.service.catalog_cache import catalog_cache
+from app.service.events import event_hub, notify_columns
+from app.service.idempotency import DuplicateKey, IdempotencyClaim, claims_insert
+from app.service.purchase_sql import (
+    BUCKET_COUNTS,
+    PurchaseState,
+    bucket_starts,
+    buckets_upsert,
+    sales_upsert,
+    transaction_rows,
+)
+from app.service.vending_service import busy, decide, purchase_response
+
+logger = logging.getLogger(__name__)
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+@dataclass(slots=True)
+class _Order:
+    product_id: UUID
+    inserted: MoneyVector
+    claim: IdempotencyClaim | None = None
+    future: Future = field(default_factory=Future)
+
+
+@dataclass(slots=True)
+class _Plan:
+    # What a batch does, decided from the book without touching the database.
+    # outcomes[i] is order i's (state, result, log_row, money_rows) or the
+    # HTTPException it gets; claims are the idempotency rows of the orders
+    # that carry a key, by order index.
+    outcomes: list
+    sold: Counter
+    refusals: Counter
+    balance: MoneyVector
+    claims: dict[int, dict] = field(default_factory=dict)
+
+
+class _KeysTaken(Exception):
+    # Orders (by index) whose Idempotency-Key another worker committed.
+    def __init__(self, indexes: list[int]):
+        self.indexes = indexes
+
+
+class MachineBook:
+    # One machine's stock and float as last committed. Only the thread that
+    # is running the machine's batch touches it; event hooks just leave
+    # notes in the inbox or set stale.
+    __slots__ = (
+        "machine_id", "products", "balance", "versions",
+        "stale", "inbox", "pending", "running",
+    )
+
+    def __init__(self, machine_id: UUID):
+        self.machine_id = machine_id
+        # product id -> [name, price, stock, version]
+        self.products: dict[UUID, list] = {}
+        self.balance = MoneyVector()
+        # denomination -> version, for the balances rows that exist
+        self.versions: dict[int, int] = {}
+        self.stale = True
+        self.inbox: deque[dict] = deque()
+        self.pending: list[_Order] = []
+        self.running = False
+
+    def load(self, products, balance_rows) -> None:
+        self.products = {
+            p.product_id: [p.name, p.price, p.stock, p.version] for p in products
+        }
+        self.balance = MoneyVector.from_pairs(
+            (b.denomination, b.amount) for b in balance_rows
+        )
+        self.versions = {b.denomination: b.version for b in balance_rows}
+        self.inbox.clear()
+        self.stale = False
+
+    def catch_up(self) -> None:
+        # Versioned events this book has not written itself mean someone
+        # else changed the machine.
+        while self.inbox:
+            event = self.inbox.popleft()
+            if event["type"] == "stock":
+                product = self.products.get(UUID(event["product_id"]))
+                current = product[3] if product else None
+            else:
+                current = self.versions.get(event["denomination"])
+            if current is None or event["version"] > current:
+                self.stale = True
+
+
+def _book_products(machine_ids: list[UUID] | None = None):
+    query = select(
+        MachineProductModel.machine_id,
+        MachineProductModel.product_id,
+        ProductModel.name,
+        ProductModel.price,
+        MachineProductModel.stock,
+        MachineProductModel.version,
+    ).join(ProductModel, ProductModel.id == MachineProductModel.product_id)
+    if machine_ids is not None:
+        query = query.where(MachineProductModel.machine_id.in_(machine_ids))
+    return query
+
+
+def _book_balance(machine_ids: list[UUID] | None = None):
+    query = select(
+        BalanceModel.machine_id,
+        BalanceModel.denomination,
+        BalanceModel.amount,
+        BalanceModel.version,
+    )
+    if machine_ids is not None:
+        query = query.where(BalanceModel.machine_id.in_(machine_ids))
+    return query
+
+
+def _stock_write(
+    machine_id: UUID, book: MachineBook, sold: Counter, deferred: bool = False
+):
+    # Takes the units off every product the batch sold, if each row still
+    # has the version and price the book decided with.
+    rows = values(
+        column("product_id", MachineProductModel.product_id.type),
+        column("sold", Integer),
+        column("version", Integer),
+        column("price", Integer),
+        name="sold",
+    ).data(
+        [
+            (product_id, units, book.products[product_id][3], book.products[product_id][1])
+            for product_id, units in sorted(sold.items())
+        ]
+    )
+    return (
+        update(MachineProductModel)
+        .where(
+            MachineProductModel.machine_id == machine_id,
+            MachineProductModel.product_id == rows.c.product_id,
+            MachineProductModel.version == rows.c.version,
+            MachineProductModel.stock >= rows.c.sold,
+            ProductModel.id == MachineProductModel.product_id,
+            ProductModel.price == rows.c.price,
+        )
+        .values(
+            stock=MachineProductModel.stock - rows.c.sold,
+            version=MachineProductModel.version + 1,
+        )
+        .returning(
+            MachineProductModel.product_id,
+            MachineProductModel.stock,
+            MachineProductModel.version,
+            *notify_columns(
+                "stock",
+                machine_id=MachineProductModel.machine_id,
+                product_id=MachineProductModel.product_id,
+                stock=MachineProductModel.stock,
+                version=MachineProductModel.version,
+            ),
+            *xid_columns(deferred),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _balance_write(machine_id: UUID, book: MachineBook, deltas: dict[int, int]):
+    # Rows created by the batch start at version 0.
+    rows = values(
+        column("denomination", Integer),
+        column("delta", Integer),
+        column("version", Integer),
+        name="delta",
+    ).data(
+        [
+            (denom, delta, book.versions.get(denom, 0))
+            for denom, delta in sorted(deltas.items())
+        ]
+    )
+    return (
+        update(BalanceModel)
+        .where(
+            BalanceModel.machine_id == machine_id,
+            BalanceModel.denomination == rows.c.denomination,
+            BalanceModel.version == rows.c.version,
+        )
+        .values(
+            amount=BalanceModel.amount + rows.c.delta,
+            version=BalanceModel.version + 1,
+        )
+        .returning(
+            BalanceModel.denomination,
+            BalanceModel.amount,
+            BalanceModel.version,
+            *notify_columns(
+                "balance",
+                machine_id=BalanceModel.machine_id,
+                denomination=BalanceModel.denomination,
+                amount=BalanceModel.amount,
+                version=BalanceModel.version,
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _totals_write(machine_id: UUID, plan: _Plan, deferred: bool):
+    # Sales totals, analytics buckets and (unless deferred to the log queue)
+    # the log rows of the whole batch in one statement.
+    sales = {}
+    buckets = defaultdict(Counter)
+    logs = []
+    for outcome in plan.outcomes:
+        if isinstance(outcome, HTTPException):
+            continue
+        state, _, log_row, _ = outcome
+        product_id, at = log_row["product_id"], log_row["created_at"]
+        row = sales.setdefault(
+            product_id,
+            {
+                "machine_id": machine_id,
+                "product_id": product_id,
+                "units_sold": 0,
+                "revenue": 0,
+                "last_sold_at": at,
+            },
+        )
+        row["units_sold"] += 1
+        row["revenue"] += state.price
+        row["last_sold_at"] = max(row["last_sold_at"], at)
+        for period, start in bucket_starts(at):
+            buckets[period, start, product_id].update(
+                units=1, revenue=state.price, change_paid=log_row["change_amount"]
+            )
+        logs.append(log_row)
+
+    now = datetime.now(UTC)
+    for product_id, refusals in plan.refusals.items():
+        for period, start in bucket_starts(now):
+            buckets[period, start, product_id]["refusals"] += refusals
+
+    bucket_rows = [
+        {
+            "machine_id": machine_id,
+            "period": period,
+            "bucket_start": start,
+            "product_id": product_id,
+            **{name: counts[name] for name in BUCKET_COUNTS},
+        }
+        for (period, start, product_id), counts in buckets.items()
+    ]
+    if not sales:
+        return buckets_upsert(bucket_rows) if bucket_rows else None
+
+    stmt = sales_upsert(list(sales.values())).add_cte(
+        buckets_upsert(bucket_rows).cte("buckets")
+    )
+    if not deferred:
+        stmt = stmt.add_cte(insert(TransactionLogModel).values(logs).cte("log"))
+    return stmt
+
+
+class Ledger:
+    # Purchases decided in memory, one machine at a time. Each machine's
+    # orders queue on its book; a pool thread takes everything queued (up to
+    # max_batch), decides it against the book, writes it in one transaction
+    # and only then answers the callers. Nothing is acknowledged before it
+    # is committed, so recovery is a reload from the database.
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        threads: int = LEDGER_THREADS,
+        max_batch: int = LEDGER_MAX_BATCH,
+    ):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.make_change = get_count_engine()
+        self.batch_sizes = Histogram(BATCH_BUCKETS)
+        self.purchases = 0
+        self.conflicts = 0
+        self.reloads = 0
+        self._books: dict[UUID, MachineBook] = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="ledger")
+
+    def recover(self) -> int:
+        # Loads every machine in two queries; returns how many.
+        db: Session = self.session_factory()
+        try:
+            products = defaultdict(list)
+            for row in db.execute(_book_products()):
+                products[row.machine_id].append(row)
+            balance = defaultdict(list)
+            for row in db.execute(_book_balance()):
+                balance[row.machine_id].append(row)
+        finally:
+            db.close()
+
+        with self._lock:
+            for machine_id in products.keys() | balance.keys():
+                book = self._books.setdefault(machine_id, MachineBook(machine_id))
+                book.load(products[machine_id], balance[machine_id])
+        return len(self._books)
+
+    def _reload(self, db: Session, book: MachineBook) -> None:
+        machine = [book.machine_id]
+        book.load(
+            db.execute(_book_products(machine)).all(),
+            db.execute(_book_balance(machine)).all(),
+        )
+        self.reloads += 1
+
+    def on_event(self, event: dict) -> None:
+        # Called on the event loop with every change any worker committed.
+        kind = event["type"]
+        machine_id = event.get("machine_id")
+        if machine_id is None:
+            product_id = event.get("product_id")
+            for book in list(self._books.values()):
+                if kind != "product" or UUID(product_id) in book.products:
+                    book.stale = True
+            return
+
+        book = self._books.get(UUID(machine_id))
+        if book is None:
+            return
+        if kind in ("stock", "balance") and "version" in event:
+            book.inbox.append(event)
+        else:
+            book.stale = True
+
+    def submit(
+        self,
+        machine_id: UUID,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ) -> Future:
+        order = _Order(product_id, inserted, claim)
+        with self._lock:
+            if self._stopping:
+                order.future.set_exception(busy())
+                return order.future
+            book = self._books.get(machine_id)
+            if book is None:
+                book = self._books[machine_id] = MachineBook(machine_id)
+            book.pending.append(order)
+            if book.running:
+                return order.future
+            book.running = True
+        self._executor.submit(self._run, book)
+        return order.future
+
+    def buy(
+        self,
+        machine_id: UUID,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ):
+        return self.submit(machine_id, product_id, inserted, claim).result()
+
+    def _run(self, book: MachineBook) -> None:
+        # One batch, then back in the pool's queue if more arrived, so a
+        # busy machine can't hold a thread while others wait.
+        with self._lock:
+            batch = book.pending[: self.max_batch]
+            del book.pending[: len(batch)]
+
+        try:
+            self._settle(book, batch)
+        except Exception as e:
+            logger.exception("ledger batch failed")
+            book.stale = True
+            for order in batch:
+                if not order.future.done():
+                    order.future.set_exception(e)
+
+        with self._lock:
+            # Once stopping, what is left is failed by stop().
+            if not book.pending or self._stopping:
+                book.running = False
+                return
+        self._executor.submit(self._run, book)
+
+    def _settle(self, book: MachineBook, batch: list[_Order]) -> None:
+        for attempt in range(PURCHASE_MAX_RETRIES + 1):
+            db: Session = self.session_factory()
+            try:
+                book.catch_up()
+                if book.stale or any(
+                    o.product_id not in book.products for o in batch
+                ):
+                    self._reload(db, book)
+                plan = self._plan(db, book, batch)
+                if self._write(db, book, plan):
+                    break
+                db.rollback()
+                self.conflicts += 1
+                book.stale = True
+            except _KeysTaken as e:
+                # Those callers get the other worker's outcome; the rest of
+                # the batch is decided again without them.
+                db.rollback()
+                for i in reversed(e.indexes):
+                    batch.pop(i).future.set_exception(DuplicateKey())
+                if not batch:
+                    return
+            finally:
+                db.close()
+        else:
+            for order in batch:
+                order.future.set_exception(busy())
+            return
+
+        self.batch_sizes.observe(len(batch))
+        for order, outcome in zip(batch, plan.outcomes):
+            if isinstance(outcome, HTTPException):
+                order.future.set_exception(outcome)
+            else:
+                self.purchases += 1
+                state, result, _, _ = outcome
+                order.future.set_result(purchase_response(state, result))
+
+    def _plan(self, db: Session, book: MachineBook, batch: list[_Order]) -> _Plan:
+        machine_id = book.machine_id
+        stock = {}
+        balance = book.balance
+        known = set(book.versions)
+        plan = _Plan([], Counter(), Counter(), balance)
+
+        missing = {o.product_id for o in batch} - book.products.keys()
+        exists = set(
+            db.scalars(select(ProductModel.id).where(ProductModel.id.in_(missing)))
+        ) if missing else set()
+
+        for i, order in enumerate(batch):
+            if order.claim is not None:
+                # Filled in below, once the outcome is known.
+                plan.claims[i] = order.claim
+            product_id = order.product_id
+            product = book.products.get(product_id)
+            if product is None:
+                plan.outcomes.append(
+                    HTTPException(
+                        status_code=404,
+                        detail="Product not found in vending machine"
+                        if product_id in exists
+                        else "Product not found",
+                    )
+                )
+                continue
+
+            name, price, on_hand, _ = product
+            state = PurchaseState(
+                name=name,
+                price=price,
+                stock=stock.get(product_id, on_hand),
+                balance=balance,
+                known=known,
+            )
+            try:
+                result = decide(state, order.inserted, self.make_change)
+            except HTTPException as e:
+                plan.refusals[product_id] += 1
+                plan.outcomes.append(e)
+                continue
+
+            log_row, money_rows = transaction_rows(
+                machine_id, product_id, state, order.inserted, result
+            )
+            stock[product_id] = state.stock - 1
+            balance = result.balance
+            plan.sold[product_id] += 1
+            plan.outcomes.append((state, result, log_row, money_rows))
+
+        plan.balance = balance
+        for i, claim in plan.claims.items():
+            outcome = plan.outcomes[i]
+            if not isinstance(outcome, HTTPException):
+                state, result, _, _ = outcome
+                outcome = purchase_response(state, result)
+            plan.claims[i] = claim.row(outcome)
+        return plan
+
+    def _write(self, db: Session, book: MachineBook, plan: _Plan) -> bool:
+        # False if a row moved under the book: the caller reloads and
+        # decides again.
+        machine_id = book.machine_id
+        log_queue = get_log_queue()
+        stock_rows, balance_rows = [], []
+
+        if plan.claims:
+            # First, so duplicates on other workers wait for this batch.
+            taken = set(db.scalars(claims_insert(list(plan.claims.values()))))
+            lost = [i for i, row in plan.claims.items() if row["key"] not in taken]
+            if lost:
+                raise _KeysTaken(lost)
+
+        if plan.sold:
+            stock_rows = db.execute(
+                _stock_write(
+                    machine_id, book, plan.sold, deferred=log_queue is not None
+                )
+            ).all()
+            if len(stock_rows) != len(plan.sold):
+                return False
+
+        deltas = {
+            denom: after - before
+            for denom, before, after in zip(
+                DENOMINATIONS, book.balance.counts, plan.balance.counts
+            )
+            if before != after
+        }
+        missing = [denom for denom in deltas if denom not in book.versions]
+        if missing:
+            db.execute(
+                insert(BalanceModel)
+                .values(
+                    [
+                        {
+                            "machine_id": machine_id,
+                            "denomination": denom,
+                            "amount": 0,
+                            "type": denomination_type(denom),
+                        }
+                        for denom in missing
+                    ]
+                )
+                .on_conflict_do_nothing()
+            )
+        if deltas:
+            balance_rows = db.execute(_balance_write(machine_id, book, deltas)).all()
+            if len(balance_rows) != len(deltas):
+                return False
+
+        totals = _totals_write(machine_id, plan, deferred=log_queue is not None)
+        if totals is not None:
+            db.execute(totals)
+        sales = [o for o in plan.outcomes if not isinstance(o, HTTPException)]
+        money_rows = [line for *_, lines in sales for line in lines]
+        if money_rows and log_queue is None:
+            db.execute(insert(TransactionMoneyModel).values(money_rows))
+        if log_queue is not None:
+            for _, _, log_row, lines in sales:
+                log_queue.append(log_row, lines, stock_rows[0][-1])
+        db.commit()
+
+        for product_id, stock, version, *_ in stock_rows:
+            book.products[product_id][2:] = [stock, version]
+        for denom, _, version, *_ in balance_rows:
+            book.versions[denom] = version
+        book.balance = plan.balance
+
+        for i, (product_id, stock, version, *_) in enumerate(stock_rows):
+            catalog_cache.apply_purchase(
+                machine_id,
+                product_id,
+                [(stock, version)],
+                balance_rows if i == 0 else [],
+            )
+        return True
+
+    def stop(self) -> None:
+        # Lets the batches already handed to the pool finish; orders still
+        # queued behind them get a 409 so the caller retries elsewhere.
+        with self._lock:
+            self._stopping = True
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            orders = [o for book in self._books.values() for o in book.pending]
+            for book in self._books.values():
+                book.pending.clear()
+                book.running = False
+        for order in orders:
+            order.future.set_exception(busy())
+
+    def stats(self) -> dict:
+        return {
+            "machines": len(self._books),
+            "purchases": self.purchases,
+            "conflicts": self.conflicts,
+            "reloads": self.reloads,
+            "batch_sizes": self.batch_sizes.snapshot(),
+        }
+
+
+_ledger: Ledger | None = None
+
+
+def get_ledger() -> Ledger | None:
+    # None unless PURCHASE_ENGINE is "ledger" and it started.
+    return _ledger
+
+
+def start_ledger() -> Ledger | None:
+    global _ledger
+    if PURCHASE_ENGINE != "ledger" or _ledger is not None:
+        return _ledger
+    if not PUSH_EVENTS:
+        # Without events the books never hear about edits made elsewhere.
+        raise RuntimeError("PURCHASE_ENGINE=ledger needs PUSH_EVENTS=true")
+
+    from app.db.database import SessionLocal
+
+    _ledger = Ledger(SessionLocal)
+    machines = _ledger.recover()
+    event_hub.add_hook(_ledger.on_event)
+    logger.info("ledger recovered %d machines", machines)
+    return _ledger
+
+
+def stop_ledger() -> None:
+    global _ledger
+    if _ledger is not None:
+        event_hub.remove_hook(_ledger.on_event)
+        _ledger.stop()
+        _ledger = None
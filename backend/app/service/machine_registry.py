@@ -0,0 +1,75 @@
+import threading
+from dataclasses import dataclass
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.models import MachineModel
+
+
+@dataclass(frozen=True, slots=True)
+class MachineInfo:
+    id: UUID
+    name: str
+
+
+def _not_found() -> HTTPException:
+    return HTTPException(status_code=404, detail="Machine not found")
+
+
+class MachineRegistry:
+    # Machine metadata kept in-process: machines are created rarely and never
+    # change underneath a request, so after the first lookup each machine
+    # costs a dict read per request. Reads take no lock.
+    def __init__(self):
+        self._machines: dict[UUID, MachineInfo] = {}
+        self._lock = threading.Lock()
+
+    def add(self, machine) -> MachineInfo:
+        info = MachineInfo(id=machine.id, name=machine.name)
+        with self._lock:
+            self._machines[info.id] = info
+        return info
+
+    def get(self, db: Session, machine_id: UUID) -> MachineInfo:
+        info = self._machines.get(machine_id)
+        if info is not None:
+            return info
+
+        machine = db.get(MachineModel, machine_id)
+        if machine is None:
+            raise _not_found()
+        return self.add(machine)
+
+    async def aget(self, db: AsyncSession, machine_id: UUID) -> MachineInfo:
+        info = self._machines.get(machine_id)
+        if info is not None:
+            return info
+
+        machine = await db.get(MachineModel, machine_id)
+        if machine is None:
+            raise _not_found()
+        return self.add(machine)
+
+    def _listed(self, machines) -> list[MachineInfo]:
+        return sorted(
+            (self.add(machine) for machine in machines),
+            key=lambda m: (m.name, str(m.id)),
+        )
+
+    # Listing always reads the table so machines created through another
+    # worker show up; it is not on the purchase path.
+    def all(self, db: Session) -> list[MachineInfo]:
+        return self._listed(db.scalars(select(MachineModel)).all())
+
+    async def aall(self, db: AsyncSession) -> list[MachineInfo]:
+        return self._listed((await db.scalars(select(MachineModel))).all())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._machines.clear()
+
+machine_registry = MachineRegistry()
@@ -0,0 +1,19 @@
+from sqlalchemy.orm import Session
+
+from app.models.models import MachineModel
+from app.schemas.schemas import Machine, MachineCreate
+from app.service.machine_registry import machine_registry
+
+
+class MachineService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def list_machines(self) -> list[Machine]:
+        return [Machine.model_validate(m) for m in machine_registry.all(self.db)]
+
+    def create_machine(self, data: MachineCreate) -> Machine:
+        machine = MachineModel(name=data.name)
+        self.db.add(machine)
+        self.db.commit()
+        return Machine.model_validate(machine_registry.add(machine))
@@ -0,0 +1,41 @@
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import delete, exists, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import MachineProductModel, ProductModel, TransactionLogModel
+from app.service.catalog_cache import catalog_cache
+from app.service.events import notify
+
+
+class ProductService:
+    # The catalog itself, across machines. Taking a product off one machine
+    # is AdminService.delete_product.
+    def __init__(self, db: Session):
+        self.db = db
+
+    def delete_product(self, product_id: UUID) -> None:
+        if self.db.get(ProductModel, product_id) is None:
+            raise HTTPException(404, "Product not found")
+
+        if self.db.scalar(
+            select(exists().where(MachineProductModel.product_id == product_id))
+        ):
+            raise HTTPException(409, "Product is still stocked by a machine")
+        if self.db.scalar(
+            select(exists().where(TransactionLogModel.product_id == product_id))
+        ):
+            raise HTTPException(409, "Product has sales history")
+
+        # Running totals cascade; anything added since the checks above
+        # still trips the foreign keys.
+        self.db.execute(delete(ProductModel).where(ProductModel.id == product_id))
+        notify(self.db, [{"type": "catalog", "machine_id": None}])
+        try:
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            raise HTTPException(409, "Product is still in use")
+        catalog_cache.invalidate()
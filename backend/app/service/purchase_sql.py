@@ -0,0 +1,316 @@
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from uuid import UUID, uuid4
+
+from nanoid import generate
+from sqlalchemy import Integer, cast, column, func, select, update, values
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.log_queue import xid_columns
+from app.domain.money import DENOMINATIONS, MoneyVector, denomination_type
+from app.domain.types import VectorPurchaseResult
+from app.models.models import (
+    BalanceModel,
+    MachineProductModel,
+    ProductSalesModel,
+    SalesBucketModel,
+    TransactionLogModel,
+    TransactionMoneyModel,
+)
+from app.service.events import notify_columns
+
+# The statements and rows a purchase writes, shared by VendingService,
+# AsyncVendingService and the ledger.
+
+
+@dataclass(slots=True)
+class PurchaseState:
+    name: str
+    price: int
+    stock: int
+    balance: MoneyVector
+    # Denominations that already have a balances row.
+    known: set[int]
+
+
+def insert_rows(model, rows: list[dict]):
+    # INSERT ... SELECT FROM (VALUES ...): unlike a multi-row values(), it
+    # can carry other multi-row inserts as CTEs.
+    table = model.__table__
+    names = list(rows[0])
+    source = values(
+        *(column(name, table.c[name].type) for name in names),
+        name="row",
+    ).data([tuple(row[name] for name in names) for row in rows])
+    # Enum values come back out of VALUES as text.
+    return insert(model).from_select(
+        names,
+        select(*(cast(source.c[name], table.c[name].type) for name in names)),
+    )
+
+
+def sales_upsert(rows: list[dict]):
+    # rows: machine_id, product_id, units_sold, revenue, last_sold_at; at
+    # most one per product.
+    stmt = insert_rows(ProductSalesModel, rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[ProductSalesModel.machine_id, ProductSalesModel.product_id],
+        set_={
+            "units_sold": ProductSalesModel.units_sold + stmt.excluded.units_sold,
+            "revenue": ProductSalesModel.revenue + stmt.excluded.revenue,
+            "last_sold_at": func.greatest(
+                ProductSalesModel.last_sold_at,
+                stmt.excluded.last_sold_at,
+            ),
+        },
+    )
+
+
+def record_sale(
+    machine_id: UUID,
+    product_id: UUID,
+    price: int,
+    sold_at: datetime,
+):
+    return sales_upsert(
+        [
+            {
+                "machine_id": machine_id,
+                "product_id": product_id,
+                "units_sold": 1,
+                "revenue": price,
+                "last_sold_at": sold_at,
+            }
+        ]
+    )
+
+
+BUCKET_COUNTS = ("units", "revenue", "change_paid", "refusals")
+
+
+def bucket_starts(at: datetime) -> tuple[tuple[str, datetime], ...]:
+    # The hourly and the daily bucket `at` falls in.
+    hour = at.astimezone(UTC).replace(minute=0, second=0, microsecond=0)
+    return (("hour", hour), ("day", hour.replace(hour=0)))
+
+
+def buckets_upsert(rows: list[dict]):
+    # rows: machine_id, period, bucket_start, product_id and BUCKET_COUNTS;
+    # at most one per bucket.
+    stmt = insert_rows(SalesBucketModel, rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[
+            SalesBucketModel.machine_id,
+            SalesBucketModel.period,
+            SalesBucketModel.bucket_start,
+            SalesBucketModel.product_id,
+        ],
+        set_={
+            name: getattr(SalesBucketModel, name) + getattr(stmt.excluded, name)
+            for name in BUCKET_COUNTS
+        },
+    )
+
+
+def bump_buckets(
+    machine_id: UUID,
+    product_id: UUID,
+    at: datetime,
+    units: int = 0,
+    revenue: int = 0,
+    change_paid: int = 0,
+    refusals: int = 0,
+):
+    return buckets_upsert(
+        [
+            {
+                "machine_id": machine_id,
+                "period": period,
+                "bucket_start": start,
+                "product_id": product_id,
+                "units": units,
+                "revenue": revenue,
+                "change_paid": change_paid,
+                "refusals": refusals,
+            }
+            for period, start in bucket_starts(at)
+        ]
+    )
+
+
+def refusal_write(machine_id: UUID, product_id: UUID):
+    return bump_buckets(machine_id, product_id, datetime.now(UTC), refusals=1)
+
+
+def purchase_writes(
+    machine_id: UUID,
+    product_id: UUID,
+    state: PurchaseState,
+    result: VectorPurchaseResult,
+    log_row: dict,
+    money_rows: list[dict],
+    deferred: bool = False,
+) -> list[tuple]:
+    # (statement, rows it must touch or None). A short row count means a
+    # concurrent purchase got there first. The checked updates return the
+    # rows they wrote so the catalog cache can be patched with them.
+    writes = [
+        (
+            update(MachineProductModel)
+            .where(
+                MachineProductModel.machine_id == machine_id,
+                MachineProductModel.product_id == product_id,
+                MachineProductModel.stock > 0,
+            )
+            .values(
+                stock=MachineProductModel.stock - 1,
+                version=MachineProductModel.version + 1,
+            )
+            .returning(
+                MachineProductModel.stock,
+                MachineProductModel.version,
+                *notify_columns(
+                    "stock",
+                    machine_id=MachineProductModel.machine_id,
+                    product_id=MachineProductModel.product_id,
+                    stock=MachineProductModel.stock,
+                    version=MachineProductModel.version,
+                ),
+                *xid_columns(deferred),
+            )
+            .execution_options(synchronize_session=False),
+            1,
+        )
+    ]
+
+    deltas = {
+        denom: after - before
+        for denom, before, after in zip(
+            DENOMINATIONS,
+            state.balance.counts,
+            result.balance.counts,
+        )
+        if before != after
+    }
+    missing = [denom for denom in deltas if denom not in state.known]
+    if missing:
+        writes.append(
+            (
+                insert(BalanceModel)
+                .values(
+                    [
+                        {
+                            "machine_id": machine_id,
+                            "denomination": denom,
+                            "amount": 0,
+                            "type": denomination_type(denom),
+                        }
+                        for denom in missing
+                    ]
+                )
+                .on_conflict_do_nothing(),
+                None,
+            )
+        )
+
+    if deltas:
+        # One UPDATE ... FROM (VALUES ...) for the whole float. A row only
+        # matches if it stays non-negative.
+        delta = values(
+            column("denomination", Integer),
+            column("delta", Integer),
+            name="delta",
+        ).data(sorted(deltas.items()))
+
+        writes.append(
+            (
+                update(BalanceModel)
+                .where(
+                    BalanceModel.machine_id == machine_id,
+                    BalanceModel.denomination == delta.c.denomination,
+                    BalanceModel.amount + delta.c.delta >= 0,
+                )
+                .values(
+                    amount=BalanceModel.amount + delta.c.delta,
+                    version=BalanceModel.version + 1,
+                )
+                .returning(
+                    BalanceModel.denomination,
+                    BalanceModel.amount,
+                    BalanceModel.version,
+                    *notify_columns(
+                        "balance",
+                        machine_id=BalanceModel.machine_id,
+                        denomination=BalanceModel.denomination,
+                        amount=BalanceModel.amount,
+                        version=BalanceModel.version,
+                    ),
+                )
+                .execution_options(synchronize_session=False),
+                len(deltas),
+            )
+        )
+
+    now = log_row["created_at"]
+    sale = record_sale(machine_id, product_id, state.price, now).add_cte(
+        bump_buckets(
+            machine_id,
+            product_id,
+            now,
+            units=1,
+            revenue=state.price,
+            change_paid=log_row["change_amount"],
+        ).cte("buckets")
+    )
+    if deferred:
+        # The log row and money lines go to the local queue instead.
+        writes.append((sale, None))
+        return writes
+
+    # The log row, the sales totals and the analytics buckets go out as one
+    # statement: the other inserts ride along as data-modifying CTEs.
+    writes.append(
+        (sale.add_cte(insert(TransactionLogModel).values(log_row).cte("log")), None)
+    )
+    if money_rows:
+        writes.append((insert(TransactionMoneyModel).values(money_rows), None))
+
+    return writes
+
+
+def transaction_rows(
+    machine_id: UUID,
+    product_id: UUID,
+    state: PurchaseState,
+    inserted: MoneyVector,
+    result: VectorPurchaseResult,
+) -> tuple[dict, list[dict]]:
+    # The transaction_logs row and its transaction_money lines.
+    tx_id = uuid4()
+    now = datetime.now(UTC)
+    log_row = {
+        "id": tx_id,
+        "machine_id": machine_id,
+        "product_id": product_id,
+        "product_price": state.price,
+        "paid_amount": result.paid_amount,
+        "change_amount": result.paid_amount - state.price,
+        "status": "success",
+        "created_at": now,
+        "updated_at": now,
+    }
+    money_rows = [
+        {
+            "id": generate(),
+            "transaction_id": tx_id,
+            "denomination": denom,
+            "quantity": qty,
+            "direction": direction,
+        }
+        for direction, money in (
+            ("inserted", inserted),
+            ("change", result.change),
+        )
+        for denom, qty in money.to_dict().items()
+    ]
+    return log_row, money_rows
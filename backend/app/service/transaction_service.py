@@ -0,0 +1,168 @@
+import base64
+import json
+from collections import defaultdict
+from datetime import datetime
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models.models import TransactionLogModel, TransactionMoneyModel
+from app.schemas.schemas import (
+    TransactionMoneyLine,
+    TransactionPage,
+    TransactionRecord,
+)
+
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(machine_id: UUID, created_at: datetime, tx_id: UUID) -> str:
+    raw = json.dumps([str(machine_id), created_at.isoformat(), str(tx_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[UUID, datetime, UUID]:
+    try:
+        fields = json.loads(base64.urlsafe_b64decode(cursor))
+        # Valid base64 JSON of any other shape is as invalid as garbage.
+        if not (
+            isinstance(fields, list)
+            and len(fields) == 3
+            and all(isinstance(field, str) for field in fields)
+        ):
+            raise ValueError(cursor)
+        machine_id, created_at, tx_id = fields
+        created_at = datetime.fromisoformat(created_at)
+        if created_at.tzinfo is None:
+            raise ValueError(cursor)
+        return UUID(machine_id), created_at, UUID(tx_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+
+
+def _filtered(query, machine_id, product_id, status, start, end):
+    log = TransactionLogModel
+    if machine_id:
+        query = query.where(log.machine_id == machine_id)
+    if product_id:
+        query = query.where(log.product_id == product_id)
+    if status:
+        query = query.where(log.status == status)
+    if start:
+        query = query.where(log.created_at >= start)
+    if end:
+        query = query.where(log.created_at < end)
+    return query
+
+
+class TransactionService:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def history_query(
+        self,
+        limit: int,
+        machine_id: UUID | None = None,
+        product_id: UUID | None = None,
+        status: str | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        cursor: str | None = None,
+    ):
+        # Newest first, keyed on (machine_id, created_at, id) so each page
+        # is an index range scan that starts where the last one stopped,
+        # however deep into the history it is.
+        log = TransactionLogModel
+        query = _filtered(
+            select(log), machine_id, product_id, status, start, end
+        )
+
+        if cursor:
+            after_machine, after_created, after_id = decode_cursor(cursor)
+            if machine_id:
+                # machine_id is fixed, so compare on the rest of the key and
+                # the (machine, product, created_at, id) index can serve the
+                # product filter too.
+                query = query.where(
+                    tuple_(log.created_at, log.id) < (after_created, after_id)
+                )
+            else:
+                query = query.where(
+                    tuple_(log.machine_id, log.created_at, log.id)
+                    < (after_machine, after_created, after_id)
+                )
+
+        return query.order_by(
+            log.machine_id.desc(),
+            log.created_at.desc(),
+            log.id.desc(),
+        ).limit(limit)
+
+    def list_transactions(
+        self,
+        limit: int = 50,
+        machine_id: UUID | None = None,
+        product_id: UUID | None = None,
+        status: str | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        cursor: str | None = None,
+    ) -> TransactionPage:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        # One extra row tells whether there is a next page.
+        logs = self.db.scalars(
+            self.history_query(
+                limit + 1, machine_id, product_id, status, start, end, cursor
+            )
+        ).all()
+        has_more = len(logs) > limit
+        logs = logs[:limit]
+
+        # All money lines of the page in one query.
+        money = defaultdict(list)
+        if logs:
+            lines = self.db.execute(
+                select(
+                    TransactionMoneyModel.transaction_id,
+                    TransactionMoneyModel.denomination,
+                    TransactionMoneyModel.quantity,
+                    TransactionMoneyModel.direction,
+                )
+                .where(TransactionMoneyModel.transaction_id.in_([t.id for t in logs]))
+                .order_by(
+                    TransactionMoneyModel.direction,
+                    TransactionMoneyModel.denomination.desc(),
+                )
+            )
+            for tx_id, denomination, quantity, direction in lines:
+                money[tx_id].append(
+                    TransactionMoneyLine(
+                        denomination=denomination,
+                        quantity=quantity,
+                        direction=direction,
+                    )
+                )
+
+        items = [
+            TransactionRecord(
+                id=t.id,
+                machine_id=t.machine_id,
+                product_id=t.product_id,
+                product_price=t.product_price,
+                paid_amount=t.paid_amount,
+                change_amount=t.change_amount,
+                status=t.status,
+                created_at=t.created_at,
+                money=money[t.id],
+            )
+            for t in logs
+        ]
+
+        next_cursor = None
+        if has_more:
+            last = logs[-1]
+            next_cursor = encode_cursor(last.machine_id, last.created_at, last.id)
+
+        return TransactionPage(items=items, next_cursor=next_cursor)
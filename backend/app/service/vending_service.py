@@ -1,3 +1,10 @@
+import asyncio
+import random
+import time
+
+from sqlalchemy import and_, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 
@@ -5,199 +12,536 @@ from app.models.models import (
     ProductModel,
     MachineProductModel,
     BalanceModel,
-    TransactionLogModel,
-    TransactionMoneyModel,
 )
 from app.schemas.schemas import (
     Product,
-    MoneyItem,
     PurchaseRequest,
     PurchaseResponse,
 )
-from app.domain.change import (
-    calculate_total_money,
-    merge_balance,
-    greedy_change,
+from app.domain.change import CountEngine, get_count_engine
+from app.domain.money import MoneyVector
+from app.domain.purchase import purchase_vector
+from app.domain.types import VectorPurchaseResult
+from app.core.config import CHANGE_ENGINE, PURCHASE_MAX_RETRIES
+from app.core.metrics import CHANGE_SECONDS, PURCHASES
+from app.db.log_queue import get_log_queue
+from app.service.catalog_cache import catalog_cache
+from app.service.idempotency import (
+    DuplicateKey,
+    IdempotencyClaim,
+    claim_write,
+    idempotency_store,
+)
+from app.service.purchase_sql import (
+    PurchaseState,
+    purchase_writes,
+    refusal_write,
+    transaction_rows,
 )
 from uuid import UUID
-from nanoid import generate
-from datetime import datetime
 
-DEFAULT_MACHINE_ID = UUID("00000000-0000-0000-0000-000000000001")
+# Deadlock detected / serialization failure.
+RETRYABLE_SQLSTATES = {"40P01", "40001"}
 
+PURCHASE_ERRORS = {
+    "OUT_OF_STOCK": "Product out of stock",
+    "INSUFFICIENT_FUNDS": "Insufficient funds",
+    "CANNOT_MAKE_CHANGE": "Machine cannot provide change",
+    "INVALID_DENOMINATION": "Invalid denomination",
+}
+
+# Outcome label on the purchases metric for each refusal's message.
+PURCHASE_OUTCOMES = {
+    detail: code.lower() for code, detail in PURCHASE_ERRORS.items()
+}
+
+# The SQL and the decisions below are shared by VendingService (Session) and
+# AsyncVendingService (AsyncSession); the classes only differ in how they
+# execute statements.
+
+
+class PurchaseConflict(Exception):
+    pass
+
+
+def _is_retryable(error: OperationalError) -> bool:
+    orig = error.orig
+    sqlstate = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
+
+def _retry_delay(attempt: int) -> float:
+    return random.uniform(0, 0.005 * attempt)
 
-class VendingService:
-    def __init__(self, db: Session):
-        self.db = db
 
-    def _get_product_or_404(self, product_id: UUID) -> ProductModel:
-        product = (
-            self.db.query(ProductModel)
-            .filter(ProductModel.id == product_id)
-            .first()
+def _count_outcome(error: HTTPException | None = None) -> None:
+    if error is None:
+        PURCHASES.inc("success")
+    elif error.status_code == 404:
+        PURCHASES.inc("not_found")
+    elif error.status_code == 409:
+        PURCHASES.inc("busy")
+    else:
+        PURCHASES.inc(PURCHASE_OUTCOMES.get(error.detail, "error"))
+
+
+def _parse_inserted(req: PurchaseRequest) -> MoneyVector:
+    try:
+        return MoneyVector.from_items(req.inserted_money)
+    except ValueError as e:
+        error = HTTPException(status_code=400, detail=PURCHASE_ERRORS[str(e)])
+        _count_outcome(error)
+        raise error
+
+
+def _catalog_query(machine_id: UUID):
+    return (
+        select(
+            ProductModel.id,
+            ProductModel.name,
+            ProductModel.price,
+            ProductModel.image,
+            MachineProductModel.stock,
+            MachineProductModel.version,
         )
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        return product
-
-    def _get_machine_product_or_404(
-        self, product_id: UUID
-    ) -> MachineProductModel:
-        mp = (
-            self.db.query(MachineProductModel)
-            .filter(
-                MachineProductModel.machine_id == DEFAULT_MACHINE_ID,
-                MachineProductModel.product_id == product_id,
-            )
-            .first()
+        .join(
+            MachineProductModel,
+            ProductModel.id == MachineProductModel.product_id,
         )
-        if not mp:
-            raise HTTPException(
-                status_code=404,
-                detail="Product not found in vending machine",
+        .where(MachineProductModel.machine_id == machine_id)
+    )
+
+
+def _balance_query(machine_id: UUID):
+    return select(
+        BalanceModel.denomination,
+        BalanceModel.amount,
+        BalanceModel.version,
+    ).where(BalanceModel.machine_id == machine_id)
+
+
+def _catalog(products, balance_pairs) -> list[Product]:
+    # products: (id, name, price, image, stock); balance: (denomination, amount)
+    availability = MoneyVector.from_pairs(balance_pairs).availability()
+
+    result = []
+    for product_id, name, price, image, stock in products:
+        exact_change_only, max_accepted_note = availability.hint(price)
+        result.append(
+            Product(
+                id=product_id,
+                name=name,
+                price=price,
+                stock=stock,
+                image=f"http://localhost:8000/api/v1{image}",
+                exact_change_only=exact_change_only,
+                max_accepted_note=max_accepted_note,
             )
-        return mp
+        )
+    return result
 
-    def _get_machine_balance(self) -> dict[int, int]:
-        balances = (
-            self.db.query(BalanceModel)
-            .filter(BalanceModel.machine_id == DEFAULT_MACHINE_ID)
-            .all()
+
+def _purchase_state_query(machine_id: UUID, product_id: UUID):
+    # Product, stock and the whole float in one round trip. Nothing is
+    # locked: the writes are conditional and retried on conflict.
+    return (
+        select(
+            ProductModel.name,
+            ProductModel.price,
+            MachineProductModel.stock,
+            BalanceModel.denomination,
+            BalanceModel.amount,
+        )
+        .outerjoin(
+            MachineProductModel,
+            and_(
+                MachineProductModel.product_id == ProductModel.id,
+                MachineProductModel.machine_id == machine_id,
+            ),
+        )
+        .outerjoin(
+            BalanceModel,
+            BalanceModel.machine_id == MachineProductModel.machine_id,
+        )
+        .where(ProductModel.id == product_id)
+    )
+
+
+def _purchase_state(rows) -> PurchaseState:
+    if not rows:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    name, price, stock = rows[0][:3]
+    if stock is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Product not found in vending machine",
+        )
+
+    float_rows = [
+        (row.denomination, row.amount)
+        for row in rows
+        if row.denomination is not None
+    ]
+    return PurchaseState(
+        name=name,
+        price=price,
+        stock=stock,
+        balance=MoneyVector.from_pairs(float_rows),
+        known={denom for denom, _ in float_rows},
+    )
+
+
+def decide(
+    state: PurchaseState,
+    inserted: MoneyVector,
+    make_change: CountEngine,
+) -> VectorPurchaseResult:
+    started = time.perf_counter()
+    try:
+        return purchase_vector(
+            state.price,
+            state.stock,
+            state.balance,
+            inserted,
+            make_change,
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=PURCHASE_ERRORS.get(str(e), str(e)),
         )
-        return {b.denomination: b.amount for b in balances}
+    finally:
+        CHANGE_SECONDS.observe(time.perf_counter() - started, CHANGE_ENGINE)
+
+
+def purchase_response(
+    state: PurchaseState,
+    result: VectorPurchaseResult,
+) -> PurchaseResponse:
+    return PurchaseResponse(
+        product_name=state.name,
+        paid_amount=result.paid_amount,
+        change_amount=result.paid_amount - state.price,
+        change=result.change.to_dict(),
+    )
+
+
+def _patch_catalog(
+    machine_id: UUID,
+    product_id: UUID,
+    returned: list[list],
+) -> None:
+    # returned holds the stock row and, if the float moved, the balance rows.
+    stock_rows, *rest = returned
+    catalog_cache.apply_purchase(
+        machine_id,
+        product_id,
+        stock_rows,
+        rest[0] if rest else [],
+    )
+
+
+def _claim_for(
+    machine_id: UUID,
+    idempotency_key: str,
+    product_id: UUID,
+    inserted: MoneyVector,
+) -> IdempotencyClaim:
+    # The fingerprint binds the key to this product and these coins.
+    fingerprint = f"{product_id}:{','.join(map(str, inserted.counts))}"
+    return IdempotencyClaim(machine_id, idempotency_key, fingerprint)
+
+
+def busy() -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail="Machine is busy, please retry",
+    )
+
+
+def _get_ledger():
+    # Imported here: the ledger is built from the helpers in this module.
+    from app.service.ledger import get_ledger
+
+    return get_ledger()
+
+
+class VendingService:
+    def __init__(self, db: Session, machine_id: UUID):
+        self.db = db
+        self.machine_id = machine_id
+        self.make_change = get_count_engine()
+
+    def _load_catalog(self):
+        products = self.db.execute(_catalog_query(self.machine_id)).all()
+        balance_rows = self.db.execute(_balance_query(self.machine_id)).all()
+        return products, balance_rows
 
     def get_products(self) -> list[Product]:
-        products = (
-            self.db.query(ProductModel, MachineProductModel)
-            .join(
-                MachineProductModel,
-                ProductModel.id == MachineProductModel.product_id,
-            )
-            .filter(MachineProductModel.machine_id == DEFAULT_MACHINE_ID)
-            .all()
+        return catalog_cache.get(self.machine_id, self._load_catalog, _catalog)
+
+    def _claim(self, claim: IdempotencyClaim | None, outcome) -> None:
+        # First write of the transaction, so a duplicate on another worker
+        # waits here for ours to commit or roll back.
+        if claim is not None and not self.db.execute(claim_write(claim, outcome)).all():
+            self.db.rollback()
+            raise DuplicateKey()
+
+    def _try_buy_product(
+        self,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ) -> PurchaseResponse:
+        rows = self.db.execute(
+            _purchase_state_query(self.machine_id, product_id)
+        ).all()
+        try:
+            state = _purchase_state(rows)
+        except HTTPException as e:
+            if claim is None:
+                self.db.rollback()
+                raise
+            self._claim(claim, e)
+            self.db.commit()
+            raise
+
+        try:
+            result = decide(state, inserted, self.make_change)
+        except HTTPException as e:
+            self._claim(claim, e)
+            self.db.execute(refusal_write(self.machine_id, product_id))
+            self.db.commit()
+            raise
+
+        response = purchase_response(state, result)
+        self._claim(claim, response)
+        log_row, money_rows = transaction_rows(
+            self.machine_id, product_id, state, inserted, result
         )
+        log_queue = get_log_queue()
+        returned = []
+        for statement, expected in purchase_writes(
+            self.machine_id,
+            product_id,
+            state,
+            result,
+            log_row,
+            money_rows,
+            deferred=log_queue is not None,
+        ):
+            outcome = self.db.execute(statement)
+            if expected is not None:
+                rows = outcome.all()
+                if len(rows) != expected:
+                    raise PurchaseConflict()
+                returned.append(rows)
 
-        return [
-            Product(
-                id=p.id,
-                name=p.name,
-                price=p.price,
-                stock=mp.stock,
-                image=f"http://localhost:8000/api/v1{p.image}",
-            )
-            for p, mp in products
-        ]
+        if log_queue is not None:
+            log_queue.append(log_row, money_rows, returned[0][0][-1])
+        self.db.commit()
+        _patch_catalog(self.machine_id, product_id, returned)
+        return response
 
     def buy_product(
         self,
         req: PurchaseRequest,
+        idempotency_key: str | None = None,
     ) -> PurchaseResponse:
+        inserted = _parse_inserted(req)
+        if idempotency_key is None:
+            return self._buy(req.product_id, inserted)
+        claim = _claim_for(self.machine_id, idempotency_key, req.product_id, inserted)
+        return idempotency_store.run(
+            self.machine_id,
+            idempotency_key,
+            claim.fingerprint,
+            lambda: self._buy(req.product_id, inserted, claim),
+            self.db,
+        )
 
+    def _buy(
+        self,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ) -> PurchaseResponse:
+        try:
+            response = self._purchase(product_id, inserted, claim)
+        except HTTPException as e:
+            _count_outcome(e)
+            raise
+        _count_outcome()
+        return response
 
-        product = self._get_product_or_404(req.product_id)
-        machine_product = self._get_machine_product_or_404(req.product_id)
+    def _purchase(
+        self,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ) -> PurchaseResponse:
+        ledger = _get_ledger()
+        if ledger is not None:
+            return ledger.buy(self.machine_id, product_id, inserted, claim)
 
-        if machine_product.stock <= 0:
-            raise HTTPException(
-                status_code=400,
-                detail="Product out of stock",
-            )
+        # Optimistic: re-read and re-decide when a conditional write loses
+        # a race (or Postgres aborts us on a deadlock).
+        for attempt in range(PURCHASE_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(_retry_delay(attempt))
+            try:
+                return self._try_buy_product(product_id, inserted, claim)
+            except PurchaseConflict:
+                self.db.rollback()
+            except OperationalError as e:
+                self.db.rollback()
+                if not _is_retryable(e):
+                    raise
 
-        total_paid = calculate_total_money(req.inserted_money)
+        raise busy()
 
-        if total_paid < product.price:
-            raise HTTPException(
-                status_code=400,
-                detail="Insufficient funds",
-            )
 
-        change_amount = total_paid - product.price
+class AsyncVendingService:
+    def __init__(self, db: AsyncSession, machine_id: UUID):
+        self.db = db
+        self.machine_id = machine_id
+        self.make_change = get_count_engine()
 
-        current_balance = self._get_machine_balance()
+    async def _load_catalog(self):
+        products = (await self.db.execute(_catalog_query(self.machine_id))).all()
+        balance_rows = (
+            await self.db.execute(_balance_query(self.machine_id))
+        ).all()
+        return products, balance_rows
 
-        merged_balance = merge_balance(
-            current_balance,
-            req.inserted_money,
+    async def get_products(self) -> list[Product]:
+        return await catalog_cache.aget(
+            self.machine_id,
+            self._load_catalog,
+            _catalog,
         )
 
-        try:
-            change = greedy_change(
-                merged_balance,
-                change_amount,
-            )
-        except ValueError:
-            raise HTTPException(
-                status_code=400,
-                detail="Machine cannot provide change",
+    async def _claim(self, claim: IdempotencyClaim | None, outcome) -> None:
+        if claim is not None and not (
+            await self.db.execute(claim_write(claim, outcome))
+        ).all():
+            await self.db.rollback()
+            raise DuplicateKey()
+
+    async def _try_buy_product(
+        self,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ) -> PurchaseResponse:
+        rows = (
+            await self.db.execute(
+                _purchase_state_query(self.machine_id, product_id)
             )
+        ).all()
+        try:
+            state = _purchase_state(rows)
+        except HTTPException as e:
+            if claim is None:
+                await self.db.rollback()
+                raise
+            await self._claim(claim, e)
+            await self.db.commit()
+            raise
 
+        try:
+            result = decide(state, inserted, self.make_change)
+        except HTTPException as e:
+            await self._claim(claim, e)
+            await self.db.execute(refusal_write(self.machine_id, product_id))
+            await self.db.commit()
+            raise
 
-        tx = TransactionLogModel(
-            machine_id=DEFAULT_MACHINE_ID,
-            product_id=product.id,
-            product_price=product.price,
-            paid_amount=total_paid,
-            change_amount=change_amount,
-            status="success",
-            created_at=datetime.utcnow(),
+        response = purchase_response(state, result)
+        await self._claim(claim, response)
+        log_row, money_rows = transaction_rows(
+            self.machine_id, product_id, state, inserted, result
         )
-        self.db.add(tx)
-        self.db.flush() 
-
-        for m in req.inserted_money:
-            self.db.add(
-                TransactionMoneyModel(
-                    id=generate(),
-                    transaction_id=tx.id,
-                    denomination=m.denomination,
-                    quantity=m.quantity,
-                    direction="inserted",
-                )
-            )
+        log_queue = get_log_queue()
+        returned = []
+        for statement, expected in purchase_writes(
+            self.machine_id,
+            product_id,
+            state,
+            result,
+            log_row,
+            money_rows,
+            deferred=log_queue is not None,
+        ):
+            outcome = await self.db.execute(statement)
+            if expected is not None:
+                rows = outcome.all()
+                if len(rows) != expected:
+                    raise PurchaseConflict()
+                returned.append(rows)
 
-        for denom, qty in change.items():
-            self.db.add(
-                TransactionMoneyModel(
-                    id=generate(),
-                    transaction_id=tx.id,
-                    denomination=denom,
-                    quantity=qty,
-                    direction="change",
-                )
-            )
-            merged_balance[denom] -= qty
-
-        for denom, amount in merged_balance.items():
-            balance_row = (
-                self.db.query(BalanceModel)
-                .filter(
-                    BalanceModel.machine_id == DEFAULT_MACHINE_ID,
-                    BalanceModel.denomination == denom,
-                )
-                .first()
+        if log_queue is not None:
+            await asyncio.to_thread(
+                log_queue.append, log_row, money_rows, returned[0][0][-1]
             )
+        await self.db.commit()
+        _patch_catalog(self.machine_id, product_id, returned)
+        return response
 
-            if balance_row:
-                balance_row.amount = amount
-            else:
-                self.db.add(
-                    BalanceModel(
-                        id=generate(),
-                        machine_id=DEFAULT_MACHINE_ID,
-                        denomination=denom,
-                        amount=amount,
-                        type="coin" if denom < 20 else "banknote",
-                    )
-                )
-
-        machine_product.stock -= 1
+    async def buy_product(
+        self,
+        req: PurchaseRequest,
+        idempotency_key: str | None = None,
+    ) -> PurchaseResponse:
+        inserted = _parse_inserted(req)
+        if idempotency_key is None:
+            return await self._buy(req.product_id, inserted)
+        claim = _claim_for(self.machine_id, idempotency_key, req.product_id, inserted)
+        return await idempotency_store.arun(
+            self.machine_id,
+            idempotency_key,
+            claim.fingerprint,
+            lambda: self._buy(req.product_id, inserted, claim),
+            self.db,
+        )
 
-        self.db.commit()
+    async def _buy(
+        self,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ) -> PurchaseResponse:
+        try:
+            response = await self._purchase(product_id, inserted, claim)
+        except HTTPException as e:
+            _count_outcome(e)
+            raise
+        _count_outcome()
+        return response
 
-        return PurchaseResponse(
-            product_name=product.name,
-            paid_amount=total_paid,
-            change_amount=change_amount,
-            change=change,
-        )
+    async def _purchase(
+        self,
+        product_id: UUID,
+        inserted: MoneyVector,
+        claim: IdempotencyClaim | None = None,
+    ) -> PurchaseResponse:
+        ledger = _get_ledger()
+        if ledger is not None:
+            return await asyncio.wrap_future(
+                ledger.submit(self.machine_id, product_id, inserted, claim)
+            )
+
+        for attempt in range(PURCHASE_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(_retry_delay(attempt))
+            try:
+                return await self._try_buy_product(product_id, inserted, claim)
+            except PurchaseConflict:
+                await self.db.rollback()
+            except OperationalError as e:
+                await self.db.rollback()
+                if not _is_retryable(e):
+                    raise
 
+        raise busy()
@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import IMAGE_VARIANT_THREADS, MAX_IMAGE_BYTES
+
+logger = logging.getLogger(__name__)
+
+IMAGE_DIR = Path(__file__).resolve().parent.parent.parent.parent / "images"
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+CHUNK_SIZE = 64 * 1024
+
+# Longest side in pixels: the admin table (80 px), a kiosk tile (112 px
+# high), the preview dialog; each about 2x for high-density screens.
+VARIANT_SIZES = {"thumbnail": 160, "tile": 320, "full": 1024}
+VARIANT_FORMATS = ("webp", "png")
+VARIANT_DIR = "variants"
+
+
+def _publish(tmp_name: str, target: Path) -> None:
+    # NamedTemporaryFile creates files as 0600; the server that serves them
+    # may run as another user.
+    os.chmod(tmp_name, 0o644)
+    os.replace(tmp_name, target)
+
+
+def save_image(
+    image: UploadFile,
+    directory: Path = IMAGE_DIR,
+    limit: int = MAX_IMAGE_BYTES,
+) -> str:
+    # Copies the upload in chunks, hashing as it goes, and stores it as
+    # <sha256><suffix>: the same image uploaded again (for another product
+    # or machine) is the same file, and the old copy is kept as is. Blocking
+    # file I/O, so call it from a sync route (the threadpool).
+    suffix = Path(image.filename or "").suffix.lower()
+    if suffix not in IMAGE_SUFFIXES:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Image must be one of {', '.join(sorted(IMAGE_SUFFIXES))}",
+        )
+
+    directory.mkdir(exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    # In the target directory, so the final rename is atomic.
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".part", delete=False) as tmp:
+        try:
+            while chunk := image.file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Image is larger than {limit} bytes",
+                    )
+                digest.update(chunk)
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+
+    filename = f"{digest.hexdigest()}{suffix}"
+    target = directory / filename
+    if target.exists():
+        os.unlink(tmp.name)
+    else:
+        _publish(tmp.name, target)
+    return f"/images/{filename}"
+
+
+def variant_urls(image: str) -> dict[str, dict[str, str]]:
+    # Where the resized copies of an /images/ URL are served, whether or not
+    # they have been rendered yet; {} for images stored anywhere else.
+    prefix, sep, filename = image.rpartition("/images/")
+    if not sep or "/" in filename or not filename:
+        return {}
+    stem = Path(filename).stem
+    return {
+        size: {
+            fmt: f"{prefix}/images/{VARIANT_DIR}/{stem}-{size}.{fmt}"
+            for fmt in VARIANT_FORMATS
+        }
+        for size in VARIANT_SIZES
+    }
+
+
+def render_variants(source: Path) -> int:
+    # Writes every size and format of `source` that is missing or older
+    # than it, next to it under variants/; returns how many were written.
+    # The files on disk are the cache, so this is cheap when nothing changed.
+    target_dir = source.parent / VARIANT_DIR
+    mtime = source.stat().st_mtime
+    missing = []
+    for size in VARIANT_SIZES:
+        for fmt in VARIANT_FORMATS:
+            path = target_dir / f"{source.stem}-{size}.{fmt}"
+            if not path.exists() or path.stat().st_mtime < mtime:
+                missing.append((size, fmt, path))
+    if not missing:
+        return 0
+
+    # Only the workers that render need Pillow loaded.
+    from PIL import Image, ImageOps
+
+    target_dir.mkdir(exist_ok=True)
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        alpha = original.mode in ("RGBA", "LA", "PA") or "transparency" in original.info
+        original = original.convert("RGBA" if alpha else "RGB")
+
+        for size, fmt, path in missing:
+            image = original.copy()
+            image.thumbnail((VARIANT_SIZES[size],) * 2, Image.Resampling.LANCZOS)
+            if fmt == "png":
+                # The fallback for browsers without WebP: 256 colours keep
+                # it within a few times the WebP size.
+                image = image.quantize(method=Image.Quantize.FASTOCTREE)
+                options = {"optimize": True}
+            else:
+                options = {"quality": 80, "method": 4}
+            # Renamed into place, so a concurrent request never reads half
+            # a file and two workers rendering the same image don't clash.
+            with tempfile.NamedTemporaryFile(
+                dir=target_dir, suffix=".part", delete=False
+            ) as tmp:
+                image.save(tmp, format=fmt.upper(), **options)
+            _publish(tmp.name, path)
+    return len(missing)
+
+
+def _render(source: Path) -> int:
+    try:
+        return render_variants(source)
+    except Exception:
+        logger.exception("could not render variants of %s", source.name)
+        return 0
+
+
+def image_files(directory: Path = IMAGE_DIR) -> list[Path]:
+    return sorted(
+        path
+        for path in directory.iterdir()
+        if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES
+    )
+
+
+_pool: ThreadPoolExecutor | None = None
+
+
+def start_image_pool(directory: Path = IMAGE_DIR) -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            IMAGE_VARIANT_THREADS, thread_name_prefix="image-variants"
+        )
+        # Catches up on images that predate the variants, or whose
+        # rendering was cut short by a restart.
+        if directory.is_dir():
+            for source in image_files(directory):
+                _pool.submit(_render, source)
+    return _pool
+
+
+def stop_image_pool() -> None:
+    global _pool
+    if _pool is not None:
+        # Unstarted renders are dropped; the next start picks them up.
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def queue_variants(image: str, directory: Path = IMAGE_DIR) -> Future | None:
+    # Renders the variants of a just-saved /images/ path in the background.
+    # Without a running pool (scripts, tests) it renders before returning.
+    source = directory / image.rpartition("/")[2]
+    if _pool is None:
+        _render(source)
+        return None
+    return _pool.submit(_render, source)
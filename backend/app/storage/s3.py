@@ -1,4 +1,3 @@
-import boto3
 import os
 from dotenv import load_dotenv
 from fastapi import UploadFile
@@ -8,6 +7,10 @@ load_dotenv()
 BUCKET_NAME = os.getenv("S3_BUCKET")
 
 def get_s3_client():
+    # boto3 takes a good part of a second to import; only pay for it when
+    # the s3 driver is actually used.
+    import boto3
+
     return boto3.client(
         "s3",
         endpoint_url=os.getenv("ENDPOINT"),
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import namedtuple
+from uuid import uuid4
+
+from app.service.admin_service import AdminService
+from app.service.catalog_cache import CatalogCache, catalog_cache
+from app.service.vending_service import VendingService
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.test.test_vending_service import _product, count_statements
+
+ProductRow = namedtuple("ProductRow", "id name price image stock version")
+BalanceRow = namedtuple("BalanceRow", "denomination amount version")
+
+MACHINE = uuid4()
+PRODUCT = uuid4()
+
+
+def _rows(stock=5, version=0):
+    return (
+        [ProductRow(PRODUCT, "Water", 20, "/images/water.png", stock, version)],
+        [BalanceRow(10, 4, 0), BalanceRow(5, 2, 0)],
+    )
+
+
+def _stocks(products, balance):
+    return {row[0]: row[4] for row in products}
+
+
+def test_concurrent_misses_share_one_load():
+    cache = CatalogCache(ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        started.set()
+        release.wait()
+        return _rows()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get(MACHINE, load, _stocks)))
+        for _ in range(8)
+    ]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    while cache.stats()["coalesced"] < 7:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1
+    assert results == [{PRODUCT: 5}] * 8
+    assert cache.get(MACHINE, load, _stocks) == {PRODUCT: 5}
+    assert cache.stats() == {
+        "entries": 1,
+        "hits": 1,
+        "misses": 1,
+        "coalesced": 7,
+        "invalidations": 0,
+        "patches": 0,
+    }
+
+
+def test_patches_never_go_back_in_version():
+    cache = CatalogCache(ttl=60)
+    cache.get(MACHINE, lambda: _rows(stock=5, version=3), _stocks)
+
+    cache.apply_purchase(MACHINE, PRODUCT, [(3, 5)], [(10, 3, 1)])
+    # A purchase that committed earlier but reports later.
+    cache.apply_purchase(MACHINE, PRODUCT, [(4, 4)], [(10, 4, 0)])
+
+    assert cache.get(MACHINE, _rows, _stocks) == {PRODUCT: 3}
+    assert cache._entries[MACHINE].balance[10] == (3, 1)
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    cache = CatalogCache(ttl=60)
+
+    def load():
+        cache.invalidate(MACHINE)
+        return _rows(stock=5)
+
+    assert cache.get(MACHINE, load, _stocks) == {PRODUCT: 5}
+    assert cache.get(MACHINE, lambda: _rows(stock=2), _stocks) == {PRODUCT: 2}
+
+
+def test_polls_are_served_from_memory(db, machine_id):
+    service = VendingService(db, machine_id)
+    service.get_products()
+
+    with count_statements(db) as statements:
+        products = service.get_products()
+
+    assert statements == []
+    assert len(products) == 5
+
+
+def test_purchase_and_admin_edit_update_the_cache(db, machine_id):
+    service = VendingService(db, machine_id)
+    service.get_products()
+    water = _product(db, "Water")
+
+    service.buy_product(
+        PurchaseRequest(
+            product_id=water.id,
+            inserted_money=[MoneyItem(denomination=20, quantity=1)],
+        )
+    )
+    with count_statements(db) as statements:
+        products = {p.name: p for p in service.get_products()}
+    assert statements == []
+    assert products["Water"].stock == 19
+
+    AdminService(db, machine_id).update_product(
+        water.id, name="Still Water", price=25, stock=7
+    )
+    products = {p.name: p for p in service.get_products()}
+    assert products["Still Water"].price == 25
+    assert products["Still Water"].stock == 7
+    assert machine_id in catalog_cache._entries
@@ -0,0 +1,115 @@
+import random
+
+import pytest
+from itertools import product as cartesian
+
+from app.domain.change import (
+    greedy_change,
+    optimal_change,
+    is_canonical,
+    change_availability,
+    conserving_change,
+)
+
+
+def _brute_force_min_coins(balance, amount):
+    denoms = sorted(balance)
+    best = None
+    for used in cartesian(*(range(balance[d] + 1) for d in denoms)):
+        if sum(d * q for d, q in zip(denoms, used)) == amount:
+            coins = sum(used)
+            best = coins if best is None else min(best, coins)
+    return best
+
+
+def test_optimal_finds_change_greedy_misses():
+    balance = {50: 1, 20: 3}
+
+    with pytest.raises(ValueError):
+        greedy_change(balance, 60)
+
+    assert optimal_change(balance, 60) == {20: 3}
+
+
+def test_optimal_uses_fewest_coins():
+    balance = {1: 3, 5: 2, 10: 1, 20: 4, 50: 1}
+
+    for amount in range(0, 120):
+        expected = _brute_force_min_coins(balance, amount)
+        if expected is None:
+            with pytest.raises(ValueError) as e:
+                optimal_change(balance, amount)
+            assert str(e.value) == "CANNOT_MAKE_CHANGE"
+            continue
+
+        change = optimal_change(balance, amount)
+        assert sum(d * q for d, q in change.items()) == amount
+        assert all(q <= balance[d] for d, q in change.items())
+        assert sum(change.values()) == expected
+
+
+def test_optimal_search_matches_brute_force_on_random_floats():
+    # Non-canonical denominations, so every case goes through the pruned
+    # search rather than the greedy fast path.
+    rng = random.Random(7)
+    for _ in range(200):
+        balance = {d: rng.randint(0, 4) for d in (1, 3, 4, 7, 12)}
+        amount = rng.randint(0, 60)
+        expected = _brute_force_min_coins(balance, amount)
+        if expected is None:
+            with pytest.raises(ValueError):
+                optimal_change(balance, amount)
+        else:
+            assert sum(optimal_change(balance, amount).values()) == expected
+
+
+def test_canonical_detection():
+    assert is_canonical((1000, 500, 100, 50, 20, 10, 5, 1))
+    assert not is_canonical((4, 3, 1))
+    assert not is_canonical((50, 20))
+
+
+def test_change_availability_matches_engine():
+    balance = {1: 2, 5: 1, 10: 0, 20: 3, 50: 1, 100: 0}
+    availability = change_availability(balance)
+
+    for amount in range(0, 101):
+        try:
+            optimal_change(balance, amount)
+            payable = True
+        except ValueError:
+            payable = False
+        assert availability.can_change(amount) == payable
+
+
+def test_change_hint():
+    # Change for 35 from a 50 needs 15, which the float cannot pay.
+    availability = change_availability({1: 0, 5: 0, 10: 1, 20: 0, 50: 0, 100: 0})
+    assert availability.hint(35) == (True, 5)
+    assert availability.hint(40) == (False, 50)
+
+    availability = change_availability({1: 0, 5: 0, 10: 0, 20: 0, 50: 0})
+    assert availability.hint(35) == (True, 5)
+
+
+def test_conserving_change_pays_whenever_possible():
+    balance = {1: 3, 5: 2, 10: 1, 20: 4, 50: 1}
+
+    for amount in range(0, 120):
+        try:
+            optimal_change(balance, amount)
+        except ValueError:
+            with pytest.raises(ValueError):
+                conserving_change(balance, amount)
+            continue
+
+        change = conserving_change(balance, amount)
+        assert sum(d * q for d, q in change.items()) == amount
+        assert all(q <= balance[d] for d, q in change.items())
+
+
+def test_conserving_change_keeps_small_coins():
+    # Fewest coins would empty the 5s; paying with the 20s keeps them.
+    balance = {1: 3, 5: 3, 10: 0, 20: 3, 50: 1}
+    assert optimal_change(balance, 68) == {50: 1, 5: 3, 1: 3}
+    assert conserving_change(balance, 68) == {20: 3, 5: 1, 1: 3}
@@ -0,0 +1,108 @@
+import random
+import threading
+from collections import Counter
+
+from fastapi import HTTPException
+
+from app.db.database import SessionLocal
+from app.models.models import BalanceModel, MachineProductModel, ProductModel
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.service.vending_service import VendingService
+
+THREADS = 12
+PURCHASES_PER_THREAD = 25
+PAYMENTS = [
+    [MoneyItem(denomination=50, quantity=1)],
+    [MoneyItem(denomination=100, quantity=1)],
+    [MoneyItem(denomination=20, quantity=2), MoneyItem(denomination=5, quantity=1)],
+    [MoneyItem(denomination=500, quantity=1)],
+]
+
+
+def _float(db):
+    return {b.denomination: b.amount for b in db.query(BalanceModel)}
+
+
+def _stock(db):
+    return {mp.product_id: mp.stock for mp in db.query(MachineProductModel)}
+
+
+def test_concurrent_purchases_conserve_stock_and_cash(db, machine_id):
+    products = {p.id: p.price for p in db.query(ProductModel)}
+    float_before = _float(db)
+    stock_before = _stock(db)
+    db.close()
+
+    sold = Counter()
+    moved = Counter()
+    errors = []
+    lock = threading.Lock()
+
+    def customer(seed):
+        rng = random.Random(seed)
+        session = SessionLocal()
+        try:
+            for _ in range(PURCHASES_PER_THREAD):
+                product_id = rng.choice(list(products))
+                payment = rng.choice(PAYMENTS)
+                try:
+                    response = VendingService(session, machine_id).buy_product(
+                        PurchaseRequest(
+                            product_id=product_id,
+                            inserted_money=payment,
+                        )
+                    )
+                except HTTPException as e:
+                    # 400: sold out / no change; 409: lost every retry.
+                    if e.status_code not in (400, 409):
+                        with lock:
+                            errors.append(e.detail)
+                    continue
+
+                with lock:
+                    sold[product_id] += 1
+                    for m in payment:
+                        moved[m.denomination] += m.quantity
+                    for denom, qty in response.change.items():
+                        moved[denom] -= qty
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+        finally:
+            session.close()
+
+    threads = [
+        threading.Thread(target=customer, args=(seed,))
+        for seed in range(THREADS)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+
+    session = SessionLocal()
+    try:
+        float_after = _float(session)
+        stock_after = _stock(session)
+    finally:
+        session.close()
+
+    # Total demand is well above total stock, so most of it sells (the
+    # float running out of change stops the rest); every unit sold must come
+    # off the stock exactly, without going negative.
+    assert sum(sold.values()) >= sum(stock_before.values()) / 2
+    for product_id, before in stock_before.items():
+        assert stock_after[product_id] >= 0
+        assert stock_after[product_id] == before - sold[product_id]
+
+    for denom in float_after:
+        assert float_after[denom] >= 0
+        assert float_after[denom] == float_before.get(denom, 0) + moved[denom]
+
+    revenue = sum(products[p] * n for p, n in sold.items())
+    assert (
+        sum(d * q for d, q in float_after.items())
+        == sum(d * q for d, q in float_before.items()) + revenue
+    )
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import threading
+from uuid import uuid4
+
+import pytest
+
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.service import events
+from app.service.admin_service import AdminService
+from app.service.catalog_cache import catalog_cache
+from app.service.events import RESYNC, EventHub
+from app.service.vending_service import VendingService
+from app.test.conftest import TEST_DATABASE_URL
+from app.test.test_catalog_cache import PRODUCT, _rows, _stocks
+from app.test.test_vending_service import _product, count_statements
+
+
+@pytest.fixture
+def push_events(monkeypatch):
+    # Off by default; these tests are about the events themselves.
+    monkeypatch.setattr(events, "PUSH_EVENTS", True)
+
+
+def _event(**fields) -> str:
+    return json.dumps(fields)
+
+
+def _drain(queue: asyncio.Queue) -> list[str]:
+    frames = []
+    while not queue.empty():
+        frames.append(queue.get_nowait())
+    return frames
+
+
+def test_events_reach_the_machine_and_fleet_subscribers():
+    async def run():
+        hub = EventHub(queue_size=4)
+        one, other = uuid4(), uuid4()
+        mine = hub.subscribe(one)
+        theirs = hub.subscribe(other)
+        fleet = hub.subscribe(None)
+
+        hub.publish(_event(type="stock", machine_id=str(one), product_id=str(PRODUCT), stock=3))
+        hub.publish(_event(type="product", product_id=str(PRODUCT), name="Water", price=25))
+
+        assert [f.split("\n")[0] for f in _drain(mine)] == ["event: stock", "event: product"]
+        assert [f.split("\n")[0] for f in _drain(theirs)] == ["event: product"]
+        assert len(_drain(fleet)) == 2
+
+        hub.unsubscribe(other, theirs)
+        assert hub.stats()["subscribers"] == 2
+
+    asyncio.run(run())
+
+
+def test_slow_client_is_told_to_resync():
+    async def run():
+        hub = EventHub(queue_size=2)
+        machine = uuid4()
+        queue = hub.subscribe(machine)
+        for stock in range(5):
+            hub.publish(_event(type="catalog", machine_id=str(machine), stock=stock))
+
+        # The backlog is replaced by one resync once it overflows.
+        assert RESYNC in _drain(queue)
+        assert hub.stats()["dropped"] > 0
+
+    asyncio.run(run())
+
+
+def test_remote_stock_event_patches_the_cache():
+    machine = uuid4()
+    catalog_cache.get(machine, lambda: _rows(stock=5, version=3), _stocks)
+    hub = EventHub()
+
+    hub.publish(
+        _event(type="stock", machine_id=str(machine), product_id=str(PRODUCT), stock=2, version=4)
+    )
+    # Older than what the cache holds: ignored.
+    hub.publish(
+        _event(type="stock", machine_id=str(machine), product_id=str(PRODUCT), stock=4, version=2)
+    )
+
+    assert catalog_cache.get(machine, _rows, _stocks) == {PRODUCT: 2}
+    catalog_cache.invalidate(machine)
+
+
+def test_float_edit_notifies_without_an_extra_statement(db, machine_id, push_events):
+    with count_statements(db) as statements:
+        AdminService(db, machine_id).set_balance([MoneyItem(denomination=20, quantity=9)])
+
+    assert len(statements) == 1
+    assert "pg_notify" in statements[0]
+
+
+def test_purchase_is_pushed_to_listeners(db, machine_id, push_events):
+    req = PurchaseRequest(
+        product_id=_product(db, "Water").id,
+        inserted_money=[MoneyItem(denomination=50, quantity=1)],
+    )
+    db.expire_all()
+
+    async def run():
+        hub = EventHub()
+        queue = hub.subscribe(machine_id)
+        hub.start(TEST_DATABASE_URL)
+        try:
+            while not hub.connected:
+                await asyncio.sleep(0.01)
+            assert queue.get_nowait() == RESYNC
+
+            done = threading.Event()
+            threading.Thread(
+                target=lambda: (
+                    VendingService(db, machine_id).buy_product(req),
+                    done.set(),
+                )
+            ).start()
+
+            frames = []
+            while len(frames) < 4:
+                frames.append(await asyncio.wait_for(queue.get(), 5))
+            assert done.wait(5)
+            return frames
+        finally:
+            await hub.stop()
+
+    frames = asyncio.run(run())
+    events = [json.loads(f.split("data: ", 1)[1]) for f in frames]
+
+    stock = [e for e in events if e["type"] == "stock"]
+    assert stock[0]["stock"] == 19
+    assert stock[0]["product_id"] == str(req.product_id)
+    # 50 in for a 20 Water: the note goes in, a 20 and a 10 come out.
+    balance = {e["denomination"] for e in events if e["type"] == "balance"}
+    assert balance == {50, 20, 10}
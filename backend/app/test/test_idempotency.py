@@ -0,0 +1,247 @@
+import threading
+import time
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+from app.domain.money import MoneyVector
+from app.models.models import (
+    IdempotencyKeyModel,
+    MachineProductModel,
+    TransactionLogModel,
+)
+from app.schemas.schemas import MoneyItem, PurchaseRequest, PurchaseResponse
+from app.service.idempotency import (
+    DuplicateKey,
+    IdempotencyClaim,
+    IdempotencyStore,
+    claim_write,
+    idempotency_store,
+)
+from app.service.vending_service import VendingService
+from app.test.test_vending_service import _product, count_statements
+
+MACHINE = uuid4()
+RESPONSE = PurchaseResponse(
+    product_name="Water", paid_amount=20, change_amount=0, change={}
+)
+
+
+def _request(product, note=50):
+    return PurchaseRequest(
+        product_id=product.id,
+        inserted_money=[MoneyItem(denomination=note, quantity=1)],
+    )
+
+
+def test_replay_returns_the_stored_response(db, machine_id):
+    water = _product(db, "Water")
+    service = VendingService(db, machine_id)
+    stock = db.get(MachineProductModel, (machine_id, water.id)).stock
+
+    req = _request(water)
+
+    first = service.buy_product(req, "kiosk-1:42")
+    with count_statements(db) as statements:
+        replay = service.buy_product(req, "kiosk-1:42")
+
+    assert statements == []
+    assert replay == first
+    db.expire_all()
+    assert db.get(MachineProductModel, (machine_id, water.id)).stock == stock - 1
+
+    with pytest.raises(HTTPException) as e:
+        service.buy_product(_request(water, note=100), "kiosk-1:42")
+    assert e.value.status_code == 422
+
+    service.buy_product(_request(water), "kiosk-1:43")
+    db.expire_all()
+    assert db.get(MachineProductModel, (machine_id, water.id)).stock == stock - 2
+    assert idempotency_store.stats()["replayed"] == 1
+
+
+def test_refusals_are_replayed_but_busy_is_not():
+    store = IdempotencyStore(ttl=60)
+    calls = []
+
+    def refuse():
+        calls.append(1)
+        raise HTTPException(400, "Out of stock")
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            store.run(MACHINE, "a", 1, refuse)
+    assert len(calls) == 1
+
+    def busy():
+        calls.append(1)
+        raise HTTPException(409, "Machine is busy, please retry")
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            store.run(MACHINE, "b", 1, busy)
+    assert len(calls) == 3
+
+
+def test_concurrent_duplicates_wait_for_the_first():
+    store = IdempotencyStore(ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    purchases = []
+
+    def purchase():
+        purchases.append(1)
+        started.set()
+        release.wait()
+        return RESPONSE
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(store.run(MACHINE, "k", 1, purchase))
+        )
+        for _ in range(8)
+    ]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    while store.stats()["waited"] < 7:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert purchases == [1]
+    assert results == [RESPONSE] * 8
+    assert store.stats()["in_flight"] == 0
+
+
+def test_store_is_bounded_by_count_and_ttl():
+    store = IdempotencyStore(ttl=60, max_keys=2)
+    for key in "abc":
+        store.run(MACHINE, key, 1, lambda: RESPONSE)
+    assert store.stats()["keys"] == 2
+    # "a" was dropped, so it runs again.
+    store.run(MACHINE, "a", 1, lambda: RESPONSE)
+    assert store.stats()["executed"] == 4
+
+    store = IdempotencyStore(ttl=0)
+    store.run(MACHINE, "a", 1, lambda: RESPONSE)
+    store.run(MACHINE, "a", 1, lambda: RESPONSE)
+    assert store.stats()["executed"] == 2
+
+
+def test_outcomes_survive_a_restart(db, machine_id):
+    water = _product(db, "Water")
+    service = VendingService(db, machine_id)
+    stock = db.get(MachineProductModel, (machine_id, water.id)).stock
+
+    first = service.buy_product(_request(water), "kiosk-1:44")
+    # A new worker, or this one restarted: nothing in memory.
+    idempotency_store.clear()
+    recovered = idempotency_store.stats()["recovered"]
+
+    assert service.buy_product(_request(water), "kiosk-1:44") == first
+    assert idempotency_store.stats()["recovered"] == recovered + 1
+    db.expire_all()
+    assert db.get(MachineProductModel, (machine_id, water.id)).stock == stock - 1
+
+    idempotency_store.clear()
+    with pytest.raises(HTTPException) as e:
+        service.buy_product(_request(water, note=100), "kiosk-1:44")
+    assert e.value.status_code == 422
+
+
+def test_refusals_are_stored_with_the_key(db, machine_id):
+    water = _product(db, "Water")
+    service = VendingService(db, machine_id)
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as e:
+            service.buy_product(_request(water, note=5), "kiosk-1:45")
+        assert e.value.detail == "Insufficient funds"
+        idempotency_store.clear()
+
+    assert db.scalar(
+        select(IdempotencyKeyModel.status_code).where(
+            IdempotencyKeyModel.key == "kiosk-1:45"
+        )
+    ) == 400
+
+
+def test_purchase_that_loses_its_key_is_rolled_back(db, machine_id):
+    # Another worker committed the key between our lookup and our write.
+    water = _product(db, "Water")
+    service = VendingService(db, machine_id)
+    stock = db.get(MachineProductModel, (machine_id, water.id)).stock
+    claim = IdempotencyClaim(machine_id, "kiosk-1:46", "elsewhere")
+    db.execute(claim_write(claim, RESPONSE))
+    db.commit()
+
+    with pytest.raises(DuplicateKey):
+        service._buy(water.id, MoneyVector.from_items(_request(water).inserted_money), claim)
+
+    db.expire_all()
+    assert db.get(MachineProductModel, (machine_id, water.id)).stock == stock
+    assert db.scalar(select(func.count()).select_from(TransactionLogModel)) == 0
+
+
+def test_ledger_drops_orders_whose_key_is_taken(db, machine_id):
+    from app.db.database import SessionLocal
+    from app.service.ledger import Ledger
+
+    water = _product(db, "Water")
+    stock = db.get(MachineProductModel, (machine_id, water.id)).stock
+    taken = IdempotencyClaim(machine_id, "taken", "elsewhere")
+    db.execute(claim_write(taken, RESPONSE))
+    db.commit()
+
+    ledger = Ledger(SessionLocal, threads=1)
+    ledger.recover()
+    try:
+        inserted = MoneyVector.from_items(_request(water).inserted_money)
+        lost = ledger.submit(machine_id, water.id, inserted, taken)
+        kept = ledger.submit(
+            machine_id, water.id, inserted, IdempotencyClaim(machine_id, "new", "x")
+        )
+        with pytest.raises(DuplicateKey):
+            lost.result()
+        assert kept.result().product_name == "Water"
+    finally:
+        ledger.stop()
+
+    db.expire_all()
+    assert db.get(MachineProductModel, (machine_id, water.id)).stock == stock - 1
+
+
+def test_async_purchases_store_their_key(db, machine_id):
+    import asyncio
+
+    from app.db.database import get_async_sessionmaker
+    from app.service.vending_service import AsyncVendingService
+
+    water = _product(db, "Water")
+    stock = db.get(MachineProductModel, (machine_id, water.id)).stock
+
+    async def buy_twice():
+        maker = get_async_sessionmaker()
+        try:
+            results = []
+            for _ in range(2):
+                idempotency_store.clear()
+                async with maker() as session:
+                    service = AsyncVendingService(session, machine_id)
+                    results.append(
+                        await service.buy_product(_request(water), "kiosk-1:47")
+                    )
+            return results
+        finally:
+            await maker.kw["bind"].dispose()
+
+    first, replay = asyncio.run(buy_twice())
+    assert replay == first
+    db.expire_all()
+    assert db.get(MachineProductModel, (machine_id, water.id)).stock == stock - 1
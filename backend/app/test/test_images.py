@@ -0,0 +1,120 @@
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from app.middleware.upload_limit_middleware import UploadLimitMiddleware
+from app.schemas.schemas import Product
+from app.storage.images import queue_variants, render_variants, save_image, variant_urls
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 1000
+
+
+def _upload(data: bytes, filename: str = "water.png") -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=filename)
+
+
+def test_images_are_stored_by_content_hash(tmp_path):
+    first = save_image(_upload(PNG), tmp_path)
+    again = save_image(_upload(PNG, "copy.PNG"), tmp_path)
+
+    assert first == again == f"/images/{hashlib.sha256(PNG).hexdigest()}.png"
+    assert [p.name for p in tmp_path.iterdir()] == [first.rsplit("/", 1)[1]]
+    stored = tmp_path / first.rsplit("/", 1)[1]
+    assert stored.read_bytes() == PNG
+    assert stored.stat().st_mode & 0o777 == 0o644
+
+
+def test_oversized_image_is_refused_and_removed(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        save_image(_upload(PNG), tmp_path, limit=len(PNG) - 1)
+
+    assert error.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_non_image_suffix_is_refused(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        save_image(_upload(b"<?php", "shell.php"), tmp_path)
+
+    assert error.value.status_code == 415
+
+
+def test_large_multipart_bodies_are_refused_before_the_route():
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, limit=1024)
+    seen = []
+
+    @app.post("/upload")
+    def upload(image: UploadFile = File(...)):
+        seen.append(image.filename)
+        return {}
+
+    client = TestClient(app)
+    small = client.post("/upload", files={"image": ("a.png", b"x" * 100)})
+    large = client.post("/upload", files={"image": ("b.png", b"x" * 2048)})
+
+    assert small.status_code == 200
+    assert large.status_code == 413
+    assert seen == ["a.png"]
+
+
+def _photo(path, size=(1200, 900)):
+    from PIL import Image
+
+    # Noisy enough to compress like a photo rather than a flat fill.
+    Image.effect_noise(size, 64).convert("RGB").save(path, format="PNG")
+
+
+def test_variant_urls_follow_the_image_url():
+    urls = variant_urls("http://localhost:8000/api/v1/images/abc.png")
+
+    assert set(urls) == {"thumbnail", "tile", "full"}
+    assert urls["tile"] == {
+        "webp": "http://localhost:8000/api/v1/images/variants/abc-tile.webp",
+        "png": "http://localhost:8000/api/v1/images/variants/abc-tile.png",
+    }
+    assert variant_urls("https://cdn.example.com/abc.png") == {}
+
+
+def test_products_list_their_variants():
+    product = Product(
+        id="00000000-0000-0000-0000-000000000001",
+        name="Water",
+        price=20,
+        stock=1,
+        image="/images/water.png",
+    )
+
+    dumped = product.model_dump()
+    assert dumped["image_variants"]["thumbnail"]["webp"] == (
+        "/images/variants/water-thumbnail.webp"
+    )
+
+
+def test_variants_are_resized_and_cached_on_disk(tmp_path):
+    from PIL import Image
+
+    source = tmp_path / "photo.png"
+    _photo(source)
+
+    assert render_variants(source) == 6
+    assert render_variants(source) == 0
+
+    variants = tmp_path / "variants"
+    with Image.open(variants / "photo-tile.webp") as tile:
+        assert tile.size == (320, 240)
+    with Image.open(variants / "photo-full.png") as full:
+        assert full.size == (1024, 768)
+    assert (variants / "photo-tile.webp").stat().st_size < source.stat().st_size / 10
+    assert not list(variants.glob("*.part"))
+    assert all(p.stat().st_mode & 0o777 == 0o644 for p in variants.iterdir())
+
+
+def test_queue_variants_renders_inline_without_a_pool(tmp_path):
+    _photo(tmp_path / "upload.png", (200, 100))
+
+    assert queue_variants("/images/upload.png", tmp_path) is None
+    assert len(list((tmp_path / "variants").iterdir())) == 6
@@ -0,0 +1,107 @@
+from uuid import uuid4
+
+from sqlalchemy import insert
+
+from app.models.models import (
+    BalanceModel,
+    MachineModel,
+    MachineProductModel,
+    ProductModel,
+)
+from app.schemas.schemas import MachineCreate, MoneyItem
+from app.service.admin_service import AdminService
+from app.service.import_service import ImportService, parse_rows
+from app.service.machine_service import MachineService
+from app.test.test_vending_service import _product, count_statements
+
+
+def test_set_balance_is_one_upsert(db, machine_id):
+    before = db.get(BalanceModel, (machine_id, 100)).version
+    db.expire_all()
+
+    with count_statements(db) as statements:
+        AdminService(db, machine_id).set_balance(
+            [
+                MoneyItem(denomination=100, quantity=7),
+                MoneyItem(denomination=1000, quantity=2),
+            ]
+        )
+
+    assert len(statements) == 1, statements
+    db.expire_all()
+    assert db.get(BalanceModel, (machine_id, 100)).amount == 7
+    assert db.get(BalanceModel, (machine_id, 100)).version == before + 1
+    assert db.get(BalanceModel, (machine_id, 1000)).amount == 2
+
+
+def test_csv_import_reports_row_errors(db, machine_id):
+    body = (
+        "name,price,image\n"
+        "Water,25,\n"
+        "Iced Tea,30,/images/tea.png\n"
+        "Lemonade,cheap,\n"
+        "Iced Tea,31,\n"
+    ).encode()
+
+    result = ImportService(db).import_products(parse_rows("text/csv", body))
+
+    assert result.applied == 2
+    assert [(e.row, e.error.split(":")[0]) for e in result.errors] == [
+        (3, "price"),
+        (4, "Duplicate of row 2"),
+    ]
+    db.expire_all()
+    water = _product(db, "Water")
+    assert (water.price, water.image) == (25, "/images/water.png")
+    assert result.products["Water"] == water.id
+    tea = _product(db, "Iced Tea")
+    assert result.products["Iced Tea"] == tea.id
+
+    lobby = MachineService(db).create_machine(MachineCreate(name="Lobby")).id
+    stock = ImportService(db).import_stock(
+        [
+            {"machine_id": str(lobby), "product_id": str(tea.id), "stock": 12},
+            {"machine_id": str(machine_id), "product_id": str(water.id), "stock": 3},
+            {"machine_id": str(uuid4()), "product_id": str(tea.id), "stock": 1},
+            {"machine_id": str(lobby), "product_id": str(uuid4()), "stock": 1},
+        ]
+    )
+    assert stock.applied == 2
+    assert [(e.row, e.error) for e in stock.errors] == [
+        (3, "Machine not found"),
+        (4, "Product not found"),
+    ]
+    db.expire_all()
+    assert db.get(MachineProductModel, (lobby, tea.id)).stock == 12
+    assert db.get(MachineProductModel, (machine_id, water.id)).stock == 3
+
+    balances = ImportService(db).import_balances(
+        [
+            {"machine_id": str(lobby), "denomination": 10, "quantity": 40},
+            {"machine_id": str(lobby), "denomination": 3, "quantity": 1},
+            {"machine_id": str(lobby), "denomination": 10, "quantity": -1},
+        ]
+    )
+    assert balances.applied == 1
+    assert [e.row for e in balances.errors] == [2, 3]
+    lobby_float = db.get(BalanceModel, (lobby, 10))
+    assert (lobby_float.amount, lobby_float.type) == (40, "coin")
+
+
+def test_large_import_is_batched(db, machine_id):
+    machines = [{"id": uuid4(), "name": f"fleet-{i}"} for i in range(2000)]
+    db.execute(insert(MachineModel), machines)
+    db.commit()
+    products = [p.id for p in db.query(ProductModel)]
+    rows = [
+        {"machine_id": m["id"], "product_id": p, "stock": 10}
+        for m in machines
+        for p in products
+    ]
+
+    with count_statements(db) as statements:
+        result = ImportService(db).import_stock(rows)
+
+    assert result.applied == len(rows) == 10_000
+    # Machine and product lookups, then the upsert a page of rows at a time.
+    assert len(statements) <= 2 + 10, len(statements)
@@ -0,0 +1,214 @@
+import threading
+import time
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+from app.db.database import SessionLocal
+from app.domain.money import MoneyVector
+from app.models.models import (
+    BalanceModel,
+    MachineProductModel,
+    ProductSalesModel,
+    SalesBucketModel,
+    TransactionLogModel,
+)
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.service import ledger as ledger_module
+from app.service.ledger import Ledger
+from app.service.vending_service import VendingService
+from app.test.test_vending_service import _product, count_statements
+
+
+def _stock(db, machine_id, product_id):
+    db.expire_all()
+    return db.scalar(
+        select(MachineProductModel.stock).where(
+            MachineProductModel.machine_id == machine_id,
+            MachineProductModel.product_id == product_id,
+        )
+    )
+
+
+def _float(db, machine_id):
+    db.expire_all()
+    return dict(
+        db.execute(
+            select(BalanceModel.denomination, BalanceModel.amount).where(
+                BalanceModel.machine_id == machine_id
+            )
+        ).all()
+    )
+
+
+def _burst(ledger, machine_id, orders):
+    # Holds the only pool thread so every order queues up behind it, then
+    # lets them go as one batch.
+    release = threading.Event()
+    ledger._executor.submit(release.wait)
+    futures = [ledger.submit(machine_id, p, inserted) for p, inserted in orders]
+    release.set()
+    return futures
+
+
+@pytest.fixture
+def ledger(db):
+    ledger = Ledger(SessionLocal, threads=1)
+    ledger.recover()
+    yield ledger
+    ledger.stop()
+
+
+def test_burst_is_written_in_one_transaction(db, machine_id, ledger):
+    water = _product(db, "Water").id
+    twenty = MoneyVector.from_dict({20: 1})
+    db.expire_all()
+
+    with count_statements(db) as statements:
+        futures = _burst(ledger, machine_id, [(water, twenty)] * 10)
+        responses = [f.result() for f in futures]
+
+    assert all(r.change_amount == 0 for r in responses)
+    # Stock, float, totals with buckets and log rows, money lines; no reads.
+    assert len(statements) == 4, statements
+    assert ledger.stats()["batch_sizes"]["count"] == 1
+    assert _stock(db, machine_id, water) == 10
+    assert _float(db, machine_id)[20] == 20
+    assert db.scalar(select(func.count()).select_from(TransactionLogModel)) == 10
+    assert db.scalar(
+        select(ProductSalesModel.units_sold).where(
+            ProductSalesModel.machine_id == machine_id
+        )
+    ) == 10
+
+
+def test_burst_queues_its_log_rows_before_commit(
+    db, machine_id, ledger, tmp_path, monkeypatch
+):
+    from app.db.log_queue import TransactionLogQueue
+
+    queue = TransactionLogQueue(tmp_path, SessionLocal)
+    monkeypatch.setattr(ledger_module, "get_log_queue", lambda: queue)
+    water = _product(db, "Water").id
+    twenty = MoneyVector.from_dict({20: 1})
+
+    futures = _burst(ledger, machine_id, [(water, twenty)] * 3)
+    [f.result() for f in futures]
+
+    assert db.scalar(select(func.count()).select_from(TransactionLogModel)) == 0
+    assert queue.flush() == 3
+    assert queue.stats()["flushed"] == 3
+    assert db.scalar(select(func.count()).select_from(TransactionLogModel)) == 3
+
+def test_refusals_in_a_burst_do_not_stop_the_rest(db, machine_id, ledger):
+    water = _product(db, "Water").id
+    futures = _burst(
+        ledger,
+        machine_id,
+        [
+            (water, MoneyVector.from_dict({10: 1})),
+            (water, MoneyVector.from_dict({50: 1})),
+        ],
+    )
+
+    with pytest.raises(HTTPException) as refused:
+        futures[0].result()
+    assert refused.value.detail == "Insufficient funds"
+    assert futures[1].result().change == {20: 1, 10: 1}
+    assert _stock(db, machine_id, water) == 19
+    assert db.scalar(
+        select(func.sum(SalesBucketModel.refusals)).where(
+            SalesBucketModel.period == "day"
+        )
+    ) == 1
+
+
+def test_edit_made_elsewhere_is_reloaded_not_overwritten(db, machine_id, ledger):
+    water = _product(db, "Water").id
+    twenty = MoneyVector.from_dict({20: 1})
+    ledger.buy(machine_id, water, twenty)
+
+    # Restocked behind the ledger's back (no event is delivered here).
+    mp = db.get(MachineProductModel, (machine_id, water))
+    mp.stock = 50
+    db.commit()
+
+    ledger.buy(machine_id, water, twenty)
+
+    assert _stock(db, machine_id, water) == 49
+    assert ledger.stats()["conflicts"] == 1
+
+
+def test_unknown_product_is_not_found(db, machine_id, ledger):
+    with pytest.raises(HTTPException) as missing:
+        ledger.buy(machine_id, uuid4(), MoneyVector())
+    assert missing.value.status_code == 404
+
+
+def test_recovers_what_was_committed(db, machine_id, ledger):
+    water = _product(db, "Water").id
+    ledger.buy(machine_id, water, MoneyVector.from_dict({50: 1}))
+    ledger.stop()
+
+    recovered = Ledger(SessionLocal, threads=1)
+    recovered.recover()
+    book = recovered._books[machine_id]
+    try:
+        assert book.products[water][2] == _stock(db, machine_id, water)
+        assert book.balance.to_dict() == {
+            d: q for d, q in _float(db, machine_id).items() if q
+        }
+    finally:
+        recovered.stop()
+
+
+def test_service_goes_through_the_ledger(db, machine_id, ledger, monkeypatch):
+    monkeypatch.setattr(ledger_module, "_ledger", ledger)
+    req = PurchaseRequest(
+        product_id=_product(db, "Water").id,
+        inserted_money=[MoneyItem(denomination=20, quantity=1)],
+    )
+
+    service = VendingService(db, machine_id)
+    first = service.buy_product(req, idempotency_key="k1")
+    again = service.buy_product(req, idempotency_key="k1")
+
+    assert first == again
+    assert ledger.stats()["purchases"] == 1
+    assert _stock(db, machine_id, req.product_id) == 19
+
+
+def test_stop_fails_orders_left_in_the_queue(db, machine_id):
+    ledger = Ledger(SessionLocal, threads=1, max_batch=1)
+    ledger.recover()
+    water = _product(db, "Water").id
+    twenty = MoneyVector.from_dict({20: 1})
+
+    release = threading.Event()
+    ledger._executor.submit(release.wait)
+    futures = [ledger.submit(machine_id, water, twenty) for _ in range(3)]
+    stopper = threading.Thread(target=ledger.stop)
+    stopper.start()
+    while not ledger._stopping:
+        time.sleep(0.001)
+    release.set()
+    stopper.join(5)
+
+    # The batch already handed to the pool is written; the rest are told
+    # to retry instead of being resubmitted to a pool that is shut down.
+    assert futures[0].result().change_amount == 0
+    for future in futures[1:]:
+        assert future.exception().status_code == 409
+    assert ledger.submit(machine_id, water, twenty).exception().status_code == 409
+    assert _stock(db, machine_id, water) == 19
+
+
+def test_ledger_engine_without_events_fails_to_start(monkeypatch):
+    monkeypatch.setattr(ledger_module, "PURCHASE_ENGINE", "ledger")
+    monkeypatch.setattr(ledger_module, "PUSH_EVENTS", False)
+
+    with pytest.raises(RuntimeError, match="PUSH_EVENTS"):
+        ledger_module.start_ledger()
+    assert ledger_module.get_ledger() is None
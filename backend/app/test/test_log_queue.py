@@ -0,0 +1,183 @@
+import os
+from datetime import UTC, datetime
+from uuid import uuid4
+
+from nanoid import generate
+import pytest
+from sqlalchemy import String, cast, func, select
+
+from app.db.database import SessionLocal
+from app.db.log_queue import TransactionLogQueue
+from app.models.models import TransactionLogModel, TransactionMoneyModel
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.service import vending_service
+from app.service.transaction_service import TransactionService
+from app.service.vending_service import VendingService
+from app.test.test_vending_service import _product, count_statements
+
+
+def _count(db, model):
+    return db.scalar(select(func.count()).select_from(model))
+
+
+def _record(machine_id, product_id):
+    tx_id = uuid4()
+    now = datetime.now(UTC)
+    log_row = {
+        "id": tx_id,
+        "machine_id": machine_id,
+        "product_id": product_id,
+        "product_price": 20,
+        "paid_amount": 20,
+        "change_amount": 0,
+        "status": "success",
+        "created_at": now,
+        "updated_at": now,
+    }
+    money = {
+        "id": generate(),
+        "transaction_id": tx_id,
+        "denomination": 20,
+        "quantity": 1,
+        "direction": "inserted",
+    }
+    return log_row, [money]
+
+
+def test_queued_purchase_logs_after_flush(db, machine_id, tmp_path, monkeypatch):
+    queue = TransactionLogQueue(tmp_path, SessionLocal)
+    monkeypatch.setattr(vending_service, "get_log_queue", lambda: queue)
+    req = PurchaseRequest(
+        product_id=_product(db, "Water").id,
+        inserted_money=[MoneyItem(denomination=50, quantity=1)],
+    )
+    db.expire_all()
+
+    with count_statements(db) as statements:
+        response = VendingService(db, machine_id).buy_product(req)
+
+    # State read, stock update, float update, sales totals and buckets.
+    assert len(statements) == 4, statements
+    assert _count(db, TransactionLogModel) == 0
+    assert queue.stats()["depth"] == 1
+
+    assert queue.flush() == 1
+    assert queue.stats()["depth"] == 0
+    assert queue.stats()["lag_seconds"]["count"] == 1
+    [record] = TransactionService(db).list_transactions().items
+    assert record.change_amount == response.change_amount == 30
+    assert {(m.denomination, m.direction) for m in record.money} >= {
+        (50, "inserted")
+    }
+
+
+def test_queue_survives_a_crash_and_resends_safely(db, machine_id, tmp_path):
+    queue = TransactionLogQueue(tmp_path, SessionLocal, batch_size=2)
+    product = _product(db, "Water")
+    rows = [_record(machine_id, product.id) for _ in range(3)]
+    for log_row, money_rows in rows:
+        queue.append(log_row, money_rows)
+
+    # The worker dies without flushing; its lock goes with it and the next
+    # one takes over the same file.
+    os.close(queue._lock_fd)
+    restarted = TransactionLogQueue(tmp_path, SessionLocal, batch_size=2)
+    assert restarted.path == queue.path
+    assert restarted.stats()["depth"] == 3
+
+    # A batch already in Postgres (crash before the local delete) is sent
+    # again without duplicating anything.
+    restarted.append(*rows[0])
+    assert restarted.drain() == 4
+    assert _count(db, TransactionLogModel) == 3
+    assert _count(db, TransactionMoneyModel) == 3
+    assert restarted.stats()["depth"] == 0
+
+
+def test_records_wait_for_their_purchase_to_commit(db, machine_id, tmp_path):
+    queue = TransactionLogQueue(tmp_path, SessionLocal)
+    product = _product(db, "Water")
+    xid = select(cast(func.pg_current_xact_id(), String))
+    sessions = [SessionLocal(), SessionLocal()]
+    try:
+        kept, rolled_back = sessions
+        for session in sessions:
+            queue.append(*_record(machine_id, product.id), session.scalar(xid))
+
+        # Both purchases are still open.
+        assert queue.flush() == 0
+        assert queue.stats()["depth"] == 2
+
+        kept.commit()
+        rolled_back.rollback()
+    finally:
+        for session in sessions:
+            session.close()
+
+    assert queue.flush() == 2
+    stats = queue.stats()
+    assert (stats["depth"], stats["flushed"], stats["discarded"]) == (0, 1, 1)
+    assert _count(db, TransactionLogModel) == 1
+
+
+def test_purchase_that_fails_to_commit_leaves_no_log(
+    db, machine_id, tmp_path, monkeypatch
+):
+    queue = TransactionLogQueue(tmp_path, SessionLocal)
+    monkeypatch.setattr(vending_service, "get_log_queue", lambda: queue)
+    req = PurchaseRequest(
+        product_id=_product(db, "Water").id,
+        inserted_money=[MoneyItem(denomination=20, quantity=1)],
+    )
+
+    def lost_connection():
+        db.rollback()
+        raise ConnectionError("server closed the connection")
+
+    monkeypatch.setattr(db, "commit", lost_connection)
+    with pytest.raises(ConnectionError):
+        VendingService(db, machine_id).buy_product(req)
+
+    assert queue.stats()["depth"] == 1
+    assert queue.flush() == 1
+    assert queue.stats()["discarded"] == 1
+    assert _count(db, TransactionLogModel) == 0
+
+
+def test_open_purchases_do_not_hold_back_the_rest(db, machine_id, tmp_path):
+    queue = TransactionLogQueue(tmp_path, SessionLocal, batch_size=2)
+    product = _product(db, "Water")
+    session = SessionLocal()
+    try:
+        xid = session.scalar(select(cast(func.pg_current_xact_id(), String)))
+        # A whole batch of an open purchase at the head of the queue.
+        for _ in range(2):
+            queue.append(*_record(machine_id, product.id), xid)
+        for _ in range(3):
+            queue.append(*_record(machine_id, product.id))
+
+        assert queue.flush() == 2
+        assert queue.drain() == 1
+        assert queue.stats()["depth"] == 2
+        assert _count(db, TransactionLogModel) == 3
+    finally:
+        session.rollback()
+        session.close()
+
+    assert queue.drain() == 2
+    assert queue.stats()["discarded"] == 2
+
+
+def test_records_of_forgotten_transactions_are_held(db, machine_id, tmp_path):
+    queue = TransactionLogQueue(tmp_path, SessionLocal)
+    product = _product(db, "Water")
+    # Left by a worker that crashed long ago: Postgres no longer knows how
+    # that transaction ended.
+    queue.append(*_record(machine_id, product.id), "3")
+    queue.append(*_record(machine_id, product.id))
+
+    assert queue.flush() == 2
+    stats = queue.stats()
+    assert (stats["depth"], stats["flushed"], stats["discarded"]) == (0, 1, 0)
+    assert stats["held"] == 1
+    assert _count(db, TransactionLogModel) == 1
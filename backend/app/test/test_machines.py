@@ -0,0 +1,115 @@
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from app.db.seed_balance import seed_balance
+from app.db.seed_product import seed_products
+from app.models.models import BalanceModel, MachineProductModel, ProductModel
+from app.schemas.schemas import MachineCreate, MoneyItem, PurchaseRequest
+from app.service.machine_registry import machine_registry
+from app.service.machine_service import MachineService
+from app.service.vending_service import VendingService
+from app.test.test_vending_service import _product, count_statements
+
+
+def _add_machine(db, name):
+    machine = MachineService(db).create_machine(MachineCreate(name=name))
+    seed_products(db, machine.id)
+    seed_balance(db, machine.id)
+    return machine.id
+
+
+def _state(db, machine_id):
+    db.expire_all()
+    floats = {
+        b.denomination: b.amount
+        for b in db.query(BalanceModel).filter_by(machine_id=machine_id)
+    }
+    stock = {
+        mp.product_id: mp.stock
+        for mp in db.query(MachineProductModel).filter_by(machine_id=machine_id)
+    }
+    return floats, stock
+
+
+def test_machines_keep_their_own_stock_and_float(db, machine_id):
+    lobby = _add_machine(db, "Lobby")
+    water = _product(db, "Water")
+    main_before = _state(db, machine_id)
+    lobby_before = _state(db, lobby)
+    assert main_before == lobby_before
+
+    VendingService(db, lobby).buy_product(
+        PurchaseRequest(
+            product_id=water.id,
+            inserted_money=[MoneyItem(denomination=50, quantity=1)],
+        )
+    )
+
+    assert _state(db, machine_id) == main_before
+    lobby_float, lobby_stock = _state(db, lobby)
+    assert lobby_stock[water.id] == lobby_before[1][water.id] - 1
+    assert sum(d * q for d, q in lobby_float.items()) == (
+        sum(d * q for d, q in lobby_before[0].items()) + 20
+    )
+    assert len(VendingService(db, machine_id).get_products()) == 5
+
+
+def test_registry_serves_known_machines_from_memory(db, machine_id):
+    lobby = _add_machine(db, "Lobby")
+    machine_registry.clear()
+
+    assert machine_registry.get(db, lobby).name == "Lobby"
+    with count_statements(db) as statements:
+        assert machine_registry.get(db, lobby).id == lobby
+    assert statements == []
+
+    with pytest.raises(HTTPException) as e:
+        machine_registry.get(db, uuid4())
+    assert e.value.status_code == 404
+
+    names = [m.name for m in MachineService(db).list_machines()]
+    assert names == ["Lobby", "Main Vending Machine"]
+
+
+def test_deleting_a_product_only_takes_it_off_that_machine(db, machine_id):
+    from app.service.admin_service import AdminService
+    from app.service.product_service import ProductService
+
+    lobby = _add_machine(db, "Lobby")
+    water = _product(db, "Water").id
+
+    AdminService(db, machine_id).delete_product(water)
+
+    assert water not in _state(db, machine_id)[1]
+    assert water in _state(db, lobby)[1]
+    assert db.get(ProductModel, water) is not None
+
+    # Still stocked by the lobby machine.
+    with pytest.raises(HTTPException) as e:
+        ProductService(db).delete_product(water)
+    assert e.value.status_code == 409
+
+    AdminService(db, lobby).delete_product(water)
+    ProductService(db).delete_product(water)
+    db.expire_all()
+    assert db.get(ProductModel, water) is None
+
+
+def test_catalog_delete_refuses_products_with_sales(db, machine_id):
+    from app.service.admin_service import AdminService
+    from app.service.product_service import ProductService
+
+    water = _product(db, "Water").id
+    VendingService(db, machine_id).buy_product(
+        PurchaseRequest(
+            product_id=water,
+            inserted_money=[MoneyItem(denomination=20, quantity=1)],
+        )
+    )
+    AdminService(db, machine_id).delete_product(water)
+
+    with pytest.raises(HTTPException) as e:
+        ProductService(db).delete_product(water)
+    assert e.value.status_code == 409
@@ -0,0 +1,118 @@
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.core.config import CHANGE_ENGINE
+from app.core.metrics import (
+    CHANGE_SECONDS,
+    PURCHASES,
+    REQUEST_SECONDS,
+    Histogram,
+    Registry,
+)
+from app.middleware.metrics_middleware import MetricsMiddleware
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.service.vending_service import VendingService
+from app.test.test_vending_service import _product
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests = registry.histogram("req_seconds", "Latency.", ("route",), (0.1, 1.0))
+    errors = registry.counter("errors_total", "Errors.", ("kind",))
+    requests.observe(0.05, '/a"b')
+    requests.observe(2.0, '/a"b')
+    errors.inc("timeout")
+    errors.inc("timeout")
+
+    assert registry.render().splitlines() == [
+        "# HELP req_seconds Latency.",
+        "# TYPE req_seconds histogram",
+        'req_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+        'req_seconds_bucket{route="/a\\"b",le="1.0"} 1',
+        'req_seconds_bucket{route="/a\\"b",le="+Inf"} 2',
+        'req_seconds_sum{route="/a\\"b"} 2.05',
+        'req_seconds_count{route="/a\\"b"} 2',
+        "# HELP errors_total Errors.",
+        "# TYPE errors_total counter",
+        'errors_total{kind="timeout"} 2',
+    ]
+
+
+def test_unlabelled_histogram_lines():
+    histogram = Histogram((1.0,))
+    histogram.observe(0.5)
+
+    assert histogram.render("x") == [
+        'x_bucket{le="1.0"} 1',
+        'x_bucket{le="+Inf"} 1',
+        "x_sum 0.5",
+        "x_count 1",
+    ]
+
+
+def test_requests_are_labelled_by_route_template():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/things/{thing_id}")
+    def get_thing(thing_id: int):
+        if thing_id == 0:
+            raise HTTPException(404)
+        return {}
+
+    client = TestClient(app)
+    before = REQUEST_SECONDS.labels("GET", "/things/{thing_id}", 200).snapshot()["count"]
+    client.get("/things/1")
+    client.get("/things/2")
+    client.get("/things/0")
+    client.get("/nowhere")
+
+    assert REQUEST_SECONDS.labels("GET", "/things/{thing_id}", 200).snapshot()["count"] == before + 2
+    assert REQUEST_SECONDS.labels("GET", "/things/{thing_id}", 404).snapshot()["count"] >= 1
+    assert REQUEST_SECONDS.labels("GET", "unmatched", 404).snapshot()["count"] >= 1
+
+
+def test_purchases_are_counted_by_outcome(db, machine_id):
+    water = _product(db, "Water").id
+    service = VendingService(db, machine_id)
+    success = PURCHASES.value("success")
+    short = PURCHASES.value("insufficient_funds")
+    timed = CHANGE_SECONDS.labels(CHANGE_ENGINE).snapshot()["count"]
+
+    service.buy_product(
+        PurchaseRequest(
+            product_id=water,
+            inserted_money=[MoneyItem(denomination=50, quantity=1)],
+        )
+    )
+    with pytest.raises(HTTPException):
+        service.buy_product(
+            PurchaseRequest(
+                product_id=water,
+                inserted_money=[MoneyItem(denomination=10, quantity=1)],
+            )
+        )
+
+    assert PURCHASES.value("success") == success + 1
+    assert PURCHASES.value("insufficient_funds") == short + 1
+    assert CHANGE_SECONDS.labels(CHANGE_ENGINE).snapshot()["count"] == timed + 2
+
+
+def test_metrics_need_an_admin_or_the_scrape_token(monkeypatch):
+    import main
+    from app.service.auth_service import create_access_token
+
+    client = TestClient(main.app)
+    assert client.get("/api/v1/metrics").status_code == 401
+
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-me")
+    wrong = {"Authorization": "Bearer guess"}
+    right = {"Authorization": "Bearer scrape-me"}
+    assert client.get("/api/v1/metrics", headers=wrong).status_code == 401
+    response = client.get("/api/v1/metrics", headers=right)
+    assert response.status_code == 200
+    assert "# TYPE" in response.text
+
+    client.cookies.set("access_token", create_access_token({"sub": "admin"}))
+    assert client.get("/api/v1/metrics").status_code == 200
@@ -1,6 +1,7 @@
 import pytest
 from app.domain.types import Money
-from app.domain.purchase import purchase
+from app.domain.money import MoneyVector
+from app.domain.purchase import purchase, purchase_vector
 
 def test_success_can_make_change_with_inserted_money_counted():
     machine_balance = {10: 0, 5: 0, 1: 0}
@@ -44,3 +45,23 @@ def test_fail_cannot_make_change():
             inserted_money=[Money(50, 1)],
         )
     assert str(e.value) == "CANNOT_MAKE_CHANGE"
+
+def test_vector_purchase_matches_dict_purchase():
+    machine_balance = {10: 0, 5: 0, 1: 0}
+    inserted = [Money(10, 1), Money(5, 1), Money(1, 5)]
+
+    result = purchase_vector(
+        product_price=12,
+        product_stock=1,
+        machine_balance=MoneyVector.from_dict(machine_balance),
+        inserted_money=MoneyVector.from_items(inserted),
+    )
+
+    assert result.change.to_dict() == {5: 1, 1: 3}
+    assert result.balance.to_dict() == {10: 1, 1: 2}
+    assert result.paid_amount == 20
+
+def test_vector_rejects_unknown_denomination():
+    with pytest.raises(ValueError) as e:
+        MoneyVector.from_items([Money(3, 1)])
+    assert str(e.value) == "INVALID_DENOMINATION"
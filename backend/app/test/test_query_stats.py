@@ -0,0 +1,109 @@
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app.db.database import SessionLocal
+from app.db.query_stats import normalize_sql, parameter_shape, watch_queries
+from app.middleware.metrics_middleware import MetricsMiddleware
+from app.test.conftest import TEST_DATABASE_URL, max_statements
+from app.test.test_vending_service import _product
+
+
+def test_normalized_sql_is_one_line_with_one_values_row():
+    sql = """
+        INSERT INTO t (a, b)
+        VALUES (%(a_m0)s, %(b_m0)s), (%(a_m1)s, %(b_m1)s), (%(a_m2)s, %(b_m2)s)
+    """
+    assert normalize_sql(sql) == "INSERT INTO t (a, b) VALUES (:a_m0, :b_m0), ..."
+
+
+def test_parameter_shape_hides_values():
+    assert parameter_shape({"id": 1, "name": "x"}) == "{id: int, name: str}"
+    assert parameter_shape([{"id": 1}, {"id": 2}]) == "2 x {id: int}"
+    assert parameter_shape((1, "x")) == "(int, str)"
+
+
+def test_debug_header_counts_statements():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, debug=True)
+
+    @app.get("/twice")
+    def twice():
+        if not TEST_DATABASE_URL:
+            return {}
+        db = SessionLocal()
+        try:
+            db.execute(text("SELECT 1"))
+            db.execute(text("SELECT 2"))
+        finally:
+            db.close()
+        return {}
+
+    response = TestClient(app).get("/twice")
+
+    expected = "2" if TEST_DATABASE_URL else "0"
+    assert response.headers["x-db-statements"] == expected
+    assert float(response.headers["x-db-time-ms"]) >= 0
+
+
+def test_slow_queries_are_logged_with_shapes(db, caplog):
+    engine = create_engine(TEST_DATABASE_URL)
+    watch_queries(engine, slow_ms=0.001)
+    try:
+        with caplog.at_level(logging.WARNING, logger="app.db.query_stats"):
+            with engine.connect() as conn:
+                conn.execute(
+                    text("SELECT pg_sleep(0.01), :name"), {"name": "secret"}
+                )
+    finally:
+        engine.dispose()
+
+    [record] = caplog.records
+    assert "SELECT pg_sleep(0.01), :name" in record.getMessage()
+    assert "{name: str}" in record.getMessage()
+    assert "secret" not in record.getMessage()
+
+
+@pytest.fixture
+def client(db):
+    from app.service.auth_service import create_access_token
+    from main import app
+
+    # No lifespan: the db fixture has already built and seeded the schema.
+    client = TestClient(app)
+    client.cookies.set("access_token", create_access_token({"sub": "admin"}))
+    return client
+
+
+def test_endpoint_statement_budgets(db, machine_id, client):
+    machine = f"/api/v1/vending/machines/{machine_id}"
+    water = _product(db, "Water").id
+
+    # Machine lookup, then the catalog and the float.
+    with max_statements(3):
+        assert client.get(f"{machine}/products").status_code == 200
+    # Served from memory.
+    with max_statements(0):
+        client.get(f"{machine}/products")
+
+    with max_statements(5):
+        response = client.post(
+            f"{machine}/buy/product",
+            json={
+                "product_id": str(water),
+                "inserted_money": [{"denomination": 20, "quantity": 1}],
+            },
+        )
+    assert response.status_code == 200
+
+    admin = f"/api/v1/admin/machines/{machine_id}"
+    with max_statements(1):
+        assert client.get(f"{admin}/products").status_code == 200
+    with max_statements(1):
+        response = client.put(
+            f"{admin}/balance", json=[{"denomination": 20, "quantity": 5}]
+        )
+    assert response.status_code == 200
@@ -0,0 +1,103 @@
+from datetime import UTC, datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from app.db.backfill_sales import backfill_product_sales, backfill_sales_buckets
+from app.models.models import MachineProductModel, ProductSalesModel, TransactionLogModel
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.service.admin_service import AdminService
+from app.service.analytics_service import AnalyticsService
+from app.service.vending_service import VendingService
+from app.test.test_vending_service import _product, count_statements
+
+
+def _buy(db, machine_id, product, note):
+    VendingService(db, machine_id).buy_product(
+        PurchaseRequest(
+            product_id=product.id,
+            inserted_money=[MoneyItem(denomination=note, quantity=1)],
+        )
+    )
+
+
+def test_purchases_update_the_rollup(db, machine_id):
+    cola = _product(db, "Coca Cola")
+    _buy(db, machine_id, cola, 50)
+    _buy(db, machine_id, cola, 100)
+
+    sales = db.get(ProductSalesModel, (machine_id, cola.id))
+    assert sales.units_sold == 2
+    assert sales.revenue == 70
+    assert datetime.now(UTC) - sales.last_sold_at < timedelta(minutes=1)
+
+
+def test_list_products_is_one_query(db, machine_id):
+    _buy(db, machine_id, _product(db, "Water"), 20)
+    db.expire_all()
+
+    with count_statements(db) as statements:
+        products = {p.name: p for p in AdminService(db, machine_id).list_products()}
+
+    assert len(statements) == 1
+    assert products["Water"].total_sold == 1
+    assert products["Water"].revenue == 20
+    assert products["Pepsi"].total_sold == 0
+    assert products["Pepsi"].last_sold_at is None
+
+
+def test_backfill_from_transaction_logs(db, machine_id):
+    snickers = _product(db, "Snickers")
+    sold_at = datetime(2024, 1, 1, tzinfo=UTC)
+    for price in (40, 40, 35):
+        db.add(
+            TransactionLogModel(
+                id=uuid4(),
+                machine_id=machine_id,
+                product_id=snickers.id,
+                product_price=price,
+                paid_amount=price,
+                change_amount=0,
+                status="success",
+                created_at=sold_at,
+            )
+        )
+    db.commit()
+
+    assert backfill_product_sales(db) is True
+    assert backfill_product_sales(db) is False
+    assert backfill_sales_buckets(db) is True
+
+    sales = db.get(ProductSalesModel, (machine_id, snickers.id))
+    assert (sales.units_sold, sales.revenue, sales.last_sold_at) == (3, 115, sold_at)
+
+    analytics = AnalyticsService(db)
+    start = sold_at - timedelta(days=1)
+    for period in ("hour", "day"):
+        [bucket] = analytics.list_buckets(period, start, sold_at + timedelta(days=1))
+        assert (bucket.bucket_start, bucket.units, bucket.revenue) == (sold_at, 3, 115)
+
+
+def test_buckets_count_sales_change_and_refusals(db, machine_id):
+    water = _product(db, "Water")
+    _buy(db, machine_id, water, 50)
+    _buy(db, machine_id, water, 100)
+
+    db.query(MachineProductModel).filter_by(product_id=water.id).update({"stock": 0})
+    db.commit()
+    with pytest.raises(HTTPException):
+        _buy(db, machine_id, water, 20)
+
+    analytics = AnalyticsService(db)
+    for period in ("hour", "day"):
+        [bucket] = analytics.list_buckets(period)
+        assert bucket.product_id == water.id
+        assert (bucket.units, bucket.revenue, bucket.change_paid, bucket.refusals) == (
+            2, 40, 110, 1,
+        )
+
+    summary = analytics.summary("hour", product_id=water.id)
+    assert (summary.units, summary.revenue, summary.refusals) == (2, 40, 1)
+    assert AdminService(db, machine_id).get_total_earned() == 40
+    assert AdminService(db, machine_id).get_total_sold() == 2
@@ -0,0 +1,79 @@
+import subprocess
+import sys
+
+from sqlalchemy import delete, func, select
+
+from app.test.conftest import max_statements
+from app.test.test_vending_service import _product
+
+
+def test_prepare_database_seeds_once_then_only_checks_version(db):
+    from app.db.database import Base, engine
+    from app.db.init_db import SCHEMA_VERSION, prepare_database, schema_version
+    from app.models.models import BalanceModel, MachineProductModel
+
+    db.close()
+    Base.metadata.drop_all(bind=engine)
+    assert schema_version(engine) is None
+
+    assert prepare_database(engine)
+    assert schema_version(engine) == SCHEMA_VERSION
+    assert db.scalar(select(func.count()).select_from(MachineProductModel)) > 0
+    assert db.scalar(select(func.count()).select_from(BalanceModel)) > 0
+
+    with max_statements(1):
+        assert not prepare_database(engine)
+
+
+def test_prepare_database_does_not_reseed(db):
+    from app.db.database import engine
+    from app.db.init_db import prepare_database
+    from app.models.models import MachineProductModel, SchemaVersionModel
+
+    # An operator removed a product; an upgrade must not bring it back.
+    water = _product(db, "Water").id
+    db.execute(delete(MachineProductModel).where(MachineProductModel.product_id == water))
+    db.execute(delete(SchemaVersionModel))
+    db.commit()
+
+    assert prepare_database(engine)
+    assert db.scalar(
+        select(MachineProductModel).where(MachineProductModel.product_id == water)
+    ) is None
+
+
+
+def test_prepare_database_adds_row_versions_to_older_tables(db):
+    from sqlalchemy import inspect, text
+
+    from app.db.database import engine
+    from app.db.init_db import prepare_database
+    from app.models.models import SchemaVersionModel
+
+    db.execute(text("ALTER TABLE machine_products DROP COLUMN version"))
+    db.execute(text("ALTER TABLE balances DROP COLUMN version"))
+    db.execute(delete(SchemaVersionModel))
+    db.commit()
+
+    assert prepare_database(engine)
+    for table in ("machine_products", "balances"):
+        columns = {c["name"] for c in inspect(engine).get_columns(table)}
+        assert "version" in columns
+
+def test_seed_is_a_handful_of_statements(db):
+    from app.db.seed import seed_machine
+    from app.db.seed_balance import seed_balance
+    from app.db.seed_product import seed_products
+
+    machine_id = seed_machine(db)
+    with max_statements(4):
+        seed_products(db, machine_id)
+        seed_balance(db, machine_id)
+
+
+def test_storage_does_not_import_boto3():
+    code = (
+        "import sys, app.storage.storage;"
+        "assert 'boto3' not in sys.modules, 'boto3 imported'"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
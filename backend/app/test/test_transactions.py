@@ -0,0 +1,176 @@
+import base64
+import csv
+import gzip
+import io
+import json
+from datetime import UTC, datetime
+from uuid import UUID
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+
+from app.models.models import TransactionMoneyModel
+from app.service.export_service import export_transactions
+from app.service.transaction_service import (
+    TransactionService,
+    decode_cursor,
+    encode_cursor,
+)
+from app.test.test_sales import _buy
+from app.test.test_vending_service import _product, count_statements
+
+
+def _plan(db, query) -> str:
+    sql = str(
+        query.compile(
+            dialect=postgresql.dialect(),
+            compile_kwargs={"literal_binds": True},
+        )
+    )
+    return "\n".join(row[0] for row in db.execute(text(f"EXPLAIN {sql}")))
+
+
+def _fill_history(db, machine_id, rows: int) -> None:
+    # Enough history, spread over every product, for the planner to have
+    # real choices; then fresh statistics.
+    db.execute(
+        text(
+            """
+            INSERT INTO transaction_logs
+                (id, machine_id, product_id, product_price, paid_amount,
+                 change_amount, status, created_at, updated_at)
+            SELECT gen_random_uuid(), :machine, p.id, p.price, 100,
+                   100 - p.price, 'success',
+                   now() - n * interval '1 minute', now()
+            FROM generate_series(1, :rows) AS n
+            JOIN (
+                SELECT id, price, row_number() OVER () - 1 AS k,
+                       count(*) OVER () AS total
+                FROM products
+            ) AS p ON n % p.total = p.k
+            """
+        ),
+        {"machine": machine_id, "rows": rows},
+    )
+    db.execute(
+        text(
+            """
+            INSERT INTO transaction_money
+                (id, transaction_id, denomination, quantity, direction)
+            SELECT md5(id::text), id, 100, 1, 'inserted' FROM transaction_logs
+            """
+        )
+    )
+    db.commit()
+    db.execute(text("ANALYZE transaction_logs"))
+    db.execute(text("ANALYZE transaction_money"))
+
+
+def test_pages_walk_history_newest_first(db, machine_id):
+    cola, water = _product(db, "Coca Cola"), _product(db, "Water")
+    for product in (cola, water, cola, water, cola, water, cola):
+        _buy(db, machine_id, product, 100)
+
+    service = TransactionService(db)
+    seen, cursor = [], None
+    while True:
+        with count_statements(db) as statements:
+            page = service.list_transactions(
+                limit=3, machine_id=machine_id, cursor=cursor
+            )
+        assert len(statements) == 2
+        seen += page.items
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    assert len(seen) == 7
+    assert len({t.id for t in seen}) == 7
+    assert [t.created_at for t in seen] == sorted(
+        (t.created_at for t in seen), reverse=True
+    )
+    assert all(
+        sum(m.denomination * m.quantity for m in t.money if m.direction == "inserted")
+        == 100
+        for t in seen
+    )
+
+    water_only = service.list_transactions(limit=10, product_id=water.id)
+    assert len(water_only.items) == 3
+    assert water_only.next_cursor is None
+
+
+def test_bad_cursor_is_400(db, machine_id):
+    with pytest.raises(HTTPException) as e:
+        TransactionService(db).list_transactions(cursor="not-a-cursor")
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        "[1, 2, 3]",
+        "{}",
+        '{"a": 1, "b": 2, "c": 3}',
+        '"abc"',
+        "5",
+        "null",
+        # Right shape, but without a time zone.
+        json.dumps([str(UUID(int=1)), "2024-01-01T00:00:00", str(UUID(int=2))]),
+    ],
+)
+def test_well_formed_cursor_of_the_wrong_shape_is_400(payload):
+    cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+def test_history_queries_use_the_composite_indexes(db, machine_id):
+    _fill_history(db, machine_id, 20_000)
+    service = TransactionService(db)
+    cursor = encode_cursor(machine_id, datetime.now(UTC), machine_id)
+
+    plan = _plan(db, service.history_query(50, machine_id, cursor=cursor))
+    assert "ix_transaction_logs_machine_created" in plan, plan
+
+    plan = _plan(db, service.history_query(50, cursor=cursor))
+    assert "ix_transaction_logs_machine_created" in plan, plan
+
+    product = _product(db, "Water")
+    plan = _plan(
+        db,
+        service.history_query(
+            50, machine_id, product_id=product.id, cursor=cursor
+        ),
+    )
+    assert "ix_transaction_logs_machine_product_created" in plan, plan
+
+    plan = _plan(
+        db,
+        select(TransactionMoneyModel).where(
+            TransactionMoneyModel.transaction_id.in_([machine_id])
+        ),
+    )
+    assert "ix_transaction_money_transaction_id" in plan, plan
+
+
+def test_export_streams_csv_and_gzipped_ndjson(db, machine_id):
+    cola = _product(db, "Coca Cola")
+    for note in (50, 100, 500):
+        _buy(db, machine_id, cola, note)
+
+    chunks = list(export_transactions("csv", batch_size=2))
+    # Header, then one chunk per batch of two rows.
+    assert len(chunks) == 3
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+    assert [r["inserted"] for r in rows] == ["50x1", "100x1", "500x1"]
+    assert rows[0]["change"] == "10x1 5x1"
+
+    body = gzip.decompress(b"".join(export_transactions("ndjson", compress=True)))
+    records = [json.loads(line) for line in body.decode().splitlines()]
+    assert [r["paid_amount"] for r in records] == [50, 100, 500]
+    assert records[0]["product_id"] == str(cola.id)
+    assert {"denomination": 50, "quantity": 1, "direction": "inserted"} in records[0]["money"]
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from uuid import uuid4
+from contextlib import contextmanager
+from fastapi import HTTPException
+from sqlalchemy import event
+
+from app.models.models import BalanceModel, MachineProductModel, ProductModel
+from app.schemas.schemas import MoneyItem, PurchaseRequest
+from app.db.database import get_async_sessionmaker
+from app.service.vending_service import AsyncVendingService, VendingService
+
+
+@contextmanager
+def count_statements(db):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def _product(db, name):
+    return db.query(ProductModel).filter(ProductModel.name == name).one()
+
+
+def test_buy_product_round_trips(db, machine_id):
+    product = _product(db, "Coca Cola")
+    req = PurchaseRequest(
+        product_id=product.id,
+        inserted_money=[
+            MoneyItem(denomination=100, quantity=1),
+            MoneyItem(denomination=5, quantity=1),
+        ],
+    )
+    db.expire_all()
+
+    with count_statements(db) as statements:
+        response = VendingService(db, machine_id).buy_product(req)
+
+    # State read, stock update, float update, log insert, money lines.
+    assert len(statements) == 5, statements
+    assert response.change_amount == 70
+    assert sum(d * q for d, q in response.change.items()) == 70
+
+
+def test_buy_product_updates_stock_and_float(db, machine_id):
+    product = _product(db, "Water")
+    before = {b.denomination: b.amount for b in db.query(BalanceModel)}
+
+    response = VendingService(db, machine_id).buy_product(
+        PurchaseRequest(
+            product_id=product.id,
+            inserted_money=[MoneyItem(denomination=50, quantity=1)],
+        )
+    )
+
+    db.expire_all()
+    after = {b.denomination: b.amount for b in db.query(BalanceModel)}
+    stock = (
+        db.query(MachineProductModel.stock)
+        .filter(MachineProductModel.product_id == product.id)
+        .scalar()
+    )
+
+    assert stock == 19
+    assert after[50] == before[50] + 1 - response.change.get(50, 0)
+    assert sum(after[d] * d for d in after) == sum(before[d] * d for d in before) + 20
+
+
+def test_buy_unknown_product_is_404(db, machine_id):
+    with pytest.raises(HTTPException) as e:
+        VendingService(db, machine_id).buy_product(
+            PurchaseRequest(
+                product_id=uuid4(),
+                inserted_money=[MoneyItem(denomination=50, quantity=1)],
+            )
+        )
+    assert e.value.status_code == 404
+
+
+def test_async_buy_product_matches_sync(db, machine_id):
+    product = _product(db, "Pepsi")
+    req = PurchaseRequest(
+        product_id=product.id,
+        inserted_money=[MoneyItem(denomination=100, quantity=1)],
+    )
+    expected = VendingService(db, machine_id).buy_product(req)
+
+    async def buy():
+        maker = get_async_sessionmaker()
+        try:
+            async with maker() as session:
+                return await AsyncVendingService(session, machine_id).buy_product(req)
+        finally:
+            await maker.kw["bind"].dispose()
+
+    assert asyncio.run(buy()) == expected
+
+    db.expire_all()
+    stock = (
+        db.query(MachineProductModel.stock)
+        .filter(MachineProductModel.product_id == product.id)
+        .scalar()
+    )
+    assert stock == 8
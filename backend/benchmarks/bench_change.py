@@ -0,0 +1,49 @@
+# Per-call latency of the change engines on the default 8-denomination float.
+#
+#   cd backend && python -m benchmarks.bench_change
+import timeit
+
+from app.domain.change import greedy_change, optimal_change, _optimal_counts
+
+FLOAT = {1: 10, 5: 10, 10: 10, 20: 10, 50: 10, 100: 10, 500: 10, 1000: 10}
+# Float where greedy dead-ends and the DP has to search.
+DRAINED_FLOAT = {1: 0, 5: 0, 10: 0, 20: 6, 50: 3, 100: 1, 500: 1, 1000: 2}
+
+CASES = [
+    ("fast path, 65", FLOAT, 65),
+    ("fast path, 965", FLOAT, 965),
+    ("dp, 60 from 50x3/20x6", DRAINED_FLOAT, 60),
+    ("dp, 180 from 50x3/20x6", DRAINED_FLOAT, 180),
+]
+
+
+def _per_call_us(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'case':<28}{'greedy':>10}{'optimal':>10}{'cold':>10}  (us/call)")
+    for name, balance, amount in CASES:
+        def greedy():
+            try:
+                greedy_change(balance, amount)
+            except ValueError:
+                pass
+
+        def optimal():
+            optimal_change(balance, amount)
+
+        def cold():
+            _optimal_counts.cache_clear()
+            optimal_change(balance, amount)
+
+        print(
+            f"{name:<28}"
+            f"{_per_call_us(greedy, 20000):>10.2f}"
+            f"{_per_call_us(optimal, 20000):>10.2f}"
+            f"{_per_call_us(cold, 2000):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
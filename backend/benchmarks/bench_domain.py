@@ -0,0 +1,192 @@
+# Micro-benchmarks for the domain layer over synthetic workloads.
+#
+#   cd backend && python -m benchmarks.bench_domain
+#   python -m benchmarks.bench_domain --save benchmarks/baselines/domain.json
+#   python -m benchmarks.bench_domain --compare benchmarks/baselines/domain.json
+#
+# --compare exits non-zero when any case is slower than the baseline by more
+# than --threshold (default 25%).
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import timeit
+from datetime import datetime, UTC
+
+from app.domain.change import (
+    calculate_total_money,
+    merge_balance,
+    greedy_change,
+    optimal_change,
+)
+from app.domain.money import DENOMINATIONS, MoneyVector
+from app.domain.purchase import purchase, purchase_vector
+from app.domain.types import Money
+from app.schemas.schemas import MoneyItem
+
+DENOMINATION_SETS = {
+    4: (1, 5, 10, 20),
+    8: (1, 5, 10, 20, 50, 100, 500, 1000),
+    12: (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000),
+}
+FLOAT_SIZES = {"small": 2, "medium": 10, "large": 100}
+CHANGE_AMOUNTS = {"small": 15, "medium": 385, "large": 1865}
+INSERTED_LENGTHS = (1, 4, 16, 64)
+
+
+def _float(denoms, size):
+    return {d: size for d in denoms}
+
+
+def _inserted(denoms, length, cls):
+    rng = random.Random(length)
+    return [cls(rng.choice(denoms), rng.randint(1, 3)) for _ in range(length)]
+
+
+def _money_items(denoms, length):
+    return _inserted(
+        denoms,
+        length,
+        lambda d, q: MoneyItem(denomination=d, quantity=q),
+    )
+
+
+def _workloads():
+    for n, denoms in DENOMINATION_SETS.items():
+        for length in INSERTED_LENGTHS:
+            items = _money_items(denoms, length)
+            yield (
+                f"calculate_total_money/d{n}/len{length}",
+                lambda items=items: calculate_total_money(items),
+            )
+
+        for size_name, size in FLOAT_SIZES.items():
+            balance = _float(denoms, size)
+
+            for length in INSERTED_LENGTHS:
+                items = _money_items(denoms, length)
+                yield (
+                    f"merge_balance/d{n}/{size_name}/len{length}",
+                    lambda balance=balance, items=items: merge_balance(balance, items),
+                )
+
+            for amount_name, amount in CHANGE_AMOUNTS.items():
+                for name, engine in (
+                    ("greedy_change", greedy_change),
+                    ("optimal_change", optimal_change),
+                ):
+                    def run(engine=engine, balance=balance, amount=amount):
+                        try:
+                            engine(balance, amount)
+                        except ValueError:
+                            pass
+
+                    yield f"{name}/d{n}/{size_name}/{amount_name}", run
+
+            for length in INSERTED_LENGTHS:
+                inserted = _inserted(denoms, length, Money)
+                paid = sum(m.denomination * m.quantity for m in inserted)
+                price = max(paid - CHANGE_AMOUNTS["small"], 1)
+
+                def run(balance=balance, inserted=inserted, price=price):
+                    try:
+                        purchase(price, 1, balance, inserted)
+                    except ValueError:
+                        pass
+
+                yield f"purchase/d{n}/{size_name}/len{length}", run
+
+                if set(denoms) != set(DENOMINATIONS):
+                    continue
+
+                balance_vector = MoneyVector.from_dict(balance)
+                inserted_vector = MoneyVector.from_items(inserted)
+
+                def run(balance=balance_vector, inserted=inserted_vector, price=price):
+                    try:
+                        purchase_vector(price, 1, balance, inserted)
+                    except ValueError:
+                        pass
+
+                yield f"purchase_vector/d{n}/{size_name}/len{length}", run
+
+
+def _ns_per_call(fn, target=0.02, repeat=3):
+    # Best of `repeat` runs of roughly `target` seconds each.
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < target / 10:
+        number *= 10
+    number *= 10
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(pattern: str | None = None) -> dict:
+    results = {}
+    for name, fn in _workloads():
+        if pattern and pattern not in name:
+            continue
+        results[name] = round(_ns_per_call(fn), 1)
+
+    return {
+        "created_at": datetime.now(UTC).isoformat(),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "unit": "ns/call",
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, ns in report["results"].items():
+        before = baseline["results"].get(name)
+        if before and ns > before * (1 + threshold):
+            regressions.append(f"{name}: {before:.0f} -> {ns:.0f} ns ({ns / before - 1:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", dest="pattern", help="only run cases containing this")
+    parser.add_argument("--save", help="write the report as JSON to this path")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    report = run(args.pattern)
+
+    for name, ns in report["results"].items():
+        print(f"{name:<48}{ns:>12.0f} ns")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
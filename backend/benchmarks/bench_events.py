@@ -0,0 +1,103 @@
+# What idle event-stream clients cost the server: opens a number of SSE
+# connections to one machine, lets them sit, and reports the server's
+# resident memory and CPU time against an idle baseline. Then makes one
+# purchase and times how long it takes to reach every client. Starts its
+# own uvicorn against the database configured in .env.
+#
+#   cd backend && python -m benchmarks.bench_events --clients 2000 --idle 30
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from benchmarks.bench_http import BASE, _start_server, _top_up
+
+
+def _usage(pid: int) -> tuple[float, float]:
+    # (resident MB, CPU seconds) of the server process.
+    with open(f"/proc/{pid}/status") as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    return rss_kb / 1024, (int(fields[11]) + int(fields[12])) / ticks
+
+
+async def _run(url, pid, clients, idle):
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        machine_id = (await client.get(f"{BASE}/machines")).json()[0]["id"]
+        machine = f"{BASE}/machines/{machine_id}"
+        product_id = (await client.get(f"{machine}/products")).json()[0]["id"]
+
+    results = {"baseline": _usage(pid)}
+    limits = httpx.Limits(max_connections=clients + 10)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        opened = asyncio.Event()
+        ready = 0
+        received = []
+
+        async def listen():
+            nonlocal ready
+            async with client.stream("GET", f"{machine}/events") as response:
+                lines = response.aiter_lines()
+                await anext(lines)  # retry: ...
+                ready += 1
+                if ready == clients:
+                    opened.set()
+                async for line in lines:
+                    if line == "event: stock":
+                        received.append(time.perf_counter())
+                        return
+
+        tasks = [asyncio.create_task(listen()) for _ in range(clients)]
+        await opened.wait()
+        results["connected"] = _usage(pid)
+        await asyncio.sleep(idle)
+        results["idle"] = _usage(pid)
+
+        bought = time.perf_counter()
+        await client.post(
+            f"{machine}/buy/product",
+            json={
+                "product_id": product_id,
+                "inserted_money": [{"denomination": 100, "quantity": 1}],
+            },
+        )
+        await asyncio.gather(*tasks)
+        results["fan_out_ms"] = (max(received) - bought) * 1e3
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--idle", type=float, default=20)
+    parser.add_argument("--mode", default="sync")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    _top_up()
+    server = _start_server(args.mode, args.port, 1)
+    try:
+        r = asyncio.run(
+            _run(f"http://127.0.0.1:{args.port}", server.pid, args.clients, args.idle)
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+    base_rss, base_cpu = r["baseline"]
+    conn_rss, conn_cpu = r["connected"]
+    idle_rss, idle_cpu = r["idle"]
+    print(f"clients                 {args.clients}")
+    print(f"RSS baseline            {base_rss:.1f} MB")
+    print(f"RSS with clients        {idle_rss:.1f} MB "
+          f"({(idle_rss - base_rss) * 1024 / args.clients:.1f} KB/client)")
+    print(f"CPU while idle          {idle_cpu - conn_cpu:.2f} s over {args.idle:.0f} s")
+    print(f"purchase to all clients {r['fan_out_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Rows/sec and memory growth of the streaming transaction export.
+# Fills transaction_logs (and one money line per row) in the database from
+# .env with synthetic history first, so point it at a scratch database.
+#
+#   cd backend && python -m benchmarks.bench_export --rows 500000
+import argparse
+import resource
+import time
+
+from sqlalchemy import text
+
+from app.db.database import Base, SessionLocal, engine
+from app.service.export_service import export_transactions
+
+FILL = """
+INSERT INTO transaction_logs
+    (id, machine_id, product_id, product_price, paid_amount, change_amount,
+     status, created_at, updated_at)
+SELECT gen_random_uuid(), m.id, p.id, p.price, 100, 100 - p.price,
+       'success', now() - n * interval '1 second', now()
+FROM generate_series(1, :rows) AS n,
+     (SELECT id FROM machines LIMIT 1) AS m,
+     (SELECT id, price FROM products LIMIT 1) AS p
+RETURNING id
+"""
+
+FILL_MONEY = """
+INSERT INTO transaction_money (id, transaction_id, denomination, quantity, direction)
+SELECT md5(random()::text), id, 100, 1, 'inserted'
+FROM transaction_logs
+WHERE NOT EXISTS (
+    SELECT 1 FROM transaction_money m WHERE m.transaction_id = transaction_logs.id
+)
+"""
+
+
+def _fill(rows: int) -> int:
+    db = SessionLocal()
+    try:
+        have = db.execute(text("SELECT count(*) FROM transaction_logs")).scalar()
+        if have < rows:
+            db.execute(text(FILL), {"rows": rows - have})
+            db.execute(text(FILL_MONEY))
+            db.commit()
+            db.execute(text("ANALYZE transaction_logs"))
+        return max(have, rows)
+    finally:
+        db.close()
+
+
+def run(fmt: str, compress: bool, batch_size: int) -> dict:
+    # Peak RSS only ever grows, so its growth over the run is what the
+    # export needed on top of what was already there.
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    size = 0
+    for chunk in export_transactions(fmt, compress, batch_size=batch_size):
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "seconds": elapsed,
+        "bytes": size,
+        "rss_growth_bytes": (rss_after - rss_before) * 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--formats", nargs="*", default=["csv", "ndjson"])
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    rows = _fill(args.rows)
+
+    print(f"{rows} rows, batch size {args.batch_size}")
+    print(f"{'format':<12}{'rows/s':>10}{'MB out':>9}{'RSS +MB':>9}")
+    for fmt in args.formats:
+        for compress in (False, True):
+            r = run(fmt, compress, args.batch_size)
+            name = fmt + (".gz" if compress else "")
+            print(
+                f"{name:<12}{rows / r['seconds']:>10.0f}"
+                f"{r['bytes'] / 1e6:>9.1f}{r['rss_growth_bytes'] / 1e6:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Purchases/sec across a fleet: the same number of concurrent buyers either
+# all on one machine or spread over thousands, to show that machines do not
+# contend with each other. Adds the fleet machines (stocked and floated like
+# the first one) with a few bulk statements, then starts its own uvicorn
+# against the database configured in .env (use a scratch database).
+#
+#   cd backend && python -m benchmarks.bench_fleet --machines 5000 --concurrency 64
+import argparse
+import asyncio
+import random
+
+import httpx
+from sqlalchemy import text
+
+from benchmarks.bench_http import BASE, _load, _start_server, _top_up
+
+
+def _add_fleet(machines: int) -> None:
+    from app.db.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        db.execute(
+            text(
+                """
+                INSERT INTO machines (id, name)
+                SELECT gen_random_uuid(), 'fleet-' || lpad(n::text, 6, '0')
+                FROM generate_series(1, :machines) AS n
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM machines
+                    WHERE name = 'fleet-' || lpad(n::text, 6, '0')
+                )
+                """
+            ),
+            {"machines": machines},
+        )
+        # Every machine gets the stock and float rows of the first one.
+        db.execute(
+            text(
+                """
+                WITH template AS (
+                    SELECT id FROM machines
+                    WHERE name NOT LIKE 'fleet-%'
+                    ORDER BY name, id
+                    LIMIT 1
+                )
+                INSERT INTO machine_products
+                    (machine_id, product_id, stock, created_at, updated_at)
+                SELECT m.id, mp.product_id, mp.stock, now(), now()
+                FROM machines m
+                CROSS JOIN machine_products mp
+                WHERE mp.machine_id = (SELECT id FROM template)
+                  AND m.name LIKE 'fleet-%'
+                ON CONFLICT DO NOTHING
+                """
+            )
+        )
+        db.execute(
+            text(
+                """
+                WITH template AS (
+                    SELECT id FROM machines
+                    WHERE name NOT LIKE 'fleet-%'
+                    ORDER BY name, id
+                    LIMIT 1
+                )
+                INSERT INTO balances (machine_id, denomination, amount, type)
+                SELECT m.id, b.denomination, b.amount, b.type
+                FROM machines m
+                CROSS JOIN balances b
+                WHERE b.machine_id = (SELECT id FROM template)
+                  AND m.name LIKE 'fleet-%'
+                ON CONFLICT DO NOTHING
+                """
+            )
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _run(url, machines, concurrency, seconds):
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        fleet = [
+            m["id"]
+            for m in (await client.get(f"{BASE}/machines")).json()
+            if m["name"].startswith("fleet-")
+        ][:machines]
+        products = (await client.get(f"{BASE}/machines/{fleet[0]}/products")).json()
+    purchase = {
+        "product_id": products[0]["id"],
+        "inserted_money": [{"denomination": 100, "quantity": 1}],
+    }
+
+    def buy(targets):
+        rng = random.Random(0)
+        return lambda c: c.post(
+            f"{BASE}/machines/{rng.choice(targets)}/buy/product", json=purchase
+        )
+
+    return {
+        "1 machine": await _load(url, buy(fleet[:1]), concurrency, seconds),
+        f"{len(fleet)} machines": await _load(url, buy(fleet), concurrency, seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--machines", type=int, default=2000)
+    parser.add_argument("--mode", default="sync")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    _add_fleet(args.machines)
+    _top_up()
+    server = _start_server(args.mode, args.port, args.workers)
+    try:
+        results = asyncio.run(
+            _run(
+                f"http://127.0.0.1:{args.port}",
+                args.machines,
+                args.concurrency,
+                args.seconds,
+            )
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{'buying on':<16}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}  statuses")
+    for spread, r in results.items():
+        print(
+            f"{spread:<16}{r['rps']:>9.0f}"
+            f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}  {r['statuses']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
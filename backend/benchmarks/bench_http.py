@@ -0,0 +1,148 @@
+# Requests/sec and latency of a machine's /products and /buy/product with
+# the server in sync and async DB mode. Starts its own uvicorn per mode
+# against the database configured in .env (use a scratch database: stock
+# and float are topped up before each run).
+#
+#   cd backend && python -m benchmarks.bench_http --concurrency 64 --seconds 10
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import update
+
+BASE = "/api/v1/vending"
+
+
+def _top_up():
+    from app.db.database import SessionLocal
+    from app.models.models import BalanceModel, MachineProductModel
+
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(MachineProductModel)
+            .values(stock=1_000_000)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            update(BalanceModel)
+            .values(amount=1_000_000)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _start_server(mode: str, port: int, workers: int, **env) -> subprocess.Popen:
+    env = {**os.environ, "DB_MODE": mode, **env}
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(port),
+            "--workers", str(workers),
+            "--log-level", "warning",
+        ],
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"server in {mode} mode did not start")
+
+
+async def _load(url, make_request, concurrency, seconds):
+    latencies = []
+    statuses = {}
+    stop = time.perf_counter() + seconds
+
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        async def worker():
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                response = await make_request(client)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        began = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "requests": n,
+        "rps": n / elapsed,
+        "p50_ms": latencies[n // 2] * 1e3 if n else 0.0,
+        "p99_ms": latencies[min(n - 1, int(n * 0.99))] * 1e3 if n else 0.0,
+        "statuses": statuses,
+    }
+
+
+async def _run(url, concurrency, seconds):
+    async with httpx.AsyncClient(base_url=url) as client:
+        machine_id = (await client.get(f"{BASE}/machines")).json()[0]["id"]
+        machine = f"{BASE}/machines/{machine_id}"
+        products = (await client.get(f"{machine}/products")).json()
+    product_id = products[0]["id"]
+    purchase = {
+        "product_id": product_id,
+        "inserted_money": [{"denomination": 100, "quantity": 1}],
+    }
+
+    return {
+        "GET products": await _load(
+            url,
+            lambda c: c.get(f"{machine}/products"),
+            concurrency,
+            seconds,
+        ),
+        "POST buy/product": await _load(
+            url,
+            lambda c: c.post(f"{machine}/buy/product", json=purchase),
+            concurrency,
+            seconds,
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="*", default=["sync", "async"])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'mode':<7}{'endpoint':<28}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}  statuses")
+    for mode in args.modes:
+        _top_up()
+        server = _start_server(mode, args.port, args.workers)
+        try:
+            results = asyncio.run(
+                _run(f"http://127.0.0.1:{args.port}", args.concurrency, args.seconds)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+        for endpoint, r in results.items():
+            print(
+                f"{mode:<7}{endpoint:<28}{r['rps']:>9.0f}"
+                f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}  {r['statuses']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
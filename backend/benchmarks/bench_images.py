@@ -0,0 +1,48 @@
+# Bytes a kiosk downloads for its catalog tiles: the original uploads
+# against the tile-sized WebP and PNG variants, with the time to fetch them
+# over a slow link and the time to render the variants. Uses the images in
+# --source (the repo's images/ by default), copied to a temp directory.
+#
+#   cd backend && python -m benchmarks.bench_images --mbit 2
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from app.storage.images import IMAGE_DIR, VARIANT_DIR, image_files, render_variants
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=Path, default=IMAGE_DIR)
+    parser.add_argument("--size", default="tile")
+    parser.add_argument("--mbit", type=float, default=2.0)
+    args = parser.parse_args()
+
+    sources = image_files(args.source)
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for path in sources:
+            shutil.copy(path, directory / path.name)
+
+        started = time.perf_counter()
+        for path in sources:
+            render_variants(directory / path.name)
+        rendered = time.perf_counter() - started
+
+        totals = {"original": 0, "webp": 0, "png": 0}
+        for path in sources:
+            totals["original"] += path.stat().st_size
+            for fmt in ("webp", "png"):
+                variant = directory / VARIANT_DIR / f"{path.stem}-{args.size}.{fmt}"
+                totals[fmt] += variant.stat().st_size
+
+    print(f"{len(sources)} images, variants rendered in {rendered * 1000:.0f} ms")
+    print(f"{'served':<10}{'KB':>10}{f'ms @ {args.mbit:g} Mbit/s':>20}")
+    for name, size in totals.items():
+        print(f"{name:<10}{size / 1024:>10.1f}{size * 8 / (args.mbit * 1e6) * 1000:>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
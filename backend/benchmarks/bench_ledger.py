@@ -0,0 +1,59 @@
+# Purchases/sec with PURCHASE_ENGINE=db (read, decide, write per purchase)
+# against PURCHASE_ENGINE=ledger (decided in memory, bursts group-committed),
+# all buyers on one machine. Starts its own uvicorn per engine against the
+# database configured in .env (use a scratch database).
+#
+#   cd backend && python -m benchmarks.bench_ledger --concurrency 64 --seconds 10
+import argparse
+import asyncio
+
+import httpx
+
+from benchmarks.bench_http import BASE, _load, _start_server, _top_up
+
+
+async def _run(url, concurrency, seconds):
+    async with httpx.AsyncClient(base_url=url) as client:
+        machine_id = (await client.get(f"{BASE}/machines")).json()[0]["id"]
+        machine = f"{BASE}/machines/{machine_id}"
+        product_id = (await client.get(f"{machine}/products")).json()[0]["id"]
+    purchase = {
+        "product_id": product_id,
+        "inserted_money": [{"denomination": 100, "quantity": 1}],
+    }
+    return await _load(
+        url,
+        lambda c: c.post(f"{machine}/buy/product", json=purchase),
+        concurrency,
+        seconds,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engines", nargs="*", default=["db", "ledger"])
+    parser.add_argument("--mode", default="sync")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'engine':<8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}  statuses")
+    for engine in args.engines:
+        _top_up()
+        server = _start_server(args.mode, args.port, 1, PURCHASE_ENGINE=engine)
+        try:
+            r = asyncio.run(
+                _run(f"http://127.0.0.1:{args.port}", args.concurrency, args.seconds)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        print(
+            f"{engine:<8}{r['rps']:>9.0f}"
+            f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}  {r['statuses']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
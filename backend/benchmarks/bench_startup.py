@@ -0,0 +1,84 @@
+# Worker startup time: importing main and running the lifespan, each run in
+# a fresh interpreter, against the database configured in .env. "prepare"
+# clears the schema version first so the worker checks and upgrades the
+# schema and backfills again; "current" is the usual restart where only the
+# version is read.
+#
+#   cd backend && python -m benchmarks.bench_startup --runs 5
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+_CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from app.db.query_stats import QueryCounter, current_queries
+
+async def run():
+    queries = QueryCounter()
+    current_queries.set(queries)
+    began = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        ready = time.perf_counter()
+    return ready - began, queries.statements
+
+lifespan, statements = asyncio.run(run())
+print(json.dumps({
+    "import_s": imported - started,
+    "lifespan_s": lifespan,
+    "statements": statements,
+}))
+"""
+
+
+def _clear_version():
+    from sqlalchemy import delete
+
+    from app.db.database import SessionLocal
+    from app.models.models import SchemaVersionModel
+
+    db = SessionLocal()
+    try:
+        db.execute(delete(SchemaVersionModel))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _start_once() -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--paths", nargs="*", default=["prepare", "current"])
+    args = parser.parse_args()
+
+    # Make sure the schema exists before timing anything.
+    _start_once()
+
+    print(f"{'path':<9}{'import ms':>11}{'lifespan ms':>13}{'statements':>12}")
+    for path in args.paths:
+        runs = []
+        for _ in range(args.runs):
+            if path == "prepare":
+                _clear_version()
+            runs.append(_start_once())
+        print(
+            f"{path:<9}"
+            f"{statistics.median(r['import_s'] for r in runs) * 1000:>11.0f}"
+            f"{statistics.median(r['lifespan_s'] for r in runs) * 1000:>13.0f}"
+            f"{statistics.median(r['statements'] for r in runs):>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
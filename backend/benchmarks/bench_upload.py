@@ -0,0 +1,66 @@
+# Peak Python memory and time to store one uploaded image: the old
+# read-it-all-then-write against save_image's chunked, hashed copy, and a
+# re-upload of the same image. The upload is a spooled temp file rolled to
+# disk, as Starlette hands it to the route. Writes to a temp directory.
+#
+#   cd backend && python -m benchmarks.bench_upload --megabytes 20
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from fastapi import UploadFile
+
+from app.storage.images import save_image
+
+
+def _read_all(image: UploadFile, directory: Path) -> str:
+    filename = f"{uuid.uuid4()}.png"
+    with open(directory / filename, "wb") as f:
+        f.write(image.file.read())
+    return f"/images/{filename}"
+
+
+def _measure(store, data: bytes, directory: Path) -> tuple[float, float]:
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(data)
+    spooled.seek(0)
+    image = UploadFile(spooled, filename="image.png")
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    store(image, directory)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    spooled.close()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megabytes", type=int, default=20)
+    args = parser.parse_args()
+    data = os.urandom(args.megabytes * 1024 * 1024)
+    limit = len(data)
+
+    print(f"{'store':<12}{'ms':>8}{'peak MB':>10}{'files':>7}")
+    for name, store in [
+        ("read-all", _read_all),
+        ("streamed", lambda image, d: save_image(image, d, limit)),
+    ]:
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            for label in (name, f"{name} x2"):
+                elapsed, peak = _measure(store, data, directory)
+                print(
+                    f"{label:<12}{elapsed * 1000:>8.0f}{peak / 1e6:>10.2f}"
+                    f"{len(list(directory.iterdir())):>7}"
+                )
+
+
+if __name__ == "__main__":
+    main()
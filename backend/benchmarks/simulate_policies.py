@@ -0,0 +1,125 @@
+# Replays the same purchase stream through domain.purchase.purchase once per
+# change policy and reports refusal rate and per-decision cost.
+#
+#   cd backend && python -m benchmarks.simulate_policies --purchases 5000
+import argparse
+import json
+import random
+import time
+from collections import Counter
+
+from app.domain.change import CHANGE_ENGINES
+from app.domain.purchase import purchase
+from app.domain.types import Money
+
+FLOAT = {1: 10, 5: 10, 10: 10, 20: 10, 50: 10, 100: 10, 500: 10, 1000: 10}
+PRICES = [35, 35, 20, 45, 40]
+# How customers pay: mostly with a single note, sometimes with coins.
+NOTES = [(20, 3), (50, 4), (100, 4), (500, 2), (1000, 1)]
+
+
+def generate_stream(purchases: int, seed: int) -> list[tuple[int, list[Money]]]:
+    rng = random.Random(seed)
+    notes, weights = zip(*NOTES)
+    stream = []
+
+    for _ in range(purchases):
+        price = rng.choice(PRICES)
+
+        if rng.random() < 0.25:
+            # Coins up to the price, topped up with one 20 or 50.
+            coins = rng.randrange(0, price, 5)
+            inserted = [Money(5, coins // 5)] if coins else []
+            top_up = 20 if price - coins <= 20 else 50
+            inserted.append(Money(top_up, 1))
+        else:
+            note = rng.choices(notes, weights)[0]
+            inserted = [Money(note, -(-price // note))]
+
+        stream.append((price, inserted))
+
+    return stream
+
+
+def replay(
+    stream,
+    policy: str,
+    machine_float: dict[int, int],
+    restock_every: int = 0,
+) -> dict:
+    # restock_every > 0 resets the float every that many purchases, like a
+    # service visit.
+    make_change = CHANGE_ENGINES[policy]
+    balance = machine_float.copy()
+    refusals: Counter = Counter()
+    timings = []
+
+    for n, (price, inserted) in enumerate(stream):
+        if restock_every and n % restock_every == 0:
+            balance = machine_float.copy()
+
+        started = time.perf_counter()
+        try:
+            result = purchase(
+                product_price=price,
+                product_stock=1,
+                machine_balance=balance,
+                inserted_money=inserted,
+                make_change=make_change,
+            )
+        except ValueError as e:
+            timings.append(time.perf_counter() - started)
+            refusals[str(e)] += 1
+            continue
+        timings.append(time.perf_counter() - started)
+
+        for money in inserted:
+            balance[money.denomination] = (
+                balance.get(money.denomination, 0) + money.quantity
+            )
+        for denom, qty in result.change.items():
+            balance[denom] -= qty
+
+    timings.sort()
+    total = len(stream)
+    return {
+        "policy": policy,
+        "purchases": total,
+        "refused": sum(refusals.values()),
+        "refusal_rate": sum(refusals.values()) / total if total else 0.0,
+        "refusals": dict(refusals),
+        "mean_us": sum(timings) / total * 1e6 if total else 0.0,
+        "p99_us": timings[int(total * 0.99)] * 1e6 if total else 0.0,
+        "final_float": balance,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--purchases", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--restock-every", type=int, default=200)
+    parser.add_argument("--policies", nargs="*", default=list(CHANGE_ENGINES))
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    stream = generate_stream(args.purchases, args.seed)
+    reports = [
+        replay(stream, policy, FLOAT, args.restock_every)
+        for policy in args.policies
+    ]
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+
+    print(f"{'policy':<10}{'refused':>9}{'rate':>8}{'mean us':>10}{'p99 us':>10}")
+    for r in reports:
+        print(
+            f"{r['policy']:<10}{r['refused']:>9}{r['refusal_rate']:>8.1%}"
+            f"{r['mean_us']:>10.1f}{r['p99_us']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,27 @@
 # main.py
 
-from fastapi import FastAPI
+import hmac
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from app.db.database import engine
 from app.models import models
-from app.db.init_db import get_db
-from app.db.seed import seed_machine
-from app.db.seed_product import seed_products
-from app.db.seed_balance import seed_balance
-
-from app.middleware.auth_middleware import JWTAuthMiddleware
+from app.db.init_db import prepare_database
+from app.db.log_queue import start_log_queue, stop_log_queue
+from app.service.events import event_hub
+from app.service.ledger import start_ledger, stop_ledger
+from app.storage.images import start_image_pool, stop_image_pool
+
+from app.core.config import MAX_IMAGE_BYTES, METRICS_TOKEN
+from app.core.metrics import registry
+from app.middleware.auth_middleware import JWTAuthMiddleware, admin_claims
+from app.middleware.metrics_middleware import MetricsMiddleware
+from app.middleware.upload_limit_middleware import UploadLimitMiddleware
 from app.routers.auth_router import router as auth_router
 from app.routers.vending_router import router as vending_router
 from app.routers.admin_router import router as admin_router
@@ -24,17 +32,19 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    models.Base.metadata.create_all(bind=engine)
+    prepare_database(engine)
 
-    db = next(get_db())
+    start_log_queue()
+    event_hub.start()
+    start_ledger()
+    start_image_pool()
     try:
-        seed_machine(db)
-        seed_products(db)
-        seed_balance(db)
+        yield
     finally:
-        db.close()
-
-    yield
+        stop_image_pool()
+        stop_ledger()
+        await event_hub.stop()
+        stop_log_queue()
 
 
 app = FastAPI(
@@ -54,11 +64,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Room for the form fields around the image.
+app.add_middleware(UploadLimitMiddleware, limit=MAX_IMAGE_BYTES + 64 * 1024)
+
 app.add_middleware(
     JWTAuthMiddleware,
     protected_paths=["/api/v1/admin"],
 )
 
+# Outermost, so the latency includes the other middleware.
+app.add_middleware(MetricsMiddleware)
+
 app.mount(
     "/images",
     StaticFiles(directory=BASE_DIR / "images"),
@@ -68,3 +84,18 @@ app.mount(
 @app.get("/health", tags=["Health"])
 def health_check():
     return {"status": "ok"}
+
+
+# Prometheus text exposition format.
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+def metrics(request: Request):
+    bearer = request.headers.get("authorization", "").encode()
+    scraper = bool(METRICS_TOKEN) and hmac.compare_digest(
+        bearer, f"Bearer {METRICS_TOKEN}".encode()
+    )
+    if not scraper and admin_claims(request) is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return PlainTextResponse(
+        registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -42,6 +42,9 @@ import { useToast } from "@/hooks/use-toast";
 import { authService } from "@/service/auth/auth.service";
 import { useRouter } from "next/navigation";
 import { adminService } from "@/service/admin/admin.service";
+import { vendingService } from "@/service/vending/vending.service";
+import { ProductImage } from "@/components/product-image";
+import { ImageVariants } from "@/types/type";
 
 interface Product {
   id: string;
@@ -49,7 +52,10 @@ interface Product {
   price: number;
   stock: number;
   image: string;
+  image_variants?: ImageVariants;
   total_sold: number;
+  revenue?: number;
+  last_sold_at?: string | null;
 }
 
 interface ProductFormValues {
@@ -82,11 +88,25 @@ export default function AdminPage() {
   const [balance, setBalance] = useState<MoneyItem[]>([]);
   const [isBalanceDialogOpen, setIsBalanceDialogOpen] = useState(false);
   const [productToDelete, setProductToDelete] = useState<Product | null>(null);
-  const [preview, setPreview] = useState<string | null>(null);
+  const [preview, setPreview] = useState<Product | null>(null);
 
   useEffect(() => {
-    adminService.getProducts().then(setProducts);
-    adminService.getBalance().then(setBalance);
+    const refresh = () => {
+      adminService.getProducts().then(setProducts);
+      adminService.getBalance().then(setBalance);
+    };
+    refresh();
+
+    // A purchase sends several events at once; re-read once per burst.
+    let timer: ReturnType<typeof setTimeout> | undefined;
+    const unsubscribe = vendingService.subscribe(() => {
+      clearTimeout(timer);
+      timer = setTimeout(refresh, 300);
+    });
+    return () => {
+      clearTimeout(timer);
+      unsubscribe();
+    };
   }, []);
 
   const { toast } = useToast();
@@ -102,7 +122,8 @@ export default function AdminPage() {
 
   const getTotalRevenue = () => {
     return products.reduce(
-      (sum, product) => sum + (product.total_sold || 0) * product.price,
+      (sum, product) =>
+        sum + (product.revenue ?? (product.total_sold || 0) * product.price),
       0
     );
   };
@@ -512,21 +533,26 @@ export default function AdminPage() {
                   <TableRow key={product.id}>
                     <TableCell>
                       <div className="flex items-center gap-3">
-                        <img
-                          src={product.image}
+                        <ProductImage
+                          product={product}
+                          size="thumbnail"
                           alt={product.name}
                           className="w-20 h-20 object-contain cursor-pointer"
-                          onClick={() => setPreview(product.image)}
+                          onClick={() => setPreview(product)}
                         />
                         <Dialog
                           open={!!preview}
                           onOpenChange={() => setPreview(null)}
                         >
                           <DialogContent className="max-w-xl">
-                            <img
-                              src={preview || ""}
-                              className="w-full h-[400px] object-contain"
-                            />
+                            {preview && (
+                              <ProductImage
+                                product={preview}
+                                size="full"
+                                alt={preview.name}
+                                className="w-full h-[400px] object-contain"
+                              />
+                            )}
                           </DialogContent>
                         </Dialog>
 
@@ -545,7 +571,11 @@ export default function AdminPage() {
                     </TableCell>
                     <TableCell>{product.total_sold || 0}</TableCell>
                     <TableCell>
-                      ฿{((product.total_sold || 0) * product.price).toFixed(2)}
+                      ฿
+                      {(
+                        product.revenue ??
+                        (product.total_sold || 0) * product.price
+                      ).toFixed(2)}
                     </TableCell>
                     <TableCell className="text-right">
                       <div className="flex justify-end gap-2">
@@ -658,8 +688,9 @@ export default function AdminPage() {
               <Label htmlFor="edit-image">Image (optional)</Label>
               {editingProduct && (
                 <div className="w-full h-64 rounded-md border bg-muted flex items-center justify-center">
-                  <img
-                    src={editingProduct.image}
+                  <ProductImage
+                    product={editingProduct}
+                    size="full"
                     alt="current product"
                     className="w-full h-full object-contain"
                   />
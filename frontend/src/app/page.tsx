@@ -14,6 +14,7 @@ import { Coins, Banknote, Wallet } from "lucide-react";
 import { useToast } from "@/hooks/use-toast";
 import Link from "next/link";
 import { Product } from "@/types/type";
+import { ProductImage } from "@/components/product-image";
 import { vendingService } from "@/service/vending/vending.service";
 
 interface InsertedMoney {
@@ -67,6 +68,26 @@ export default function VendingMachinePage() {
       }
     };
     fetchProducts();
+
+    // Stock changes are patched in place; anything else (price, float,
+    // catalog edits, a missed event) is re-read, once per burst.
+    let timer: ReturnType<typeof setTimeout> | undefined;
+    const unsubscribe = vendingService.subscribe((event) => {
+      if (event.type === "stock" && event.product_id) {
+        setProducts((prev) =>
+          prev.map((p) =>
+            p.id === event.product_id ? { ...p, stock: event.stock ?? p.stock } : p
+          )
+        );
+      } else {
+        clearTimeout(timer);
+        timer = setTimeout(fetchProducts, 300);
+      }
+    });
+    return () => {
+      clearTimeout(timer);
+      unsubscribe();
+    };
   }, []);
 
   const buyProduct = async (id: string) => {
@@ -230,8 +251,9 @@ Change: ${response.change_amount} ฿
   `}
                       >
                         <div className="relative h-28 w-full bg-white/90 flex items-center justify-center">
-                          <img
-                            src={`${product.image}`}
+                          <ProductImage
+                            product={product}
+                            size="tile"
                             alt={product.name}
                             className="max-h-full max-w-full object-contain p-2"
                           />
@@ -251,6 +273,15 @@ Change: ${response.change_amount} ฿
                           <p className="text-xs text-slate-400">
                             Stock: {product.stock}
                           </p>
+                          {product.stock > 0 && product.exact_change_only ? (
+                            <p className="text-xs text-amber-400">
+                              Exact change only
+                            </p>
+                          ) : product.stock > 0 && product.max_accepted_note ? (
+                            <p className="text-xs text-slate-400">
+                              Up to {product.max_accepted_note} ฿ notes
+                            </p>
+                          ) : null}
                         </div>
                       </Card>
                     </button>
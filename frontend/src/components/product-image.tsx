@@ -0,0 +1,53 @@
+"use client";
+
+import { useState } from "react";
+import { ImageSize, Product } from "@/types/type";
+
+type ProductImageProps = {
+  product: Pick<Product, "image" | "image_variants">;
+  size: ImageSize;
+  alt: string;
+  className?: string;
+  onClick?: () => void;
+};
+
+// The resized WebP (PNG where WebP isn't supported) for `size`, or the
+// original upload while the server is still rendering the variants.
+export function ProductImage({
+  product,
+  size,
+  alt,
+  className,
+  onClick,
+}: ProductImageProps) {
+  const [failed, setFailed] = useState<string | null>(null);
+  const variant = product.image_variants?.[size];
+
+  if (!variant || failed === product.image) {
+    return (
+      <img
+        src={product.image}
+        alt={alt}
+        className={className}
+        onClick={onClick}
+        loading="lazy"
+        decoding="async"
+      />
+    );
+  }
+
+  return (
+    <picture className="contents">
+      <source type="image/webp" srcSet={variant.webp} />
+      <img
+        src={variant.png}
+        alt={alt}
+        className={className}
+        onClick={onClick}
+        loading="lazy"
+        decoding="async"
+        onError={() => setFailed(product.image)}
+      />
+    </picture>
+  );
+}
@@ -1,31 +1,34 @@
 import { api } from "@/lib/axios";
 import { MoneyItem } from "@/types/type";
+import { machineService } from "@/service/machine/machine.service";
 
 const prefix = "/admin";
+const machine = async () =>
+  `${prefix}/machines/${await machineService.getMachineId()}`;
 
 export const adminService = {
   getProducts: async () => {
-    const response = await api.get(`${prefix}/products`);
+    const response = await api.get(`${await machine()}/products`);
     return response.data;
   },
   addProduct: async (formData: FormData) => {
-    const response = await api.post(`${prefix}/products`, formData);
+    const response = await api.post(`${await machine()}/products`, formData);
     return response.data;
   },
   updateProduct: async (id: string, formData: FormData) => {
-    const response = await api.put(`${prefix}/products/${id}`, formData);
+    const response = await api.put(`${await machine()}/products/${id}`, formData);
     return response.data;
   },
   deleteProduct: async (id: string) => {
-    const response = await api.delete(`${prefix}/products/${id}`);
+    const response = await api.delete(`${await machine()}/products/${id}`);
     return response.data;
   },
   getBalance: async (): Promise<MoneyItem[]> => {
-    const response = await api.get(`${prefix}/balance`);
+    const response = await api.get(`${await machine()}/balance`);
     return response.data;
   },
   setBalance: async (balance: MoneyItem[]): Promise<MoneyItem[]> => {
-    const response = await api.put(`${prefix}/balance`, balance);
+    const response = await api.put(`${await machine()}/balance`, balance);
     return response.data;
   },
   getSellHistory: async () => {
@@ -0,0 +1,19 @@
+import { api } from "@/lib/axios";
+
+// The machine this kiosk/admin page works on: NEXT_PUBLIC_MACHINE_ID, or the
+// first machine the API lists.
+let machineId: Promise<string> | null = null;
+
+export const machineService = {
+  getMachineId: (): Promise<string> => {
+    if (!machineId) {
+      machineId = process.env.NEXT_PUBLIC_MACHINE_ID
+        ? Promise.resolve(process.env.NEXT_PUBLIC_MACHINE_ID)
+        : api.get("/vending/machines").then((response) => response.data[0].id);
+      machineId.catch(() => {
+        machineId = null;
+      });
+    }
+    return machineId;
+  },
+};
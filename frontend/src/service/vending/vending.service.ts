@@ -1,19 +1,57 @@
 import { api } from "@/lib/axios";
+import { machineService } from "@/service/machine/machine.service";
+
+const prefix = async () =>
+  `/vending/machines/${await machineService.getMachineId()}`;
+
+export type MachineEvent = {
+  type: "stock" | "balance" | "product" | "catalog" | "resync";
+  product_id?: string;
+  stock?: number;
+  [field: string]: unknown;
+};
 
-const prefix = "/vending";
 export const vendingService = {
   getProducts: async () => {
-    const response = await api.get(`${prefix}/products`);
+    const response = await api.get(`${await prefix()}/products`);
     return response.data;
   },
   buyProduct: async (
     id: string,
-    inserted_money: { denomination: number; quantity: number }[]
+    inserted_money: { denomination: number; quantity: number }[],
+    // Reuse the same key when retrying one purchase, so it is made once.
+    idempotencyKey: string = crypto.randomUUID()
   ) => {
-    const response = await api.post(`${prefix}/buy/product`, {
-      product_id: id,
-      inserted_money: inserted_money,
-    });
+    const response = await api.post(
+      `${await prefix()}/buy/product`,
+      {
+        product_id: id,
+        inserted_money: inserted_money,
+      },
+      { headers: { "Idempotency-Key": idempotencyKey } }
+    );
     return response.data;
   },
+  // Server-sent stock, price and float changes for this machine. Returns a
+  // function that closes the stream; the browser reconnects on its own.
+  subscribe: (onEvent: (event: MachineEvent) => void) => {
+    let source: EventSource | null = null;
+    let closed = false;
+    const types = ["stock", "balance", "product", "catalog", "resync"] as const;
+
+    prefix().then((path) => {
+      if (closed) return;
+      source = new EventSource(`${api.defaults.baseURL}${path}/events`);
+      types.forEach((type) =>
+        source!.addEventListener(type, (e) =>
+          onEvent({ type, ...JSON.parse((e as MessageEvent).data) })
+        )
+      );
+    });
+
+    return () => {
+      closed = true;
+      source?.close();
+    };
+  },
 };
@@ -1,9 +1,18 @@
+export type ImageSize = "thumbnail" | "tile" | "full";
+
+export type ImageVariants = Partial<
+  Record<ImageSize, { webp: string; png: string }>
+>;
+
 export type Product = {
   id: string;
   image: string;
+  image_variants?: ImageVariants;
   name: string;
   price: number;
   stock: number;
+  exact_change_only?: boolean;
+  max_accepted_note?: number | null;
 };
 
 export type MoneyItem = {